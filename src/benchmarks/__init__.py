@@ -0,0 +1,4 @@
+"""
+Нагрузочные замеры приложений на локальных заменах PostgreSQL и MinIO.
+Запуск: python -m src.benchmarks --help
+"""
@@ -0,0 +1,210 @@
+import argparse
+import io
+import logging
+import sys
+import tempfile
+from pathlib import Path
+from typing import Awaitable, Callable
+
+import anyio
+import httpx
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+from src.benchmarks import runner
+from src.benchmarks.fakes import FakeObjectStore
+from src.config import get_settings
+from src.core import repositories, schemas
+from src.private.api.v1 import endpoints as private_endpoints
+from src.private.app import app as private_app
+from src.public.api.v1 import endpoints as public_endpoints
+from src.public.app import app as public_app
+from src.storages.postgres import Base, ObservablePool
+
+settings = get_settings()
+
+SCENARIOS = ('list', 'get', 'upload', 'put', 'delete')
+BASELINE_PATH = Path(Path(__file__).parent, 'baseline.json')
+
+
+def parse_args(argv: list[str] | None = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog='python -m src.benchmarks',
+                                     description='Замеры публичного и приватного приложений на локальной БД '
+                                                 'и хранилище объектов в памяти')
+    parser.add_argument('--db-url', help='БД для замеров, по умолчанию - временный файл SQLite (aiosqlite)')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='сценарии через запятую: %(default)s')
+    parser.add_argument('--concurrency', default='1,10,50', help='уровни конкурентности через запятую: %(default)s')
+    parser.add_argument('--requests', type=int, default=500, help='запросов на сценарий и уровень: %(default)s')
+    parser.add_argument('--memes', type=int, default=1000, help='мемов в БД перед замерами: %(default)s')
+    parser.add_argument('--payload-kb', type=int, default=32, help='размер загружаемого файла: %(default)s КБ')
+    parser.add_argument('--output', type=Path, help='куда сохранить замеры в JSON')
+    parser.add_argument('--baseline', type=Path, default=BASELINE_PATH, help='базовые замеры: %(default)s')
+    parser.add_argument('--save-baseline', action='store_true', help='записать замеры как базовые')
+    parser.add_argument('--tolerance', type=float, default=0.3,
+                        help='допустимое ухудшение относительно базовых замеров: %(default)s')
+    return parser.parse_args(argv)
+
+
+class _BenchMemeRepository(repositories.MemeRepository):
+    """Репозиторий мемов на БД замеров. Свой синглтон: репозиторий процесса не перенастраивается"""
+    _self = None
+
+
+class _BenchFileService(repositories.FileService):
+    """FileService на хранилище в памяти. Свой синглтон: FileService процесса остается на MinIO"""
+    _self = None
+
+    def __init__(self, store: FakeObjectStore = None):
+        if store is not None:
+            self.store = store
+
+    @property
+    def client(self) -> FakeObjectStore:
+        return self.store
+
+
+class Bench:
+    """
+    Приложения, подключенные к локальным заменам БД и хранилища, и сценарии запросов к ним.
+    Репозитории на engine и store подставляются в зависимости приложений (dependency_overrides), как в тестах
+    """
+
+    def __init__(self, engine: AsyncEngine, store: FakeObjectStore, payload_size: int):
+        self.engine = engine
+        self.store = store
+        self.payload_size = payload_size
+        self.meme_repo = _BenchMemeRepository(engine)
+        self.file_service = _BenchFileService(store)
+        for app, endpoints in ((public_app, public_endpoints), (private_app, private_endpoints)):
+            app.dependency_overrides[endpoints.get_meme_repo] = lambda: self.meme_repo
+            app.dependency_overrides[endpoints.get_file_service] = lambda: self.file_service
+        self.public = httpx.AsyncClient(transport=httpx.ASGITransport(app=public_app), base_url='http://public')
+        self.private = httpx.AsyncClient(transport=httpx.ASGITransport(app=private_app), base_url='http://private',
+                                         headers={'Authorization': f'Bearer {settings.web_private.API_KEY}'})
+        self.ids: list[int] = []
+        self._files: int = 0
+
+    def payload(self) -> bytes:
+        """Содержимое нового файла: каждый раз другое, чтобы загрузка не сводилась к дедупликации"""
+        self._files += 1
+        return self._files.to_bytes(8, 'big') * (self.payload_size // 8)
+
+    async def seed(self, qty: int) -> list[int]:
+        """Создает qty мемов с файлами и возвращает их id"""
+        memes: list[schemas.MemeEnriched] = []
+        for index in range(qty):
+            data: bytes = self.payload()
+            etag, key = await self.file_service.upload_file(
+                _UploadFile(data, filename=f'{index}.png', content_type='image/png')
+            )
+            memes.append(schemas.MemeEnriched(title=f'meme {index}', content=f'content {index}', etag=etag, file_key=key))
+        created: list[schemas.Meme] = []
+        for start in range(0, qty, settings.web_app.BATCH_MAX_SIZE):
+            created.extend(await self.meme_repo.create_memes(memes[start:start + settings.web_app.BATCH_MAX_SIZE]))
+        return [meme.id for meme in created]
+
+    async def scenario(self, name: str, requests: int) -> Callable[[int], Awaitable[bool]]:
+        """Готовит данные сценария и возвращает функцию одного запроса"""
+        if name == 'list':
+            async def request(index: int) -> bool:
+                return (await self.public.get('/api/v1/memes', params={'size': 50})).status_code == 200
+        elif name == 'get':
+            async def request(index: int) -> bool:
+                meme_id: int = self.ids[index % len(self.ids)]
+                return (await self.public.get(f'/api/v1/memes/{meme_id}')).status_code == 200
+        elif name == 'upload':
+            async def request(index: int) -> bool:
+                response = await self.public.post('/api/v1/memes/',
+                                                  params={'title': f'upload {index}', 'content': 'benchmark'},
+                                                  files={'file': (f'{index}.png', self.payload(), 'image/png')})
+                return response.status_code == 200
+        elif name == 'put':
+            ids: list[int] = await self.seed(requests)
+
+            async def request(index: int) -> bool:
+                response = await self.private.put(f'/api/v1/memes/{ids[index]}',
+                                                  params={'title': f'put {index}', 'content': 'benchmark'},
+                                                  files={'file': (f'{index}.png', self.payload(), 'image/png')})
+                return response.status_code == 200
+        elif name == 'delete':
+            ids: list[int] = await self.seed(requests)
+
+            async def request(index: int) -> bool:
+                return (await self.private.delete(f'/api/v1/memes/{ids[index]}')).status_code == 200
+        else:
+            raise ValueError(f'Unknown scenario {name}')
+        return request
+
+    async def aclose(self) -> None:
+        await self.public.aclose()
+        await self.private.aclose()
+        await self.engine.dispose()
+        for app, endpoints in ((public_app, public_endpoints), (private_app, private_endpoints)):
+            app.dependency_overrides.pop(endpoints.get_meme_repo, None)
+            app.dependency_overrides.pop(endpoints.get_file_service, None)
+
+
+class _UploadFile:
+    """Файл запроса для FileService.upload_file при наполнении БД в обход HTTP"""
+
+    def __init__(self, data: bytes, filename: str, content_type: str):
+        self.file = io.BytesIO(data)
+        self.filename = filename
+        self.content_type = content_type
+        self.size = len(data)
+
+    async def seek(self, offset: int) -> None:
+        self.file.seek(offset)
+
+
+async def run(args: argparse.Namespace) -> list[runner.Result]:
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_url: str = args.db_url or f'sqlite+aiosqlite:///{tmp_dir}/benchmarks.db'
+        sqlite: bool = db_url.startswith('sqlite')
+        # SQLite пишет по одному соединению за раз, а конкурирующие соединения ждут блокировку файла БД сном
+        # с нарастающими интервалами - это шум, а не свойство приложения. С одним соединением запросы честно
+        # стоят в очереди пула, как в src/tests/conftest.py
+        engine: AsyncEngine = create_async_engine(db_url,
+                                                  poolclass=ObservablePool,
+                                                  pool_size=1 if sqlite else settings.pg.POOL_SIZE,
+                                                  max_overflow=0 if sqlite else settings.pg.MAX_OVERFLOW,
+                                                  pool_timeout=settings.pg.POOL_TIMEOUT)
+        async with engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+        bench = Bench(engine, FakeObjectStore(), payload_size=args.payload_kb * 1024)
+        try:
+            bench.ids = await bench.seed(args.memes)
+            results: list[runner.Result] = []
+            for name in args.scenarios.split(','):
+                for concurrency in map(int, args.concurrency.split(',')):
+                    request = await bench.scenario(name, args.requests)
+                    results.append(await runner.measure(name, request, args.requests, concurrency))
+                    print(runner.report(results[-1:]).splitlines()[-1], file=sys.stderr)
+        finally:
+            await bench.aclose()
+    return results
+
+
+def main(argv: list[str] | None = None) -> int:
+    logging.basicConfig(level=logging.WARNING)
+    args = parse_args(argv)
+    results: list[runner.Result] = anyio.run(run, args)
+    print(runner.report(results))
+    if args.output:
+        runner.save(results, args.output)
+    if args.save_baseline:
+        runner.save(results, args.baseline)
+        print(f'Baseline saved to {args.baseline}')
+        return 0
+    if not args.baseline.exists():
+        print(f'No baseline at {args.baseline}, nothing to compare with')
+        return 0
+    regressions: list[str] = runner.compare(results, args.baseline, args.tolerance)
+    if regressions:
+        print('\nPERFORMANCE REGRESSION against ' + str(args.baseline) + ':\n  ' + '\n  '.join(regressions))
+        return 1
+    print(f'No regressions against {args.baseline} (tolerance {args.tolerance:.0%})')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
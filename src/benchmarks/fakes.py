@@ -0,0 +1,147 @@
+import hashlib
+import io
+import threading
+import uuid
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import BinaryIO, Iterable
+
+from minio import Minio, error
+from minio.deleteobjects import DeleteError, DeleteObject
+
+from src.config import get_settings
+
+settings = get_settings()
+
+
+class _Response(io.BytesIO):
+    """Ответ get_object: файловый объект с методами освобождения соединения, как у urllib3"""
+
+    def stream(self, amt: int = 64 * 1024):
+        while chunk := self.read(amt):
+            yield chunk
+
+    def release_conn(self) -> None:
+        ...
+
+
+class FakeObjectStore:
+    """
+    Хранилище объектов в памяти процесса с интерфейсом клиента MinIO в объеме, который использует FileService.
+    Ссылки подписываются настоящим клиентом MinIO: подпись - локальная работа, и ее стоимость входит в замеры.
+    """
+
+    def __init__(self):
+        self._objects: dict[str, tuple[bytes, str]] = {}
+        # незавершенные multipart-загрузки: идентификатор -> (ключ, тип содержимого, части по номерам)
+        self._uploads: dict[str, tuple[str, str, dict[int, bytes]]] = {}
+        self._lock = threading.Lock()
+        self._signer = Minio(endpoint=settings.minio.uri,
+                             access_key=settings.minio.ROOT_USER,
+                             secret_key=settings.minio.ROOT_PASSWORD,
+                             secure=settings.minio.SECURE,
+                             region=settings.minio.REGION)
+
+    @staticmethod
+    def _not_found(key: str) -> error.S3Error:
+        return error.S3Error(code='NoSuchKey', message='Object does not exist', resource=key,
+                             request_id=None, host_id=None, response=None)
+
+    @staticmethod
+    def _etag(data: bytes) -> str:
+        return hashlib.md5(data).hexdigest()
+
+    def put_object(self, bucket: str, key: str, data: BinaryIO, length: int,
+                   content_type: str = 'application/octet-stream', part_size: int = 0, **kwargs):
+        content: bytes = data.read() if length < 0 else data.read(length)
+        with self._lock:
+            self._objects[key] = (content, content_type)
+        return SimpleNamespace(bucket_name=bucket, object_name=key, etag=self._etag(content))
+
+    def stat_object(self, bucket: str, key: str, **kwargs):
+        with self._lock:
+            if key not in self._objects:
+                raise self._not_found(key)
+            content, content_type = self._objects[key]
+        return SimpleNamespace(bucket_name=bucket, object_name=key, etag=self._etag(content), size=len(content),
+                               content_type=content_type, last_modified=datetime.now(timezone.utc))
+
+    def get_object(self, bucket: str, key: str, offset: int = 0, length: int = 0, **kwargs) -> _Response:
+        with self._lock:
+            if key not in self._objects:
+                raise self._not_found(key)
+            content, _ = self._objects[key]
+        return _Response(content[offset:offset + length] if length else content[offset:])
+
+    def copy_object(self, bucket: str, key: str, source, **kwargs):
+        with self._lock:
+            if source.object_name not in self._objects:
+                raise self._not_found(source.object_name)
+            self._objects[key] = self._objects[source.object_name]
+            content, _ = self._objects[key]
+        return SimpleNamespace(bucket_name=bucket, object_name=key, etag=self._etag(content))
+
+    def remove_object(self, bucket: str, key: str, **kwargs) -> None:
+        with self._lock:
+            self._objects.pop(key, None)
+
+    def remove_objects(self, bucket: str, delete_object_list: Iterable[DeleteObject], **kwargs) -> Iterable[DeleteError]:
+        with self._lock:
+            for delete_object in delete_object_list:
+                self._objects.pop(delete_object.name, None)
+        return iter(())
+
+    def list_objects(self, bucket: str, prefix: str | None = None, recursive: bool = False, **kwargs):
+        with self._lock:
+            keys: list[str] = [key for key in self._objects if key.startswith(prefix or '')]
+        return [SimpleNamespace(object_name=key, last_modified=datetime.now(timezone.utc)) for key in keys]
+
+    @staticmethod
+    def _no_upload(key: str) -> error.S3Error:
+        return error.S3Error(code='NoSuchUpload', message='Upload does not exist', resource=key,
+                             request_id=None, host_id=None, response=None)
+
+    def _create_multipart_upload(self, bucket: str, key: str, headers: dict) -> str:
+        upload_id: str = uuid.uuid4().hex
+        with self._lock:
+            self._uploads[upload_id] = (key, headers.get('Content-Type', 'application/octet-stream'), {})
+        return upload_id
+
+    def _upload_part(self, bucket: str, key: str, data: bytes, headers: dict | None,
+                     upload_id: str, part_number: int) -> str:
+        with self._lock:
+            if upload_id not in self._uploads:
+                raise self._no_upload(key)
+            self._uploads[upload_id][2][part_number] = data
+        return self._etag(data)
+
+    def _complete_multipart_upload(self, bucket: str, key: str, upload_id: str, parts: list, **kwargs):
+        with self._lock:
+            if upload_id not in self._uploads:
+                raise self._no_upload(key)
+            _, content_type, uploaded = self._uploads[upload_id]
+            if any(uploaded.get(part.part_number) is None
+                   or self._etag(uploaded[part.part_number]) != part.etag for part in parts):
+                raise error.S3Error(code='InvalidPart', message='Part is missing or its etag differs', resource=key,
+                                    request_id=None, host_id=None, response=None)
+            del self._uploads[upload_id]
+            content: bytes = b''.join(uploaded[part.part_number] for part in parts)
+            self._objects[key] = (content, content_type)
+        return SimpleNamespace(bucket_name=bucket, object_name=key, etag=self._etag(content))
+
+    def _abort_multipart_upload(self, bucket: str, key: str, upload_id: str) -> None:
+        with self._lock:
+            if self._uploads.pop(upload_id, None) is None:
+                raise self._no_upload(key)
+
+    def presigned_get_object(self, bucket: str, key: str, **kwargs) -> str:
+        return self._signer.presigned_get_object(bucket, key, **kwargs)
+
+    def presigned_post_policy(self, policy) -> dict[str, str]:
+        return self._signer.presigned_post_policy(policy)
+
+    def bucket_exists(self, bucket: str) -> bool:
+        return True
+
+    def make_bucket(self, bucket: str, **kwargs) -> None:
+        ...
@@ -0,0 +1,115 @@
+import json
+import resource
+import statistics
+import sys
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Awaitable, Callable
+
+import anyio
+
+
+@dataclass
+class Result:
+    """Итог одного сценария на одном уровне конкурентности"""
+    scenario: str
+    concurrency: int
+    requests: int
+    errors: int
+    p50_ms: float
+    p99_ms: float
+    rps: float
+    cpu_ms: float  # процессорное время процесса на запрос, вместе с клиентом замеров
+    peak_rss_mb: float
+
+    @property
+    def name(self) -> str:
+        return f'{self.scenario}@{self.concurrency}'
+
+
+def peak_rss_mb() -> float:
+    """Пиковый RSS процесса с его запуска. ru_maxrss - в килобайтах в Linux и в байтах в macOS"""
+    peak: int = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == 'darwin' else peak / 1024
+
+
+def percentile(latencies: list[float], q: float) -> float:
+    if len(latencies) < 2:
+        return latencies[0] if latencies else 0.0
+    return statistics.quantiles(latencies, n=100, method='inclusive')[int(q) - 1]
+
+
+async def measure(scenario: str,
+                  request: Callable[[int], Awaitable[bool]],
+                  requests: int,
+                  concurrency: int) -> Result:
+    """
+    Выполняет request(i) для i от 0 до requests - 1, держа в работе не больше concurrency запросов.
+    request возвращает False, если ответ не тот, что ожидался.
+    """
+    latencies: list[float] = []
+    errors: int = 0
+    indexes = iter(range(requests))
+
+    async def worker() -> None:
+        nonlocal errors
+        for index in indexes:
+            start: float = time.perf_counter()
+            ok: bool = await request(index)
+            latencies.append(time.perf_counter() - start)
+            errors += not ok
+
+    started: float = time.perf_counter()
+    cpu_started: float = time.process_time()
+    async with anyio.create_task_group() as task_group:
+        for _ in range(concurrency):
+            task_group.start_soon(worker)
+    elapsed: float = time.perf_counter() - started
+    cpu: float = time.process_time() - cpu_started
+    return Result(scenario=scenario,
+                  concurrency=concurrency,
+                  requests=requests,
+                  errors=errors,
+                  p50_ms=round(percentile(latencies, 50) * 1000, 3),
+                  p99_ms=round(percentile(latencies, 99) * 1000, 3),
+                  rps=round(requests / elapsed, 1),
+                  cpu_ms=round(cpu / requests * 1000, 3),
+                  peak_rss_mb=round(peak_rss_mb(), 1))
+
+
+def save(results: list[Result], path: Path) -> None:
+    path.write_text(json.dumps({result.name: asdict(result) for result in results}, indent=2, sort_keys=True) + '\n')
+
+
+def compare(results: list[Result], baseline_path: Path, tolerance: float) -> list[str]:
+    """
+    Сравнивает замеры с базовыми. Регрессия - ошибки в ответах, p99, процессорное время на запрос или пиковый RSS
+    больше базового больше чем на tolerance, RPS меньше базового больше чем на tolerance. Возвращает описания регрессий.
+    """
+    baseline: dict = json.loads(baseline_path.read_text())
+    regressions: list[str] = []
+    for result in results:
+        if result.errors:
+            regressions.append(f'{result.name}: {result.errors} failed requests')
+        base: dict | None = baseline.get(result.name)
+        if base is None:
+            continue
+        if result.p99_ms > base['p99_ms'] * (1 + tolerance):
+            regressions.append(f"{result.name}: p99 {result.p99_ms}ms > baseline {base['p99_ms']}ms")
+        if result.rps < base['rps'] * (1 - tolerance):
+            regressions.append(f"{result.name}: {result.rps} rps < baseline {base['rps']} rps")
+        if 'cpu_ms' in base and result.cpu_ms > base['cpu_ms'] * (1 + tolerance):
+            regressions.append(f"{result.name}: CPU {result.cpu_ms}ms/request > baseline {base['cpu_ms']}ms/request")
+        if result.peak_rss_mb > base['peak_rss_mb'] * (1 + tolerance):
+            regressions.append(f"{result.name}: peak RSS {result.peak_rss_mb}MB > baseline {base['peak_rss_mb']}MB")
+    return regressions
+
+
+def report(results: list[Result]) -> str:
+    header: str = f"{'scenario':<16}{'requests':>10}{'errors':>8}{'p50, ms':>10}{'p99, ms':>10}{'rps':>10}{'cpu, ms':>10}{'rss, MB':>10}"
+    lines: list[str] = [header, '-' * len(header)]
+    for result in results:
+        lines.append(f'{result.name:<16}{result.requests:>10}{result.errors:>8}{result.p50_ms:>10}'
+                     f'{result.p99_ms:>10}{result.rps:>10}{result.cpu_ms:>10}{result.peak_rss_mb:>10}')
+    return '\n'.join(lines)
@@ -1,7 +1,8 @@
 from functools import lru_cache
 from pathlib import Path
-from typing import Dict
+from typing import Dict, Literal
 
+from pydantic import Field
 from pydantic_settings import BaseSettings
 
 
@@ -19,6 +20,14 @@ class PostgresSettings(BaseConfig):
     USER: str
     PASSWORD: str
     DRIVER: str
+    POOL_SIZE: int = 5
+    MAX_OVERFLOW: int = 10
+    POOL_TIMEOUT: float = 30
+    POOL_RECYCLE: int = 1800
+    ECHO: bool = False
+    REPLICA_URIS: list[str] = []  # DSN реплик для чтения, в окружении - JSON-список
+    REPLICA_CHECK_INTERVAL: float = 5
+    REPLICA_CHECK_TIMEOUT: float = 2
 
     @property
     def uri(self):
@@ -30,14 +39,35 @@ class PostgresSettings(BaseConfig):
 
 class WebAppSettings(BaseConfig):
     HEALTHCHECK_PATH: str
+    STATS_PATH: str = '/stats'
+    STARTUP_TIMEOUT: float = 10
+    MEME_CACHE_CONTROL: str = 'public, max-age=60'
+    MEMES_CACHE_CONTROL: str = 'public, max-age=10'
+    BATCH_MAX_SIZE: int = 100
+    BATCH_CONCURRENCY: int = 8
+    FILE_CACHE_CONTROL: str = 'public, max-age=60'
     PORT: int
 
     class Config(BaseConfig.Config):
         env_prefix = 'WEB_APP_'
 
 
+class WebServerSettings(BaseConfig):
+    WORKERS: int = 0  # 0 - по числу ядер
+    TIMEOUT: int = 60
+    GRACEFUL_TIMEOUT: int = 60
+    KEEPALIVE: int = 5
+    MAX_REQUESTS: int = 10000
+    MAX_REQUESTS_JITTER: int = 1000
+    MAX_WORKER_RSS_MB: int = 512  # 0 - без ограничения
+
+    class Config(BaseConfig.Config):
+        env_prefix = 'WEB_SERVER_'
+
+
 class WebPrivateAppSettings(BaseConfig):
     API_KEY: str
+    BULK_DELETE_MAX_SIZE: int = 1000  # id в одном запросе массового удаления
 
     class Config(BaseConfig.Config):
         env_prefix = 'WEB_PRIVATE_APP_'
@@ -51,6 +81,16 @@ class MinioSettings(BaseConfig):
     ROOT_PASSWORD: str
     STORAGE_BUCKET: str
     SECURE: bool
+    MAX_CONNECTIONS: int = 10
+    MAX_STREAMS: int = 5  # одновременных скачиваний через приложение, каждое держит соединение пула
+    CONNECT_TIMEOUT: float = 5
+    READ_TIMEOUT: float = 60
+    RETRIES: int = 3
+    PART_SIZE: int = 5 * 1024 * 1024
+    MAX_UPLOAD_SIZE: int = 20 * 1024 * 1024
+    REGION: str = 'us-east-1'
+    URL_EXPIRES: int = 2 * 60 * 60
+    URL_CACHE_SIZE: int = 10000
 
     @property
     def uri(self):
@@ -60,19 +100,110 @@ class MinioSettings(BaseConfig):
         env_prefix = 'MINIO_'
 
 
+class StorageSettings(BaseConfig):
+    """Хранилище файлов: minio или local - каталог на локальном диске для однонодовых установок"""
+    BACKEND: Literal['minio', 'local'] = 'minio'
+    LOCAL_PATH: str = './data/files'
+    LOCAL_URL_SECRET: str = ''  # ключ подписи ссылок на файлы, обязателен для local
+    LOCAL_URL_PATH: str = '/api/v1/files'  # маршрут публичного приложения, отдающий файлы по ссылкам
+
+    class Config(BaseConfig.Config):
+        env_prefix = 'STORAGE_'
+
+
+class MemeCacheSettings(BaseConfig):
+    SIZE: int = 10000
+    TTL: float = 300
+    CHANNEL: str = 'memes_changed'
+    RECONNECT_DELAY: float = 5
+
+    class Config(BaseConfig.Config):
+        env_prefix = 'MEME_CACHE_'
+
+
+class DerivativesSettings(BaseConfig):
+    ENABLED: bool = False
+    SIZES: list[int] = [320]
+    FORMATS: list[str] = ['webp']
+    QUALITY: int = 80
+    WORKERS: int = 2
+
+    class Config(BaseConfig.Config):
+        env_prefix = 'DERIVATIVES_'
+
+
+class JobsSettings(BaseConfig):
+    CONCURRENCY: int = 4
+    POLL_INTERVAL: float = 1
+    LEASE: int = 300
+    MAX_ATTEMPTS: int = 3
+
+    class Config(BaseConfig.Config):
+        env_prefix = 'JOBS_'
+
+
+class UploadSettings(BaseConfig):
+    """Загрузка файлов по частям (multipart). Части, кроме последней, не меньше 5 МБ - ограничение S3"""
+    MAX_PART_SIZE: int = 8 * 1024 * 1024
+    TTL: int = 24 * 60 * 60  # незавершенные загрузки удаляются после TTL секунд без новых частей
+    CLEANUP_INTERVAL: float = 600
+    DIRECT_URL_EXPIRES: int = 15 * 60  # срок действия политики загрузки прямо в хранилище
+
+    class Config(BaseConfig.Config):
+        env_prefix = 'UPLOAD_'
+
+
+class AdmissionSettings(BaseConfig):
+    """
+    Ограничение одновременных дорогих запросов (загрузки, запись) по группам маршрутов, в каждом процессе воркера.
+    Группы вместе занимают не больше соединений пула БД, чем POSTGRES_POOL_SIZE + POSTGRES_MAX_OVERFLOW
+    за вычетом READ_RESERVED: эти соединения остаются чтению
+    """
+    ENABLED: bool = True
+    LIMITS: dict[str, int] = {'upload': 4, 'write': 6}  # в окружении - JSON-объект
+    QUEUE_SIZE: int = 16  # ожидающих запросов на группу, сверх этого - сразу 503
+    QUEUE_TIMEOUT: float = 1
+    READ_RESERVED: int = 5
+    RETRY_AFTER: int = 1
+
+    class Config(BaseConfig.Config):
+        env_prefix = 'ADMISSION_'
+
+
+class MetricsSettings(BaseConfig):
+    ENABLED: bool = True
+    TRACING: bool = False
+    PATH: str = '/metrics'
+
+    class Config(BaseConfig.Config):
+        env_prefix = 'METRICS_'
+
+
 class ProjectSettings(BaseSettings):
-    pg: PostgresSettings = PostgresSettings()
-    web_app: WebAppSettings = WebAppSettings()
-    web_private: WebPrivateAppSettings = WebPrivateAppSettings()
-    minio: MinioSettings = MinioSettings()
-    connection_config: Dict = {
-        'driver': pg.DRIVER,
-        'database': pg.DB,
-        'host': pg.HOST,
-        'user': pg.USER,
-        'password': pg.PASSWORD,
-        'port': pg.PORT,
-    }
+    """Настройки читаются из окружения при создании ProjectSettings (см. get_settings), а не при импорте модуля"""
+    pg: PostgresSettings = Field(default_factory=PostgresSettings)
+    web_app: WebAppSettings = Field(default_factory=WebAppSettings)
+    web_private: WebPrivateAppSettings = Field(default_factory=WebPrivateAppSettings)
+    web_server: WebServerSettings = Field(default_factory=WebServerSettings)
+    minio: MinioSettings = Field(default_factory=MinioSettings)
+    storage: StorageSettings = Field(default_factory=StorageSettings)
+    meme_cache: MemeCacheSettings = Field(default_factory=MemeCacheSettings)
+    derivatives: DerivativesSettings = Field(default_factory=DerivativesSettings)
+    jobs: JobsSettings = Field(default_factory=JobsSettings)
+    uploads: UploadSettings = Field(default_factory=UploadSettings)
+    admission: AdmissionSettings = Field(default_factory=AdmissionSettings)
+    metrics: MetricsSettings = Field(default_factory=MetricsSettings)
+
+    @property
+    def connection_config(self) -> Dict:
+        return {
+            'driver': self.pg.DRIVER,
+            'database': self.pg.DB,
+            'host': self.pg.HOST,
+            'user': self.pg.USER,
+            'password': self.pg.PASSWORD,
+            'port': self.pg.PORT,
+        }
 
 
 @lru_cache()
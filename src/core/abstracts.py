@@ -30,6 +30,10 @@ class AbstractDBRepo(AbstractRepo):
     schema: pydantic.BaseModel
     _model: models.Base
 
+    @abstractmethod
+    def ping(self):
+        """Проверяет соединение с БД"""
+
 
 class AbstractMemeDbRepo(AbstractDBRepo):
     """Интерфейс абстрактного репозитория, отвечающего за отдачу мемов из БД"""
@@ -40,12 +44,32 @@ class AbstractMemeDbRepo(AbstractDBRepo):
 
     @abstractmethod
     def delete_meme_by_id(self, id: int):
-        """Удаляет мем по его id"""
+        """Удаляет мем по его id, возвращает его файл с ключами копий, если файл больше не используется"""
+
+    @abstractmethod
+    def delete_memes(self, ids: list[int] | None = None, **filters):
+        """Удаляет мемы по списку id и/или фильтру"""
 
     @abstractmethod
     def get_memes(self, as_qs: bool = False):
         """Возвращает мем по его id"""
 
+    @abstractmethod
+    def create_memes(self, memes: list):
+        """Создает несколько мемов за одну запись в БД"""
+
+    @abstractmethod
+    def search_memes(self, query: str, after: tuple[float, int] | None = None, limit: int = 50):
+        """Ищет мемы по тексту, возвращает их с релевантностью"""
+
+    @abstractmethod
+    def set_variants(self, id: int, file_key: str, variants: dict[str, str]):
+        """Записывает в мем уменьшенные копии его файла"""
+
+    @abstractmethod
+    def reap_files(self, keys: list[str], remove):
+        """Удаляет из хранилища функцией remove файлы, на которые по-прежнему никто не ссылается"""
+
     @abstractmethod
     class DBConstrainException:
         """Поднимается, когда запись в БД невозможна по причинам, зависящим от БД"""
@@ -57,6 +81,30 @@ class AbstractFileRepo(AbstractRepo):
     client: Any
     bucket: str
 
+    @abstractmethod
+    def ensure_bucket(self):
+        """Создает хранилище файлов, если его нет"""
+
     @abstractmethod
     def get_file_by_id(self, id):
         """Возвращает файл по его id"""
+
+    @abstractmethod
+    def get_url(self, key: str) -> str:
+        """Возвращает ссылку на скачивание файла по его ключу"""
+
+    @abstractmethod
+    def derivative_key(self, key: str, name: str) -> str:
+        """Возвращает ключ производной копии name файла key"""
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        """Есть ли файл в хранилище"""
+
+    @abstractmethod
+    def get_bytes(self, key: str) -> bytes:
+        """Возвращает содержимое файла целиком"""
+
+    @abstractmethod
+    def put_bytes(self, key: str, data: bytes, content_type: str) -> str:
+        """Кладет содержимое в хранилище и возвращает etag"""
@@ -0,0 +1,165 @@
+"""
+Контроль допуска дорогих запросов. Маршрут относится к группе декоратором limited, группа ограничивает число
+одновременно выполняемых запросов и длину очереди ожидающих. Когда очередь полна или ожидание дольше
+settings.admission.QUEUE_TIMEOUT, запрос сразу получает 503 с Retry-After, не занимая соединения БД и хранилища.
+Допуск проверяется до чтения тела запроса. Ограничители свои в каждом процессе воркера и работают из одного
+цикла событий, поэтому обходятся без блокировок.
+"""
+import functools
+import logging
+from collections import deque
+from typing import Callable, TypeVar
+
+import anyio
+from fastapi import HTTPException
+from fastapi.routing import APIRoute
+from starlette.requests import Request
+from starlette.responses import Response
+
+from src.config import get_settings
+from src.core import metrics
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+F = TypeVar('F', bound=Callable)
+
+
+class Limiter:
+    """
+    Не больше limit одновременных запросов и не больше queue_size ожидающих. Освободившийся слот передается
+    первому в очереди, поэтому очередь обслуживается по порядку и новые запросы ее не обгоняют
+    """
+
+    def __init__(self, name: str, limit: int, queue_size: int, queue_timeout: float):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.in_flight: int = 0
+        self._waiters: deque[anyio.Event] = deque()
+        self.admitted: int = 0
+        self.rejected: int = 0
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def _reject(self, reason: str) -> None:
+        self.rejected += 1
+        metrics.ADMISSION_REJECTED.inc(self.name, reason)
+        raise self.OverloadedException
+
+    async def acquire(self) -> None:
+        """Занимает слот. Поднимает OverloadedException, если очередь полна или слот не освободился вовремя"""
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            return
+        if len(self._waiters) >= self.queue_size:
+            self._reject('queue_full')
+        event = anyio.Event()
+        self._waiters.append(event)
+        try:
+            with anyio.move_on_after(self.queue_timeout):
+                await event.wait()
+        except BaseException:
+            self._abandon(event)
+            raise
+        if not event.is_set():
+            self._abandon(event)
+            self._reject('timeout')
+        self.admitted += 1
+
+    def _abandon(self, event: anyio.Event) -> None:
+        """Запрос ушел из очереди: если слот ему уже передали, он переходит дальше"""
+        if event.is_set():
+            self.release()
+        else:
+            self._waiters.remove(event)
+
+    def release(self) -> None:
+        if self._waiters:
+            # слот переходит ожидающему, не освобождаясь: in_flight не меняется
+            self._waiters.popleft().set()
+            return
+        self.in_flight -= 1
+
+    def status(self) -> dict:
+        return {'limit': self.limit, 'queue_size': self.queue_size, 'in_flight': self.in_flight,
+                'waiting': self.waiting, 'admitted': self.admitted, 'rejected': self.rejected}
+
+    class OverloadedException(Exception):
+        message = "Server is busy, retry later"
+
+
+def enabled() -> bool:
+    return settings.admission.ENABLED
+
+
+@functools.cache
+def _limits() -> dict[str, int]:
+    """
+    Пределы групп из settings.admission.LIMITS. Если вместе они больше соединений пула БД за вычетом
+    settings.admission.READ_RESERVED, то пропорционально уменьшаются: зарезервированное остается чтению
+    """
+    limits: dict[str, int] = dict(settings.admission.LIMITS)
+    budget: int = settings.pg.POOL_SIZE + settings.pg.MAX_OVERFLOW - settings.admission.READ_RESERVED
+    total: int = sum(limits.values())
+    if total > budget:
+        limits = {group: max(1, limit * budget // total) for group, limit in limits.items()}
+        logger.warning('Admission limits %s exceed DB pool minus reserved for reads (%s), scaled to %s',
+                       settings.admission.LIMITS, budget, limits)
+    return limits
+
+
+@functools.cache
+def get_limiter(group: str) -> Limiter:
+    limiter = Limiter(group, _limits()[group], settings.admission.QUEUE_SIZE, settings.admission.QUEUE_TIMEOUT)
+    metrics.instrument_limiter(limiter)
+    return limiter
+
+
+def status() -> dict[str, dict]:
+    """Состояние ограничителей всех групп для /stats"""
+    if not enabled():
+        return {}
+    return {group: get_limiter(group).status() for group in _limits()}
+
+
+def limited(group: str) -> Callable[[F], F]:
+    """Относит обработчик маршрута к группе group. Работает с маршрутами роутера с route_class=AdmissionRoute"""
+    def decorator(endpoint: F) -> F:
+        endpoint.admission_group = group
+        return endpoint
+    return decorator
+
+
+class AdmissionRoute(APIRoute):
+    """
+    Маршрут, обработчик которого выполняется со слотом ограничителя своей группы. Слот занимается до разбора
+    тела запроса и освобождается, когда ответ готов. Маршруты без группы и групп без предела не ограничиваются
+    """
+
+    async def before_admission(self, request: Request) -> None:
+        """Проверки запроса до того, как он займет слот (например, аутентификация): отказ не ждет в очереди"""
+
+    def get_route_handler(self) -> Callable:
+        handler: Callable = super().get_route_handler()
+        group: str | None = getattr(self.endpoint, 'admission_group', None)
+        if not enabled() or group not in _limits():
+            return handler
+        limiter: Limiter = get_limiter(group)
+
+        async def admitted_handler(request: Request) -> Response:
+            await self.before_admission(request)
+            try:
+                await limiter.acquire()
+            except limiter.OverloadedException as _e:
+                raise HTTPException(status_code=503, detail=_e.message,
+                                    headers={'Retry-After': str(settings.admission.RETRY_AFTER)})
+            try:
+                return await handler(request)
+            finally:
+                limiter.release()
+        return admitted_handler
@@ -0,0 +1,21 @@
+"""
+Аутентификация администратора по ключу settings.web_private.API_KEY в заголовке Authorization: Bearer.
+Ключом закрыты приватный API и служебные маршруты обоих приложений (статистика и метрики).
+"""
+from fastapi import HTTPException, Security
+from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
+from starlette import status
+
+from src.config import get_settings
+
+security = HTTPBearer()
+settings = get_settings()
+
+
+def authenticate_admin(credentials: HTTPAuthorizationCredentials = Security(security)):
+    if not credentials.credentials == settings.web_private.API_KEY:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
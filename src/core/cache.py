@@ -0,0 +1,86 @@
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+
+class TTLCache:
+    """
+    Ограниченный по размеру LRU-кэш, записи которого живут не дольше ttl секунд.
+    Рассчитан на работу из одного цикла событий, поэтому без блокировок.
+    У каждого ключа есть поколение, которое меняется при его сбросе: значение, прочитанное до сброса,
+    кладется с поколением, взятым до чтения, и после сброса в кэш не попадает.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, timer: Callable[[], float] = time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._timer = timer
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        # поколение ключа - (эпоха, число его сбросов в этой эпохе), clear начинает новую эпоху
+        self._epoch: int = 0
+        self._generations: dict[Hashable, int] = {}
+        # кэш можно временно выключить, например, пока не работает межпроцессная инвалидация
+        self.active: bool = True
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self.invalidations: int = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.active and self.maxsize > 0 and self.ttl > 0
+
+    def get(self, key: Hashable) -> Any | None:
+        """Возвращает значение по ключу или None, если записи нет или она устарела"""
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires_at, value = entry
+        if expires_at <= self._timer():
+            del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def generation(self, key: Hashable) -> tuple[int, int]:
+        """Поколение ключа: берется до чтения значения из источника и передается в set"""
+        return self._epoch, self._generations.get(key, 0)
+
+    def set(self, key: Hashable, value: Any, generation: tuple[int, int] | None = None) -> None:
+        """Кладет значение, если ключ не сбрасывали с тех пор, как взято поколение generation"""
+        if not self.enabled or (generation is not None and generation != self.generation(key)):
+            return
+        self._data[key] = (self._timer() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key: Hashable) -> None:
+        self._generations[key] = self._generations.get(key, 0) + 1
+        if len(self._generations) > self.maxsize:
+            # счетчики сбросов не копятся без предела: новая эпоха меняет поколения всех ключей сразу
+            self._generations.clear()
+            self._epoch += 1
+        if self._data.pop(key, None) is not None:
+            self.invalidations += 1
+
+    def clear(self) -> None:
+        self._data.clear()
+        self._generations.clear()
+        self._epoch += 1
+
+    def stats(self) -> dict:
+        return {
+            'active': self.active,
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
@@ -0,0 +1,60 @@
+import logging
+
+import anyio
+import anyio.to_process
+
+from src.config import get_settings
+from src.core import imaging
+from src.core.abstracts import AbstractFileRepo, AbstractMemeDbRepo
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+_limiter: anyio.CapacityLimiter | None = None
+
+
+def _get_limiter() -> anyio.CapacityLimiter:
+    """Ограничитель числа процессов, одновременно обрабатывающих изображения"""
+    global _limiter
+    if _limiter is None:
+        _limiter = anyio.CapacityLimiter(settings.derivatives.WORKERS)
+    return _limiter
+
+
+def enabled() -> bool:
+    return settings.derivatives.ENABLED and imaging.available()
+
+
+async def create_derivatives(file_service: AbstractFileRepo, file_key: str) -> dict[str, str]:
+    """
+    Создает уменьшенные копии файла во всех настроенных размерах и форматах и кладет их в хранилище рядом
+    с оригиналом. Уже существующие копии (например, у файла, общего для нескольких мемов) не пересоздаются.
+    Возвращает словарь "<размер>.<формат>" -> ключ копии в хранилище.
+    """
+    variants: dict[str, str] = {}
+    original: bytes | None = None
+    for size in settings.derivatives.SIZES:
+        for fmt in settings.derivatives.FORMATS:
+            name: str = f'{size}.{fmt}'
+            variant_key: str = file_service.derivative_key(file_key, name)
+            if not await file_service.exists(variant_key):
+                if original is None:
+                    original = await file_service.get_bytes(file_key)
+                data: bytes = await anyio.to_process.run_sync(imaging.render, original, size, fmt,
+                                                              settings.derivatives.QUALITY,
+                                                              limiter=_get_limiter())
+                await file_service.put_bytes(variant_key, data, content_type=imaging.content_type(fmt))
+            variants[name] = variant_key
+    return variants
+
+
+async def process_meme(meme_id: int, file_key: str,
+                       meme_repo: AbstractMemeDbRepo, file_service: AbstractFileRepo) -> None:
+    """Фоновая задача после загрузки файла мема: строит уменьшенные копии и записывает их в мем"""
+    if not enabled():
+        return
+    try:
+        variants: dict[str, str] = await create_derivatives(file_service, file_key)
+        await meme_repo.set_variants(meme_id, file_key=file_key, variants=variants)
+    except Exception:  # noqa
+        logger.exception('Failed to build derivatives of meme %s', meme_id)
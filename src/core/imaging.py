@@ -0,0 +1,37 @@
+"""
+Обработка изображений. Функции модуля выполняются в процессах-воркерах, поэтому модуль не импортирует
+ни БД, ни хранилище, а Pillow - необязательная зависимость.
+"""
+import io
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pragma: no cover
+    Image = ImageOps = None
+
+CONTENT_TYPES: dict[str, str] = {
+    'webp': 'image/webp',
+    'avif': 'image/avif',
+    'jpeg': 'image/jpeg',
+    'png': 'image/png',
+}
+
+
+def available() -> bool:
+    return Image is not None
+
+
+def content_type(fmt: str) -> str:
+    return CONTENT_TYPES.get(fmt.lower(), 'application/octet-stream')
+
+
+def render(data: bytes, size: int, fmt: str, quality: int) -> bytes:
+    """Уменьшает изображение до вписывания в квадрат size x size и сохраняет в формате fmt"""
+    with Image.open(io.BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size))
+        if fmt.lower() == 'jpeg' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        output = io.BytesIO()
+        image.save(output, format=fmt.upper(), quality=quality)
+    return output.getvalue()
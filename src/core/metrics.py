@@ -0,0 +1,287 @@
+"""
+Метрики в текстовом формате Prometheus и, если установлен opentelemetry-api, спаны трассировки.
+Метрики пишутся только из потока цикла событий (обработчики событий SQLAlchemy в асинхронном движке вызываются
+в нем же), поэтому обходятся без блокировок. При выключенных метриках декораторы возвращают функции как есть,
+а движки и приложения не инструментируются.
+"""
+import bisect
+import functools
+import re
+import time
+import weakref
+from contextlib import nullcontext
+from typing import Any, Awaitable, Callable, ContextManager, Iterable, TypeVar
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from src.config import get_settings
+from src.storages import postgres
+
+try:
+    from opentelemetry import trace
+except ImportError:  # pragma: no cover
+    trace = None
+
+settings = get_settings()
+
+T = TypeVar('T')
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS: tuple[float, ...] = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+_registry: list['Metric'] = []
+
+
+def enabled() -> bool:
+    return settings.metrics.ENABLED
+
+
+def tracing_enabled() -> bool:
+    return settings.metrics.TRACING and trace is not None
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(str(value))}"' for name, value in labels.items()) + '}'
+
+
+class Metric:
+    """Метрика с метками. Значения хранятся по кортежу значений меток"""
+    type: str = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames: tuple[str, ...] = tuple(labelnames)
+        _registry.append(self)
+
+    def samples(self) -> Iterable[tuple[str, dict[str, str], float]]:
+        """(имя сэмпла, метки, значение) для текстового формата"""
+        return ()
+
+    def render(self) -> str:
+        lines: list[str] = [f'# HELP {self.name} {_escape(self.documentation)}', f'# TYPE {self.name} {self.type}']
+        lines.extend(f'{name}{_format_labels(labels)} {value}' for name, labels, value in self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *labelvalues: str, amount: float = 1) -> None:
+        self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def samples(self) -> Iterable[tuple[str, dict[str, str], float]]:
+        for labelvalues, value in self._values.items():
+            yield self.name, dict(zip(self.labelnames, labelvalues)), value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets: tuple[float, ...] = tuple(sorted(buckets))
+        # по меткам: [счетчики по корзинам (последняя - +Inf), сумма, количество]
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        state: list | None = self._values.get(labelvalues)
+        if state is None:
+            state = self._values[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+        state[2] += 1
+
+    def samples(self) -> Iterable[tuple[str, dict[str, str], float]]:
+        for labelvalues, (counts, total, count) in self._values.items():
+            labels: dict[str, str] = dict(zip(self.labelnames, labelvalues))
+            cumulative: int = 0
+            for bound, bucket_count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += bucket_count
+                yield f'{self.name}_bucket', {**labels, 'le': str(bound)}, cumulative
+            yield f'{self.name}_sum', labels, total
+            yield f'{self.name}_count', labels, count
+
+
+class Gauge(Metric):
+    """Значения снимаются в момент отдачи метрик: callback возвращает пары (значения меток, значение)"""
+    type = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str],
+                 callback: Callable[[], Iterable[tuple[tuple, float]]]):
+        super().__init__(name, documentation, labelnames)
+        self._callback = callback
+
+    def samples(self) -> Iterable[tuple[str, dict[str, str], float]]:
+        for labelvalues, value in self._callback():
+            yield self.name, dict(zip(self.labelnames, labelvalues)), value
+
+
+def render() -> str:
+    """Все метрики процесса в текстовом формате Prometheus"""
+    return '\n'.join(metric.render() for metric in _registry) + '\n'
+
+
+def span(name: str, **attributes) -> ContextManager:
+    """Спан OpenTelemetry, если трассировка включена, иначе пустой контекстный менеджер"""
+    if not tracing_enabled():
+        return nullcontext()
+    return trace.get_tracer(__name__).start_as_current_span(name, attributes=attributes)
+
+
+HTTP_REQUEST_SECONDS = Histogram('http_request_duration_seconds', 'HTTP request latency by route',
+                                 ('app', 'method', 'route', 'status'))
+DB_STATEMENT_SECONDS = Histogram('db_statement_duration_seconds', 'SQL statement execution time',
+                                 ('operation',))
+DB_ERRORS = Counter('db_errors_total', 'Failed SQL statements', ('operation', 'error'))
+FILE_SERVICE_SECONDS = Histogram('file_service_duration_seconds', 'FileService call duration', ('operation',))
+FILE_SERVICE_ERRORS = Counter('file_service_errors_total', 'Failed FileService calls', ('operation', 'error'))
+UPLOAD_BYTES = Counter('upload_bytes_total', 'Bytes received in uploaded files', ('kind',))
+DOWNLOAD_BYTES = Counter('download_bytes_total', 'Bytes of files streamed to clients')
+
+_engines: weakref.WeakSet[AsyncEngine] = weakref.WeakSet()
+
+
+def _pool_occupancy() -> Iterable[tuple[tuple, float]]:
+    for engine in _engines:
+        status: dict = postgres.pool_status(engine)
+        for state in ('checked_in', 'checked_out', 'overflow'):
+            if state in status:
+                yield (engine.url.database or '', state), max(status[state], 0)
+
+
+DB_POOL_CONNECTIONS = Gauge('db_pool_connections', 'Connection pool occupancy', ('database', 'state'),
+                            _pool_occupancy)
+
+
+_limiters: list = []
+
+
+def _admission_occupancy() -> Iterable[tuple[tuple, float]]:
+    for limiter in _limiters:
+        yield (limiter.name, 'in_flight'), limiter.in_flight
+        yield (limiter.name, 'waiting'), limiter.waiting
+
+
+ADMISSION_REQUESTS = Gauge('admission_requests', 'Requests holding or waiting for an admission slot',
+                           ('group', 'state'), _admission_occupancy)
+ADMISSION_REJECTED = Counter('admission_rejected_total', 'Requests shed with 503 by admission control',
+                             ('group', 'reason'))
+
+
+def instrument_limiter(limiter) -> None:
+    """Отдает заполненность ограничителя admission.Limiter в метриках"""
+    if enabled() and limiter not in _limiters:
+        _limiters.append(limiter)
+
+
+_OPERATION = re.compile(r'\s*(\w+)')
+
+
+def _statement_operation(statement: str) -> str:
+    """Первое слово запроса (SELECT, INSERT, ...) без копирования текста запроса"""
+    match: re.Match | None = _OPERATION.match(statement)
+    return match.group(1).upper() if match else 'UNKNOWN'
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    operation: str = _statement_operation(statement)
+    context_manager: ContextManager = span(f'db.{operation}', **{'db.statement': statement})
+    context_manager.__enter__()
+    conn.info.setdefault('metrics_statements', []).append((time.perf_counter(), operation, context_manager))
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany) -> None:
+    started, operation, context_manager = conn.info['metrics_statements'].pop()
+    DB_STATEMENT_SECONDS.observe(time.perf_counter() - started, operation)
+    context_manager.__exit__(None, None, None)
+
+
+def _handle_error(exception_context) -> None:
+    connection = exception_context.connection
+    statements: list = connection.info.get('metrics_statements') if connection is not None else None
+    if not statements:
+        return
+    started, operation, context_manager = statements.pop()
+    DB_ERRORS.inc(operation, type(exception_context.original_exception).__name__)
+    context_manager.__exit__(type(exception_context.original_exception), exception_context.original_exception, None)
+
+
+def instrument_engine(engine: AsyncEngine) -> None:
+    """Подписывается на события выполнения запросов движка и отдает заполненность его пула. Повторно не подписывается"""
+    if not enabled() or engine in _engines:
+        return
+    _engines.add(engine)
+    event.listen(engine.sync_engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine.sync_engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(engine.sync_engine, 'handle_error', _handle_error)
+
+
+def instrumented(histogram: Histogram, errors: Counter) -> Callable:
+    """
+    Декоратор корутины: время вызова в histogram, исключения в errors, спан на вызов.
+    Метка operation - имя функции.
+    """
+    def decorator(func: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+        if not enabled():
+            return func
+        operation: str = func.__name__
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs) -> T:
+            started: float = time.perf_counter()
+            with span(f'{func.__qualname__}'):
+                try:
+                    return await func(*args, **kwargs)
+                except Exception as _exc:
+                    errors.inc(operation, type(_exc).__name__)
+                    raise
+                finally:
+                    histogram.observe(time.perf_counter() - started, operation)
+        return wrapper
+    return decorator
+
+
+class MetricsMiddleware:
+    """ASGI-middleware: задержка HTTP-запросов по шаблону маршрута (а не по пути - у путей нет предела числа)"""
+
+    def __init__(self, app, app_name: str):
+        self.app = app
+        self.app_name = app_name
+
+    async def __call__(self, scope: dict, receive: Callable, send: Callable) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        started: float = time.perf_counter()
+        status: int = 500
+
+        async def send_with_status(message: dict[str, Any]) -> None:
+            nonlocal status
+            if message['type'] == 'http.response.start':
+                status = message['status']
+            await send(message)
+
+        with span(f"{scope['method']} {scope['path']}") as current_span:
+            try:
+                await self.app(scope, receive, send_with_status)
+            finally:
+                # маршрут, совпавший с запросом, FastAPI кладет в scope при маршрутизации
+                route: str = getattr(scope.get('route'), 'path', 'unmatched')
+                HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started,
+                                             self.app_name, scope['method'], route, str(status))
+                if current_span is not None:
+                    current_span.update_name(f"{scope['method']} {route}")
+                    current_span.set_attribute('http.status_code', status)
@@ -1,12 +1,93 @@
-from sqlalchemy import Column, Integer, String
+import enum
+from datetime import datetime, timezone
+
+from sqlalchemy import Column, Integer, String, JSON, DateTime, Index, ForeignKey
 
 from src.storages.postgres import Base
 
 
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
 class Meme(Base):
     __tablename__ = 'memes'
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, index=True)
     content = Column(String)
-    url = Column(String)
     etag = Column(String, index=True)
+    file_key = Column(String, index=True)
+    version = Column(Integer, nullable=False, default=1, server_default='1')
+    variants = Column(JSON)  # уменьшенные копии файла: "<размер>.<формат>" -> ключ в хранилище
+
+    # версия строки увеличивается ORM при каждом UPDATE, по ней строятся HTTP-валидаторы
+    __mapper_args__ = {'version_id_col': version}
+
+
+class MemeFile(Base):
+    """Файл в хранилище, адресуемый хэшем содержимого. refcount - число мемов, ссылающихся на файл"""
+    __tablename__ = 'meme_files'
+    key = Column(String, primary_key=True)
+    refcount = Column(Integer, nullable=False, default=0)
+
+
+class UploadJobStatus(str, enum.Enum):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+
+class UploadJob(Base):
+    """Задача на асинхронную загрузку мема. Файл уже лежит в хранилище под staging_key"""
+    __tablename__ = 'upload_jobs'
+    id = Column(Integer, primary_key=True)
+    status = Column(String, nullable=False, default=UploadJobStatus.PENDING.value)
+    title = Column(String)
+    content = Column(String)
+    staging_key = Column(String, nullable=False)
+    content_type = Column(String)
+    file_key = Column(String)  # постоянный файл, в который перевели staging_key: повторная попытка его не переводит
+    etag = Column(String)
+    meme_id = Column(Integer)
+    error = Column(String)
+    attempts = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), nullable=False, default=_now)
+    updated_at = Column(DateTime(timezone=True), nullable=False, default=_now)
+
+    __table_args__ = (Index('ix_upload_jobs_status_id', 'status', 'id'),)
+
+
+class UploadStatus(str, enum.Enum):
+    OPEN = 'open'
+    COMPLETING = 'completing'
+    DONE = 'done'
+
+
+class Upload(Base):
+    """
+    Загрузка файла мема по частям. Части лежат в незавершенной multipart-загрузке s3_upload_id
+    под временным ключом object_key, пока клиент не завершит загрузку
+    """
+    __tablename__ = 'uploads'
+    id = Column(String, primary_key=True)  # непрозрачный идентификатор для клиента
+    status = Column(String, nullable=False, default=UploadStatus.OPEN.value)
+    title = Column(String)
+    content = Column(String)
+    content_type = Column(String)
+    object_key = Column(String, nullable=False)
+    s3_upload_id = Column(String, nullable=False)
+    meme_id = Column(Integer)
+    created_at = Column(DateTime(timezone=True), nullable=False, default=_now)
+    updated_at = Column(DateTime(timezone=True), nullable=False, default=_now)
+
+    __table_args__ = (Index('ix_uploads_updated_at', 'updated_at'),)
+
+
+class UploadPart(Base):
+    """Загруженная часть. Повторная загрузка части с тем же номером заменяет ее"""
+    __tablename__ = 'upload_parts'
+    upload_id = Column(String, ForeignKey('uploads.id', ondelete='CASCADE'), primary_key=True)
+    part_number = Column(Integer, primary_key=True)
+    etag = Column(String, nullable=False)
+    size = Column(Integer, nullable=False)
@@ -0,0 +1,25 @@
+import base64
+import binascii
+import json
+
+
+class InvalidCursorException(Exception):
+    message = "Invalid cursor"
+
+
+def encode_cursor(position: dict) -> str:
+    """Кодирует позицию последнего элемента страницы в непрозрачный для клиента курсор"""
+    raw: bytes = json.dumps(position, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str, *keys: str) -> dict:
+    """Раскодирует курсор, проверяя, что в нем есть все ключи keys"""
+    try:
+        raw: bytes = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        position = json.loads(raw)
+    except (binascii.Error, ValueError) as _exc:
+        raise InvalidCursorException from _exc
+    if not isinstance(position, dict) or any(key not in position for key in keys):
+        raise InvalidCursorException
+    return position
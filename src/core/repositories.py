@@ -1,36 +1,120 @@
+import hashlib
 import io
+import logging
+import re
+import time
 import uuid
-from urllib.parse import urlparse
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, BinaryIO, Callable
 
+import anyio
+import asyncpg
 import sqlalchemy as sa
 from fastapi import UploadFile
 from minio import error
+from minio.commonconfig import CopySource
+from minio.datatypes import Part, PostPolicy
+from minio.deleteobjects import DeleteObject
 from pydantic import BaseModel
 from sqlalchemy import Select, delete
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker, AsyncEngine
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncConnection, AsyncSession, async_sessionmaker, AsyncEngine
 
 from src.config import get_settings
-from src.core import schemas, models
+from src.core import schemas, models, cache, metrics
 from src.core.abstracts import AbstractMemeDbRepo, AbstractDBRepo, AbstractFileRepo
-from src.storages.minio import minio_client
+from src.storages import postgres
+from src.storages import minio as storage
+from src.storages import local as local_storage
 
 settings = get_settings()
+logger = logging.getLogger(__name__)
 
 
 class DBRepoBaseMixin(AbstractDBRepo):
     """Основное неспецифичное поведение репоизтория, работующего с БД"""
-    def __init__(self, pool_size: int = None, max_overflow: int = None):
+    _engine: AsyncEngine = None
+
+    def __init__(self, engine: AsyncEngine = None, replicas: postgres.ReplicaSet = None):
+        """
+        Прокидывает информацию для подключения к БД.
+        Движок (и его пул соединений) общий на процесс, сессия создается на каждую единицу работы.
+        Читающие запросы, для которых допустимо отставание, идут на реплики replicas (по умолчанию - из настроек,
+        если не передан свой движок), пишущие - на основной движок.
+        """
+        if self._engine is not None and engine is None:
+            return
+        self._engine: AsyncEngine = engine or postgres.get_engine()
+        self.replicas: postgres.ReplicaSet = replicas or (postgres.ReplicaSet() if engine else postgres.get_replicas())
+        for _engine in (self._engine, *self.replicas.engines):
+            metrics.instrument_engine(_engine)
+        self.session_maker: async_sessionmaker[AsyncSession] = async_sessionmaker(self._engine,
+                                                                                  class_=AsyncSession,
+                                                                                  expire_on_commit=False)
+
+    @asynccontextmanager
+    async def _use_session(self, session: AsyncSession = None) -> AsyncIterator[AsyncSession]:
+        """Отдает переданную сессию или открывает новую на время блока"""
+        if session is not None:
+            yield session
+            return
+        async with self.session_maker() as session:
+            yield session
+
+    def pool_status(self) -> dict:
+        """Заполненность пула соединений движка репозитория"""
+        return postgres.pool_status(self._engine)
+
+    async def _ping_primary(self) -> None:
+        async with self._engine.connect() as connection:
+            await connection.execute(sa.select(1))
+
+    async def ping(self) -> None:
+        """
+        Открывает соединение в пуле движка и проверяет его, параллельно проверяет реплики.
+        Используется для прогрева при старте приложения: недоступная реплика только выводится из оборота
         """
-        Прокидывает информацию для подключения к БД
+        async with anyio.create_task_group() as task_group:
+            task_group.start_soon(self._ping_primary)
+            task_group.start_soon(self.replicas.check)
+
+    def _read_engine(self) -> AsyncEngine:
+        """Движок для чтения: очередная исправная реплика, если в этом запросе еще не было записи, иначе основной"""
+        if postgres.wrote_to_primary():
+            return self._engine
+        return self.replicas.pick() or self._engine
+
+    @asynccontextmanager
+    async def _read_connection(self) -> AsyncIterator[AsyncConnection]:
         """
+        Соединение для чтения (см. _read_engine). Если к реплике не удалось подключиться, она выводится из оборота,
+        а чтение идет с основной БД
+        """
+        engine: AsyncEngine = self._read_engine()
+        try:
+            connection: AsyncConnection = await engine.connect()
+        except (OSError, sa.exc.DBAPIError):
+            if engine is self._engine:
+                raise
+            self.replicas.mark_down(engine)
+            connection = await self._engine.connect()
+        try:
+            yield connection
+        finally:
+            await connection.close()
 
-        self._engine: AsyncEngine = create_async_engine(settings.pg.uri,
-                                                        pool_size=pool_size or 5,
-                                                        max_overflow=max_overflow or 10,
-                                                        echo=True)
-        self.session: AsyncSession = async_sessionmaker(self._engine, class_=AsyncSession, expire_on_commit=False)()
+    async def _read_rows(self, stmt: Select) -> list[sa.Row]:
+        """
+        Выполняет выборку столбцов на соединении для чтения, минуя сессию ORM: строки не превращаются в объекты
+        модели и не попадают в identity map
+        """
+        async with self._read_connection() as connection:
+            return list(await connection.execute(stmt))
 
-    async def _get_object_by(self, **kwargs) -> models.Base:
+    async def _get_object_by(self, session: AsyncSession = None, **kwargs) -> models.Base:
         """Возвращает объект sqlalchemy по любым аттрибутам модели"""
         stmt = sa.select(self._model)
         kwargs = self.filter_kwargs(kwargs)
@@ -38,8 +122,8 @@ class DBRepoBaseMixin(AbstractDBRepo):
             model_field = getattr(self._model, field_name)
             stmt = stmt.where(model_field == kwargs[field_name])
         try:
-            async with self.session:
-                results = await self.session.scalars(stmt)
+            async with self._use_session(session) as session:
+                results = await session.scalars(stmt)
             obj: models.Base = results.one()
         except sa.exc.NoResultFound as _exc:
             raise self.NothingFoundException from _exc
@@ -53,12 +137,36 @@ class DBRepoBaseMixin(AbstractDBRepo):
         if as_stmt:
             return stmt
         try:
-            async with self.session:
-                results = await self.session.scalars(stmt)  # noqa
+            async with self._read_connection() as connection, self.session_maker(bind=connection) as session:
+                results = await session.scalars(stmt)  # noqa
         except sa.exc.NoResultFound as _exc:
             return list()
         return list(results)
 
+    async def _get_page(self, after: int | None, limit: int) -> list[models.Base]:
+        """Возвращает limit объектов с первичным ключом больше after. Поиск идет по индексу pk, без OFFSET"""
+        pk: sa.Column = sa.inspect(self._model).primary_key[0]
+        stmt = sa.select(self._model).order_by(pk).limit(limit)
+        if after is not None:
+            stmt = stmt.where(pk > after)
+        async with self._read_connection() as connection, self.session_maker(bind=connection) as session:
+            results = await session.scalars(stmt)
+        return list(results)
+
+    async def estimate_count(self) -> int:
+        """
+        Оценка числа строк таблицы. В PostgreSQL берется из статистики планировщика (pg_class.reltuples)
+        без прохода по таблице, в остальных БД и для ни разу не проанализированной таблицы - COUNT(*).
+        """
+        table: sa.Table = self._model.__table__
+        async with self._read_connection() as connection:
+            if connection.dialect.name == 'postgresql':
+                stmt = sa.text('SELECT reltuples::bigint FROM pg_class WHERE oid = CAST(:table AS regclass)')
+                estimate: int | None = (await connection.execute(stmt, {'table': table.name})).scalar_one_or_none()
+                if estimate is not None and estimate >= 0:
+                    return estimate
+            return (await connection.execute(sa.select(sa.func.count()).select_from(table))).scalar_one()
+
     async def get_by(self, as_pd: bool = False, **kwargs) -> dict | BaseModel:
         """Возвращает объект как словарь или как объект Pydantic"""
         obj = await self._get_object_by(**kwargs)
@@ -72,18 +180,23 @@ class DBRepoBaseMixin(AbstractDBRepo):
                 ret.update({key: kwargs[key]})
         return ret
 
-    async def _create_obj(self, pd_obj: BaseModel) -> models.Base:
-        """Создает объект в БД"""
+    async def _create_obj(self, pd_obj: BaseModel, before_commit: Callable[[], Awaitable] = None) -> models.Base:
+        """Создает объект в БД. before_commit выполняется в транзакции создания после _on_save, перед коммитом"""
         obj = self._model(**{**pd_obj.dict(), 'id': None})
-        async with self.session:
-            self.session.add(obj)
-            await self.session.commit()
-            await self.session.refresh(obj)
+        async with self.session_maker() as session:
+            session.add(obj)
+            await session.flush()
+            await self._on_save(session, None, obj)
+            if before_commit is not None:
+                await before_commit()
+            await session.commit()
+            await session.refresh(obj)
         return obj
 
-    async def create(self, pd_obj: BaseModel, as_pd: bool = False) -> dict | BaseModel:
+    async def create(self, pd_obj: BaseModel, as_pd: bool = False,
+                     before_commit: Callable[[], Awaitable] = None) -> dict | BaseModel:
         """Создает объект в БД и возвращает его как словарь"""
-        obj: models.Base = await self._create_obj(pd_obj)
+        obj: models.Base = await self._create_obj(pd_obj, before_commit)
         return self.schema.from_orm(obj) if as_pd else obj.__dict__
 
     async def update_or_create(self, *,
@@ -96,26 +209,45 @@ class DBRepoBaseMixin(AbstractDBRepo):
         Если partial==False, то поля объекта будут обновлены значением None, если такие поля отсутствуют в data.
         """
         data: dict = self.filter_kwargs(data)
-        try:
-            obj: models.Base = await self._get_object_by(**filter)
-            _obj: models.Base = await self.session.merge(
-                obj)  # локальная копия объекта, чтобы избежать конфликта сессий
-            # перебираем все ключи модели, если partial==false, иначе перебираем ключи из данных
-            for key in data if partial else self._model.__table__.columns.keys():
-                # если поле - primary, то его не обновляем
-                if getattr(getattr(self._model, key), 'primary_key'):
-                    continue
-                field, value = key, data[key]
-                setattr(_obj, field, value) if (value is not None or not partial) else None
-        except self.NothingFoundException:
-            _obj: models.Base = self._model(**data)
-            self.session.add(_obj)
-        await self.session.commit()
+        async with self.session_maker() as session:
+            try:
+                _obj: models.Base = await self._get_object_by(session=session, **filter)
+                previous: dict | None = {key: getattr(_obj, key) for key in self._model.__table__.columns.keys()}
+                version_column: sa.Column | None = sa.inspect(self._model).version_id_col
+                # перебираем все ключи модели, если partial==false, иначе перебираем ключи из данных
+                for key in data if partial else self._model.__table__.columns.keys():
+                    # если поле - primary или версия строки (ее увеличивает ORM), то его не обновляем
+                    if getattr(getattr(self._model, key), 'primary_key'):
+                        continue
+                    if self._model.__table__.columns[key] is version_column:
+                        continue
+                    field, value = key, data.get(key)
+                    setattr(_obj, field, value) if (value is not None or not partial) else None
+            except self.NothingFoundException:
+                previous = None
+                _obj: models.Base = self._model(**data)
+                session.add(_obj)
+            await session.flush()
+            await self._on_save(session, previous, _obj)
+            await session.commit()
         return self.schema.from_orm(_obj) if as_pd else _obj.__dict__
 
     async def partial_update_or_create(self, *, filter: dict, data: dict, as_pd: bool = False) -> dict:
         return await self.update_or_create(filter=filter, data=data, partial=True, as_pd=as_pd)
 
+    async def _on_save(self, session: AsyncSession, previous: dict | None, obj: models.Base) -> None:
+        """
+        Хук, вызываемый в транзакции создания или обновления объекта перед коммитом.
+        previous - значения полей до обновления, None для нового объекта.
+        """
+
+    @staticmethod
+    def _insert(session: AsyncSession, model: type[models.Base]) -> postgresql.Insert | sqlite.Insert:
+        """INSERT с поддержкой ON CONFLICT в диалекте текущей БД"""
+        if session.bind.dialect.name == 'postgresql':
+            return postgresql.insert(model)
+        return sqlite.insert(model)
+
     class NothingFoundException(Exception):
         message = "Nothing found"
         ...
@@ -126,7 +258,10 @@ class DBRepoBaseMixin(AbstractDBRepo):
 
 
 class MemeRepository(DBRepoBaseMixin, AbstractMemeDbRepo):
-    """Репозиторий для работы с мемами. Синглтон, инстанцируется только в один экземпляр."""
+    """
+    Репозиторий для работы с мемами. Синглтон, инстанцируется только в один экземпляр.
+    Сессии БД не хранит: каждая операция открывает свою сессию на общем движке процесса.
+    """
     schema = schemas.Meme
     _model = models.Meme
 
@@ -135,44 +270,342 @@ class MemeRepository(DBRepoBaseMixin, AbstractMemeDbRepo):
     def __new__(cls, *args, **kwargs):
         if cls._self:
             return cls._self
-        cls._self = super().__new__(cls, *args, **kwargs)
+        cls._self = super().__new__(cls)
         return cls._self
 
+    def __init__(self, engine: AsyncEngine = None, replicas: postgres.ReplicaSet = None):
+        super().__init__(engine, replicas)
+        if getattr(self, 'cache', None) is None:
+            self.cache = cache.TTLCache(maxsize=settings.meme_cache.SIZE, ttl=settings.meme_cache.TTL)
+
     async def get_meme_by_id(self, id: int) -> schemas.Meme:
-        return await self.get_by(id=id, as_pd=True)
+        """
+        Отдает мем (без url) из кэша, при промахе читает из БД и кладет в кэш.
+        Если мем изменился, пока шло чтение, прочитанное в кэш не кладется (см. cache.TTLCache.generation)
+        """
+        meme: schemas.Meme | None = self.cache.get(id)
+        if meme is None:
+            generation: tuple[int, int] = self.cache.generation(id)
+            rows: list[sa.Row] = await self._read_rows(sa.select(*_MEME_READ_COLUMNS).where(self._model.id == id))
+            if not rows:
+                raise self.NothingFoundException
+            meme = self.schema.from_orm(rows[0])
+            self.cache.set(id, meme, generation=generation)
+        return meme
 
     async def get_memes(self, as_stmt: bool = False, **kwargs) -> list[dict] | Select:
         return await self._get_objects(as_stmt=as_stmt)
 
+    async def get_memes_page(self, after_id: int | None = None, limit: int = 50) -> list[sa.Row]:
+        """limit мемов с id больше after_id строками выборки, как в get_meme_by_id"""
+        stmt = sa.select(*_MEME_READ_COLUMNS).order_by(self._model.id).limit(limit)
+        if after_id is not None:
+            stmt = stmt.where(self._model.id > after_id)
+        return await self._read_rows(stmt)
+
+    async def search_memes(self, query: str,
+                           after: tuple[float, int] | None = None,
+                           limit: int = 50) -> list[sa.Row]:
+        """
+        Ищет мемы по title и content. Возвращает строки выборки, как в get_meme_by_id, со столбцом rank,
+        по убыванию релевантности, затем id.
+        after - (релевантность, id) последнего мема предыдущей страницы: keyset-пагинация без OFFSET.
+        В PostgreSQL ищет по вектору search_vector (GIN) и по триграммам title (pg_trgm, GIN), в остальных БД -
+        по подстроке без ранжирования.
+        """
+        if self._engine.dialect.name == 'postgresql':
+            tsquery = sa.func.websearch_to_tsquery(sa.literal(_SEARCH_CONFIG, type_=postgresql.REGCONFIG), query)
+            search_vector = sa.literal_column('search_vector', type_=postgresql.TSVECTOR)
+            rank = sa.func.ts_rank_cd(search_vector, tsquery) + sa.func.similarity(self._model.title, query)
+            matches = sa.or_(search_vector.bool_op('@@')(tsquery), self._model.title.bool_op('%')(query))
+        else:
+            rank = sa.literal(0.0, type_=sa.Float)
+            matches = sa.or_(self._model.title.icontains(query, autoescape=True),
+                             self._model.content.icontains(query, autoescape=True))
+        ranked = sa.select(*_MEME_READ_COLUMNS, rank.label('rank')).where(matches).subquery()
+        stmt = sa.select(ranked).order_by(ranked.c.rank.desc(), ranked.c.id.desc()).limit(limit)
+        if after is not None:
+            stmt = stmt.where(sa.tuple_(ranked.c.rank, ranked.c.id) < sa.tuple_(*after))
+        return await self._read_rows(stmt)
+
     async def create_meme(self, meme: schemas.MemeCreate) -> dict:
         return await self.create(meme)
 
-    async def delete_meme_by_id(self, id: int):
-        async with self.session:
-            stmt = sa.delete(self._model).where(self._model.id == id)
-            await self.session.execute(stmt)
-            await self.session.commit()
+    async def create_memes(self, memes: list[schemas.MemeEnriched],
+                           before_commit: Callable[[], Awaitable] = None) -> list[schemas.Meme]:
+        """
+        Создает мемы одной транзакцией: строки мемов пишутся многострочным INSERT ... RETURNING,
+        счетчики ссылок на файлы - одним upsert. Мемы возвращаются в порядке memes.
+        before_commit выполняется в транзакции после того, как ссылки на файлы взяты (см. reap_files).
+        """
+        if not memes:
+            return []
+        rows: list[dict] = [meme.model_dump(include=set(schemas.MemeEnriched.model_fields)) for meme in memes]
+        stmt = sa.insert(self._model).returning(self._model, sort_by_parameter_order=True)
+        try:
+            async with self.session_maker.begin() as session:
+                objs: list[models.Meme] = list(await session.scalars(stmt, rows))
+                await self._acquire_files(session, Counter(meme.file_key for meme in memes))
+                if before_commit is not None:
+                    await before_commit()
+        except sa.exc.IntegrityError as _exc:
+            raise self.DBConstrainException from _exc
+        return [self.schema.from_orm(obj) for obj in objs]
+
+    async def delete_meme_by_id(self, id: int) -> dict[str, list[str]]:
+        """
+        Удаляет мем одной транзакцией: DELETE ... RETURNING ключа файла и копий и уменьшение счетчика ссылок на файл.
+        Возвращает файл, если на него больше никто не ссылается и его пора удалить из хранилища, вместе с ключами
+        его копий (как delete_memes), иначе пустой словарь.
+        """
+        async with self.session_maker.begin() as session:
+            stmt = (sa.delete(self._model).where(self._model.id == id)
+                    .returning(self._model.file_key, self._model.variants))
+            try:
+                row: sa.Row = (await session.execute(stmt)).one()
+            except sa.exc.NoResultFound as _exc:
+                raise self.NothingFoundException from _exc
+            orphaned: bool = bool(row.file_key) and await self._release_file(session, row.file_key)
+            await self._notify_changed(session, id)
+        return self._collect_orphans([row.file_key] if orphaned else [], [row])
+
+    async def replace_meme(self, id: int, meme: schemas.MemeEnriched,
+                           before_commit: Callable[[], Awaitable] = None) -> (schemas.Meme, dict[str, list[str]]):
+        """
+        Заменяет поля и файл мема одной транзакцией, заблокировав строку мема (SELECT ... FOR UPDATE).
+        Ссылка переносится со старого файла на новый в той же транзакции, before_commit выполняется после этого.
+        При смене файла копии старого (variants) сбрасываются.
+        Возвращает обновленный мем и старый файл с ключами его копий, если на файл больше никто не ссылается
+        (как delete_memes), иначе пустой словарь.
+        """
+        async with self.session_maker.begin() as session:
+            stmt = sa.select(self._model).where(self._model.id == id).with_for_update()
+            try:
+                obj: models.Meme = (await session.scalars(stmt)).one()
+            except sa.exc.NoResultFound as _exc:
+                raise self.NothingFoundException from _exc
+            old_key: str | None = obj.file_key
+            old_variants: dict[str, str] | None = obj.variants
+            for field, value in meme.model_dump(include=set(schemas.MemeEnriched.model_fields)).items():
+                setattr(obj, field, value)
+            await session.flush()
+            orphaned: bool = False
+            if old_key != obj.file_key:
+                obj.variants = None
+                await self._acquire_file(session, obj.file_key)
+                orphaned = bool(old_key) and await self._release_file(session, old_key)
+            if before_commit is not None:
+                await before_commit()
+            await self._notify_changed(session, id)
+        return (self.schema.from_orm(obj),
+                self._collect_orphans([old_key] if orphaned else [], [(old_key, old_variants)]))
+
+    async def delete_memes(self, ids: list[int] | None = None, limit: int | None = None,
+                           **filters) -> (dict[int, str | None], dict[str, list[str]]):
+        """
+        Удаляет мемы с id из ids и/или с полями, равными filters, одним DELETE ... RETURNING.
+        limit - не больше стольких мемов с наименьшими id за вызов (подзапрос id с LIMIT).
+        Счетчики ссылок на файлы удаленных мемов уменьшаются одним UPDATE в той же транзакции.
+        Возвращает ключи файлов удаленных мемов по их id и файлы, на которые больше никто не ссылается,
+        вместе с ключами их производных копий. Без условий ничего не удаляет.
+        """
+        filters: dict = self.filter_kwargs(filters)
+        if ids is None and not filters:
+            return {}, {}
+        where: list = [getattr(self._model, field_name) == value for field_name, value in filters.items()]
+        if ids is not None:
+            where.append(self._model.id.in_(ids))
+        if limit is not None:
+            where = [self._model.id.in_(sa.select(self._model.id).where(*where).order_by(self._model.id).limit(limit))]
+        stmt = (sa.delete(self._model).where(*where)
+                .returning(self._model.id, self._model.file_key, self._model.variants))
+        async with self.session_maker.begin() as session:
+            rows: list[sa.Row] = list((await session.execute(stmt)).all())
+            orphaned_keys: list[str] = await self._release_files(session, Counter(row.file_key for row in rows
+                                                                                  if row.file_key))
+            await self._notify_changed_many(session, [row.id for row in rows])
+        return ({row.id: row.file_key for row in rows},
+                self._collect_orphans(orphaned_keys, [(row.file_key, row.variants) for row in rows]))
 
     @staticmethod
-    def _parse_name(url: str) -> str:
-        path = urlparse(url).path
-        return path.split('/')[-1]
+    def _collect_orphans(orphaned_keys: list[str],
+                         files: list[tuple[str | None, dict[str, str] | None]]) -> dict[str, list[str]]:
+        """
+        Сопоставляет файлам, на которые больше никто не ссылается, ключи их копий из variants удаленных или
+        замененных мемов. Копии берутся из мемов, а не из настроек: набор размеров и форматов мог поменяться
+        """
+        orphans: dict[str, list[str]] = {key: [] for key in orphaned_keys}
+        for file_key, variants in files:
+            if file_key in orphans:
+                orphans[file_key].extend(variant_key for variant_key in (variants or {}).values()
+                                         if variant_key not in orphans[file_key])
+        return orphans
 
-    async def get_meme_file_name(self, id: int) -> str:
-        obj = await self.get_by(id=id, as_pd=True)
-        name: str = self._parse_name(obj.url)
-        return name
+    async def set_variants(self, id: int, file_key: str, variants: dict[str, str]) -> None:
+        """Записывает копии файла в мем, если файл мема за время их построения не поменялся"""
+        stmt = (sa.update(self._model)
+                .where(self._model.id == id, self._model.file_key == file_key)
+                .values(variants=variants, version=self._model.version + 1))
+        async with self.session_maker.begin() as session:
+            result = await session.execute(stmt)
+            if result.rowcount:
+                await self._notify_changed(session, id)
+
+    async def get_meme_file_key(self, id: int) -> str:
+        obj: schemas.Meme = await self.get_by(id=id, as_pd=True)
+        return obj.file_key
 
     async def get_etag(self, id: int) -> str:
         obj: schemas.Meme = await self.get_by(id=id, as_pd=True)
         return obj.etag
 
-    async def is_etag_unique(self, etag: str) -> bool:
+    async def create_exclusive(self, meme: schemas.MemeEnriched,
+                               before_commit: Callable[[], Awaitable] = None) -> schemas.Meme:
+        """
+        Создает мем на файл, на который еще никто не ссылается, одной транзакцией. Ссылка на файл берется upsert-ом,
+        который ничего не меняет, если на файл уже ссылаются: из одновременных созданий мема на один файл проходит
+        одно, остальные получают FileInUseException. before_commit выполняется в транзакции после создания мема.
+        """
+        row: dict = meme.model_dump(include=set(schemas.MemeEnriched.model_fields))
+        async with self.session_maker.begin() as session:
+            stmt = self._insert(session, models.MemeFile).values(key=meme.file_key, refcount=1)
+            stmt = (stmt.on_conflict_do_update(index_elements=[models.MemeFile.key],
+                                               set_={'refcount': 1},
+                                               where=models.MemeFile.refcount <= 0)
+                    .returning(models.MemeFile.key))
+            if (await session.execute(stmt)).scalar_one_or_none() is None:
+                raise self.FileInUseException
+            obj: models.Meme = (await session.scalars(sa.insert(self._model).values(**row)
+                                                      .returning(self._model))).one()
+            if before_commit is not None:
+                await before_commit()
+        return self.schema.from_orm(obj)
+
+    async def reap_files(self, keys: list[str], remove: Callable[[list[str]], Awaitable[set[str]]]) -> set[str]:
+        """
+        Удаляет из хранилища файлы из keys, на которые по-прежнему никто не ссылается: remove получает их ключи и
+        возвращает те, что удалить не удалось. Записи о файлах (недостающие создаются с нулевым счетчиком)
+        держатся заблокированными (SELECT ... FOR UPDATE) до конца удаления, и записи об удаленных файлах удаляются
+        в той же транзакции. Мем, который ссылается на файл, берет ссылку на него в транзакции создания до проверки,
+        что файл на месте (before_commit): он или ждет блокировку и видит, что файла больше нет, или успевает
+        взять ссылку, и тогда файл не удаляется. Возвращает ключи, удалить которые не удалось.
+        """
+        if not keys:
+            return set()
+        keys = sorted(set(keys))
+        async with self.session_maker.begin() as session:
+            stmt = self._insert(session, models.MemeFile).values([{'key': key, 'refcount': 0} for key in keys])
+            await session.execute(stmt.on_conflict_do_nothing(index_elements=[models.MemeFile.key]))
+            stmt = (sa.select(models.MemeFile.key)
+                    .where(models.MemeFile.key.in_(keys), models.MemeFile.refcount <= 0)
+                    .order_by(models.MemeFile.key)
+                    .with_for_update())
+            orphaned_keys: list[str] = list(await session.scalars(stmt))
+            failed_keys: set[str] = await remove(orphaned_keys) if orphaned_keys else set()
+            await session.execute(sa.delete(models.MemeFile)
+                                  .where(models.MemeFile.key.in_(set(orphaned_keys) - failed_keys),
+                                         models.MemeFile.refcount <= 0))
+        return failed_keys
+
+    async def _on_save(self, session: AsyncSession, previous: dict | None, obj: models.Meme) -> None:
+        """Переносит ссылку мема со старого файла на новый и оповещает о изменении мема"""
+        old_key: str | None = previous and previous.get('file_key')
+        if old_key != obj.file_key:
+            if obj.file_key:
+                await self._acquire_file(session, obj.file_key)
+            if old_key:
+                await self._release_file(session, old_key)
+        if previous is not None:
+            await self._notify_changed(session, obj.id)
+
+    async def _notify_changed(self, session: AsyncSession, id: int) -> None:
+        """
+        Сбрасывает мем в кэше процесса и, в PostgreSQL, шлет NOTIFY в канал settings.meme_cache.CHANNEL.
+        Уведомление доставляется другим процессам только после коммита транзакции.
+        """
+        self.cache.invalidate(id)
+        if session.bind.dialect.name == 'postgresql':
+            await session.execute(sa.select(sa.func.pg_notify(settings.meme_cache.CHANNEL, str(id))))
+
+    async def _notify_changed_many(self, session: AsyncSession, ids: list[int]) -> None:
+        """То же, что _notify_changed, но одним уведомлением на все мемы: получатели сбрасывают кэш целиком"""
+        if len(ids) <= 1:
+            for id in ids:
+                await self._notify_changed(session, id)
+            return
+        for id in ids:
+            self.cache.invalidate(id)
+        if session.bind.dialect.name == 'postgresql':
+            await session.execute(sa.select(sa.func.pg_notify(settings.meme_cache.CHANNEL, '*')))
+
+    def _on_notification(self, connection, pid: int, channel: str, payload: str) -> None:
         try:
-            await self._get_object_by(etag=etag)
-            return True
-        except self.MultipleObjectsException:
-            return False
+            self.cache.invalidate(int(payload))
+        except ValueError:
+            self.cache.clear()
+
+    async def listen_for_changes(self) -> None:
+        """
+        Слушает канал уведомлений об изменении мемов (LISTEN) и сбрасывает измененные мемы в кэше.
+        Работает до отмены, при потере соединения переподключается. Пока соединения нет, кэш не используется,
+        так как уведомления могли быть пропущены.
+        """
+        if self._engine.dialect.name != 'postgresql' or not self.cache.enabled:
+            return
+        dsn: str = self._engine.url.set(drivername='postgresql').render_as_string(hide_password=False)
+        self.cache.active = False
+        while True:
+            try:
+                connection: asyncpg.Connection = await asyncpg.connect(dsn)
+            except (OSError, asyncpg.PostgresError) as _exc:
+                logger.warning('Meme cache invalidation listener failed to connect: %s', _exc)
+                await anyio.sleep(settings.meme_cache.RECONNECT_DELAY)
+                continue
+            closed = anyio.Event()
+            connection.add_termination_listener(lambda _connection: closed.set())
+            try:
+                await connection.add_listener(settings.meme_cache.CHANNEL, self._on_notification)
+                self.cache.clear()
+                self.cache.active = True
+                await closed.wait()
+            finally:
+                self.cache.active = False
+                self.cache.clear()
+                with anyio.CancelScope(shield=True):
+                    await connection.close()
+            logger.warning('Meme cache invalidation listener lost connection, reconnecting')
+
+    async def _acquire_file(self, session: AsyncSession, file_key: str) -> None:
+        """Увеличивает счетчик ссылок на файл, создавая запись о файле при необходимости"""
+        await self._acquire_files(session, {file_key: 1})
+
+    async def _acquire_files(self, session: AsyncSession, refs: dict[str, int]) -> None:
+        """Увеличивает счетчики ссылок на файлы на refs[ключ] одним upsert, создавая записи о файлах при необходимости"""
+        stmt = self._insert(session, models.MemeFile).values([{'key': key, 'refcount': refs[key]}
+                                                               for key in sorted(refs)])
+        stmt = stmt.on_conflict_do_update(index_elements=[models.MemeFile.key],
+                                          set_={'refcount': models.MemeFile.refcount + stmt.excluded.refcount})
+        await session.execute(stmt)
+
+    async def _release_file(self, session: AsyncSession, file_key: str) -> bool:
+        """Уменьшает счетчик ссылок на файл. Возвращает True, если на файл больше никто не ссылается"""
+        return file_key in await self._release_files(session, {file_key: 1})
+
+    async def _release_files(self, session: AsyncSession, refs: dict[str, int]) -> list[str]:
+        """
+        Уменьшает счетчики ссылок на файлы на refs[ключ] одним UPDATE.
+        Возвращает ключи файлов, на которые больше никто не ссылается. Записи о них остаются с нулевым счетчиком
+        до удаления файлов через reap_files.
+        """
+        if not refs:
+            return []
+        stmt = (sa.update(models.MemeFile)
+                .where(models.MemeFile.key.in_(list(refs)))
+                .values(refcount=models.MemeFile.refcount - sa.case(refs, value=models.MemeFile.key, else_=0))
+                .returning(models.MemeFile.key, models.MemeFile.refcount)
+                .execution_options(synchronize_session=False))
+        refcounts: dict[str, int] = dict((await session.execute(stmt)).all())
+        return [key for key in refs if refcounts.get(key, 0) <= 0]
 
     class DBConstrainException(Exception):
         message = "Internal DB constraint"
@@ -180,23 +613,288 @@ class MemeRepository(DBRepoBaseMixin, AbstractMemeDbRepo):
     class NothingFoundException(Exception):
         message = "No meme found"
 
+    class FileInUseException(Exception):
+        message = "File is already used by another meme"
+
     class MultipleObjectsException(Exception):
         message = "Found more than one meme"
 
 
+class UploadJobRepository(DBRepoBaseMixin, AbstractDBRepo):
+    """
+    Очередь задач асинхронной загрузки мемов в PostgreSQL. Синглтон, инстанцируется только в один экземпляр.
+    Воркеры разбирают задачи через SELECT ... FOR UPDATE SKIP LOCKED, не блокируя друг друга.
+    """
+    schema = schemas.UploadJob
+    _model = models.UploadJob
+
+    _self = None
+
+    def __new__(cls, *args, **kwargs):
+        if cls._self:
+            return cls._self
+        cls._self = super().__new__(cls)
+        return cls._self
+
+    async def enqueue(self, job: schemas.UploadJobCreate) -> schemas.UploadJob:
+        return await self.create(job, as_pd=True)
+
+    async def get_job_by_id(self, id: int) -> schemas.UploadJob:
+        return await self.get_by(id=id, as_pd=True)
+
+    async def claim(self, limit: int = 1) -> list[models.UploadJob]:
+        """
+        Забирает в работу до limit задач: ожидающих и тех, чей воркер не продлевал аренду (extend_lease)
+        settings.jobs.LEASE секунд. Строки, уже захваченные другими воркерами, пропускаются.
+        """
+        now = datetime.now(timezone.utc)
+        lease_expired = now - timedelta(seconds=settings.jobs.LEASE)
+        claimable = (sa.select(self._model.id)
+                     .where(sa.or_(self._model.status == models.UploadJobStatus.PENDING.value,
+                                   sa.and_(self._model.status == models.UploadJobStatus.RUNNING.value,
+                                           self._model.updated_at < lease_expired)))
+                     .order_by(self._model.id)
+                     .limit(limit)
+                     .with_for_update(skip_locked=True))
+        stmt = (sa.update(self._model)
+                .where(self._model.id.in_(claimable.scalar_subquery()))
+                .values(status=models.UploadJobStatus.RUNNING.value,
+                        attempts=self._model.attempts + 1,
+                        updated_at=now)
+                .returning(self._model)
+                .execution_options(synchronize_session=False))
+        async with self.session_maker.begin() as session:
+            return list(await session.scalars(stmt))
+
+    async def extend_lease(self, id: int, attempt: int) -> bool:
+        """
+        Продлевает аренду задачи, которую выполняет воркер, забравший ее попыткой attempt.
+        Возвращает False, если аренда уже истекла и задачу забрал другой воркер или она завершена
+        """
+        stmt = (sa.update(self._model)
+                .where(self._model.id == id,
+                       self._model.status == models.UploadJobStatus.RUNNING.value,
+                       self._model.attempts == attempt)
+                .values(updated_at=datetime.now(timezone.utc)))
+        async with self.session_maker.begin() as session:
+            return (await session.execute(stmt)).rowcount == 1
+
+    async def set_file(self, id: int, etag: str, file_key: str) -> None:
+        """Запоминает постоянный файл задачи: повторная попытка после сбоя не переводит временный файл заново"""
+        async with self.session_maker.begin() as session:
+            await session.execute(sa.update(self._model)
+                                  .where(self._model.id == id)
+                                  .values(etag=etag, file_key=file_key))
+
+    async def complete(self, id: int, meme_id: int) -> None:
+        await self._set_status(id, status=models.UploadJobStatus.DONE, meme_id=meme_id, error=None)
+
+    async def fail(self, id: int, error: str, retry: bool) -> None:
+        """Возвращает задачу в очередь или, если retry=False, помечает ее проваленной"""
+        status = models.UploadJobStatus.PENDING if retry else models.UploadJobStatus.FAILED
+        await self._set_status(id, status=status, error=error)
+
+    async def _set_status(self, id: int, status: models.UploadJobStatus, **values) -> None:
+        stmt = (sa.update(self._model)
+                .where(self._model.id == id)
+                .values(status=status.value, updated_at=datetime.now(timezone.utc), **values))
+        async with self.session_maker.begin() as session:
+            await session.execute(stmt)
+
+    class NothingFoundException(Exception):
+        message = "No upload job found"
+
+    class MultipleObjectsException(Exception):
+        message = "Found more than one upload job"
+
+
+class UploadRepository(DBRepoBaseMixin, AbstractDBRepo):
+    """
+    Загрузки мемов по частям и их части. Синглтон, инстанцируется только в один экземпляр.
+    Сами части лежат в хранилище, в БД - их номера, etag и размеры, чтобы клиент мог докачать недостающие.
+    """
+    schema = schemas.Upload
+    _model = models.Upload
+
+    _self = None
+
+    def __new__(cls, *args, **kwargs):
+        if cls._self:
+            return cls._self
+        cls._self = super().__new__(cls)
+        return cls._self
+
+    async def create_upload(self, upload: schemas.UploadCreate, object_key: str, s3_upload_id: str) -> schemas.Upload:
+        obj = self._model(id=uuid.uuid4().hex, object_key=object_key, s3_upload_id=s3_upload_id, **upload.model_dump())
+        async with self.session_maker.begin() as session:
+            session.add(obj)
+        return self.schema(id=obj.id, status=obj.status)
+
+    async def get_upload(self, id: str) -> (models.Upload, list[schemas.UploadPart]):
+        """Загрузка и ее части по возрастанию номера"""
+        parts_stmt = (sa.select(models.UploadPart)
+                      .where(models.UploadPart.upload_id == id)
+                      .order_by(models.UploadPart.part_number))
+        async with self.session_maker() as session:
+            upload: models.Upload = await self._get_object_by(session=session, id=id)
+            parts: list[models.UploadPart] = list(await session.scalars(parts_stmt))
+        return upload, [schemas.UploadPart.model_validate(part) for part in parts]
+
+    async def get_upload_state(self, id: str) -> schemas.Upload:
+        upload, parts = await self.get_upload(id)
+        return self.schema(id=upload.id, status=upload.status, parts=parts, meme_id=upload.meme_id)
+
+    async def save_part(self, id: str, part: schemas.UploadPart) -> None:
+        """
+        Записывает загруженную часть, заменяя прежнюю с тем же номером, и продлевает жизнь загрузки.
+        Если загрузка уже завершается или удалена, поднимает ConflictException
+        """
+        now = datetime.now(timezone.utc)
+        touch = (sa.update(self._model)
+                 .where(self._model.id == id, self._model.status == models.UploadStatus.OPEN.value)
+                 .values(updated_at=now))
+        async with self.session_maker.begin() as session:
+            if (await session.execute(touch)).rowcount != 1:
+                raise self.ConflictException
+            stmt = self._insert(session, models.UploadPart).values(upload_id=id, **part.model_dump())
+            stmt = stmt.on_conflict_do_update(index_elements=[models.UploadPart.upload_id,
+                                                              models.UploadPart.part_number],
+                                              set_={'etag': stmt.excluded.etag, 'size': stmt.excluded.size})
+            await session.execute(stmt)
+
+    async def start_completing(self, id: str) -> models.Upload:
+        """
+        Переводит открытую загрузку в завершение. Из нескольких одновременных завершений проходит одно,
+        остальные получают ConflictException
+        """
+        stmt = (sa.update(self._model)
+                .where(self._model.id == id, self._model.status == models.UploadStatus.OPEN.value)
+                .values(status=models.UploadStatus.COMPLETING.value, updated_at=datetime.now(timezone.utc))
+                .returning(self._model)
+                .execution_options(synchronize_session=False))
+        async with self.session_maker.begin() as session:
+            upload: models.Upload | None = (await session.scalars(stmt)).one_or_none()
+        if upload is None:
+            raise self.ConflictException
+        return upload
+
+    async def reopen(self, id: str) -> None:
+        """Возвращает загрузку, которую не удалось завершить, в открытые: клиент может дозагрузить части"""
+        await self._set_status(id, models.UploadStatus.OPEN)
+
+    async def finish(self, id: str, meme_id: int) -> None:
+        """Отмечает загрузку завершенной. Части больше не нужны, запись о загрузке живет до очистки по TTL"""
+        async with self.session_maker.begin() as session:
+            await session.execute(sa.delete(models.UploadPart).where(models.UploadPart.upload_id == id))
+            await session.execute(sa.update(self._model)
+                                  .where(self._model.id == id)
+                                  .values(status=models.UploadStatus.DONE.value, meme_id=meme_id,
+                                          updated_at=datetime.now(timezone.utc)))
+
+    async def delete_upload(self, id: str) -> models.Upload:
+        """Удаляет открытую загрузку с частями и возвращает ее, чтобы прервать multipart-загрузку в хранилище"""
+        return (await self._delete_where(self._model.id == id,
+                                         self._model.status == models.UploadStatus.OPEN.value))[0]
+
+    async def delete_stale(self, older_than: timedelta, limit: int = 100) -> list[models.Upload]:
+        """
+        Удаляет до limit загрузок без изменений дольше older_than. Возвращает их: у незавершенных в хранилище
+        остались части или собранный временный файл
+        """
+        stale = (sa.select(self._model.id)
+                 .where(self._model.updated_at < datetime.now(timezone.utc) - older_than)
+                 .limit(limit)
+                 .scalar_subquery())
+        return await self._delete_where(self._model.id.in_(stale), allow_empty=True)
+
+    async def _delete_where(self, *where, allow_empty: bool = False) -> list[models.Upload]:
+        stmt = (sa.delete(self._model)
+                .where(*where)
+                .returning(self._model)
+                .execution_options(synchronize_session=False))
+        async with self.session_maker.begin() as session:
+            uploads: list[models.Upload] = list(await session.scalars(stmt))
+            if uploads:
+                # каскад внешнего ключа в SQLite без PRAGMA foreign_keys не срабатывает
+                await session.execute(sa.delete(models.UploadPart)
+                                      .where(models.UploadPart.upload_id.in_([upload.id for upload in uploads])))
+        if not uploads and not allow_empty:
+            raise self.NothingFoundException
+        return uploads
+
+    async def _set_status(self, id: str, status: models.UploadStatus) -> None:
+        stmt = (sa.update(self._model)
+                .where(self._model.id == id)
+                .values(status=status.value, updated_at=datetime.now(timezone.utc)))
+        async with self.session_maker.begin() as session:
+            await session.execute(stmt)
+
+    class NothingFoundException(Exception):
+        message = "No upload found"
+
+    class MultipleObjectsException(Exception):
+        message = "Found more than one upload"
+
+    class ConflictException(Exception):
+        message = "Upload is already being completed or finished"
+
+
+# столбцы, которые отдаются на чтение мемов: поля schemas.Meme и то, что нужно для ссылки на файл и HTTP-валидатора
+_MEME_READ_COLUMNS: tuple[sa.Column, ...] = tuple(models.Meme.__table__.c[name] for name in
+                                                  ('id', 'title', 'content', 'etag', 'file_key', 'version', 'variants'))
+_SEARCH_CONFIG = 'russian'  # конфигурация полнотекстового поиска, та же, что в вычисляемом search_vector
+_HASH_CHUNK_SIZE = 1024 * 1024
+_STREAM_CHUNK_SIZE = 256 * 1024
+_MIN_PART_SIZE = 5 * 1024 * 1024  # минимальный размер части multipart-загрузки, кроме последней, в S3
+_DERIVATIVES_SUFFIX = '.derivatives/'
+_STAGING_PREFIX = 'staging/'
+_DIRECT_PREFIX = 'direct/'
+_DIRECT_KEY = re.compile(rf'{_DIRECT_PREFIX}[0-9a-f]{{8}}-[0-9a-f]{{4}}-[0-9a-f]{{4}}-[0-9a-f]{{4}}-[0-9a-f]{{12}}')
+
+
+class _LimitedReader:
+    """Файловый объект-обертка, который поднимает исключение, как только прочитано больше limit байт"""
+
+    def __init__(self, raw: BinaryIO, limit: int, exception: type[Exception]):
+        self._raw = raw
+        self._limit = limit
+        self._exception = exception
+        self.bytes_read: int = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data: bytes = self._raw.read(size)
+        self.bytes_read += len(data)
+        if self.bytes_read > self._limit:
+            raise self._exception
+        return data
+
+
 class FileService(AbstractFileRepo):
-    """Репозиторий для работы с файлами. Синглтон, инстанцируется только в один экземпляр."""
-    client = minio_client
+    """
+    Репозиторий для работы с файлами. Синглтон, инстанцируется только в один экземпляр.
+    Блокирующие вызовы клиента MinIO выполняются в ограниченном пуле потоков.
+    """
     bucket = settings.minio.STORAGE_BUCKET
+    _urls = cache.TTLCache(maxsize=settings.minio.URL_CACHE_SIZE, ttl=settings.minio.URL_EXPIRES // 2)
 
     _self = None
 
     def __new__(cls, *args, **kwargs):
         if cls._self:
             return cls._self
-        cls._self = super().__new__(cls, *args, **kwargs)
+        cls._self = super().__new__(cls)
         return cls._self
 
+    @property
+    def client(self):
+        """Клиент MinIO процесса, создается при первом обращении"""
+        return storage.get_client()
+
+    async def ensure_bucket(self) -> None:
+        """Создает бакет, если его нет. Вызывается при старте приложения, а не при импорте"""
+        if not await storage.run_sync(self.client.bucket_exists, self.bucket):
+            await storage.run_sync(self.client.make_bucket, self.bucket)
+
     async def get_by(self, **kwargs):
         id_ = kwargs.get('id')
         if not id_:
@@ -206,45 +904,366 @@ class FileService(AbstractFileRepo):
     async def get_file_by_id(self, id):
         return await self.get_by(id=id)
 
-    async def create(self, data: bytes, filename: str, content_type: str) -> (str, str):
-        file_buffer = io.BytesIO(data)
-        file_buffer.seek(0)
-        length_ = file_buffer.getbuffer().nbytes
+    @metrics.instrumented(metrics.FILE_SERVICE_SECONDS, metrics.FILE_SERVICE_ERRORS)
+    async def create(self, stream: BinaryIO, filename: str, content_type: str, length: int = -1) -> str:
+        """
+        Потоково загружает файл в хранилище частями по settings.minio.PART_SIZE и возвращает его etag.
+        Если длина неизвестна (length=-1), используется multipart-загрузка.
+        """
+        result = await storage.run_sync(self.client.put_object, self.bucket, filename, stream,
+                                        length=length, content_type=content_type,
+                                        part_size=settings.minio.PART_SIZE)
+        return result.etag
+
+    def get_url(self, key: str) -> str:
+        """
+        Подписывает ссылку на скачивание локально, без запросов в хранилище.
+        Время подписи округляется вниз до окна длиной в половину срока жизни ссылки, поэтому в пределах окна ссылка
+        одна и та же (ее можно кэшировать) и остается действительной не меньше половины срока жизни.
+        """
+        window: int = settings.minio.URL_EXPIRES // 2
+        window_start: int = int(time.time()) // window * window
+        url: str | None = self._urls.get((key, window_start))
+        if url is None:
+            url = self.client.presigned_get_object(self.bucket, key,
+                                                   expires=timedelta(seconds=settings.minio.URL_EXPIRES),
+                                                   request_date=datetime.fromtimestamp(window_start, tz=timezone.utc))
+            self._urls.set((key, window_start), url)
+        return url
+
+    @staticmethod
+    def _hash_stream(stream: BinaryIO) -> str:
+        """Считает sha256 содержимого потока, читая его частями"""
+        hasher = hashlib.sha256()
+        while chunk := stream.read(_HASH_CHUNK_SIZE):
+            hasher.update(chunk)
+        return hasher.hexdigest()
+
+    def derivative_key(self, key: str, name: str) -> str:
+        """Производные копии лежат рядом с оригиналом, под общим префиксом"""
+        return f'{key}{_DERIVATIVES_SUFFIX}{name}'
+
+    @metrics.instrumented(metrics.FILE_SERVICE_SECONDS, metrics.FILE_SERVICE_ERRORS)
+    async def exists(self, key: str) -> bool:
+        try:
+            await storage.run_sync(self.client.stat_object, self.bucket, key)
+            return True
+        except error.S3Error:
+            return False
+
+    @staticmethod
+    def _read_object(client, bucket: str, key: str) -> bytes:
+        response = client.get_object(bucket, key)
+        try:
+            return response.read()
+        finally:
+            response.close()
+            response.release_conn()
+
+    @metrics.instrumented(metrics.FILE_SERVICE_SECONDS, metrics.FILE_SERVICE_ERRORS)
+    async def get_bytes(self, key: str) -> bytes:
+        try:
+            return await storage.run_sync(self._read_object, self.client, self.bucket, key)
+        except error.S3Error:
+            raise self.NothingFoundException
+
+    @metrics.instrumented(metrics.FILE_SERVICE_SECONDS, metrics.FILE_SERVICE_ERRORS)
+    async def stat(self, key: str):
+        """Метаданные объекта хранилища: size, etag, content_type, last_modified"""
+        try:
+            return await storage.run_sync(self.client.stat_object, self.bucket, key)
+        except error.S3Error:
+            raise self.NothingFoundException
+
+    def local_path(self, key: str) -> Path | None:
+        """Путь к файлу на локальном диске, если хранилище локальное: такой файл отдается без чтения в приложение"""
+        return None
+
+    async def stream(self, key: str, offset: int = 0, length: int = 0) -> AsyncIterator[bytes]:
+        """
+        Читает объект, или length байт с offset, кусками по _STREAM_CHUNK_SIZE: в памяти не больше одного куска
+        на поток. Одновременно читается не больше settings.minio.MAX_STREAMS объектов (см. storage.get_stream_limiter).
+        Соединение с хранилищем возвращается в пул, когда поток дочитан или закрыт, в том числе при обрыве клиентом
+        """
+        async with storage.get_stream_limiter():
+            try:
+                response = await storage.run_sync(self.client.get_object, self.bucket, key,
+                                                  offset=offset, length=length)
+            except error.S3Error:
+                raise self.NothingFoundException
+            try:
+                while chunk := await storage.run_sync(response.read, _STREAM_CHUNK_SIZE):
+                    metrics.DOWNLOAD_BYTES.inc(amount=len(chunk))
+                    yield chunk
+            finally:
+                response.close()
+                response.release_conn()
+
+    @metrics.instrumented(metrics.FILE_SERVICE_SECONDS, metrics.FILE_SERVICE_ERRORS)
+    async def put_bytes(self, key: str, data: bytes, content_type: str) -> str:
+        return await self.create(io.BytesIO(data), key, content_type, length=len(data))
+
+    def _hash_object(self, key: str) -> str:
+        response = self.client.get_object(self.bucket, key)
+        try:
+            return self._hash_stream(response)
+        finally:
+            response.close()
+            response.release_conn()
+
+    @metrics.instrumented(metrics.FILE_SERVICE_SECONDS, metrics.FILE_SERVICE_ERRORS)
+    async def stage_file(self, file: UploadFile) -> str:
+        """
+        Загружает файл запроса во временный ключ одним потоковым PUT, без хэширования и проверок.
+        Возвращает временный ключ, который потом переводится в постоянный через promote_staged.
+        """
+        max_size: int = settings.minio.MAX_UPLOAD_SIZE
+        if file.size is not None and file.size > max_size:
+            raise self.FileTooLargeException
+        await file.seek(0)
+        stream = _LimitedReader(file.file, limit=max_size, exception=self.FileTooLargeException)
+        staging_key: str = f'{_STAGING_PREFIX}{uuid.uuid4()}'
+        content_type = getattr(file, 'content_type') or 'image/jpeg'
+        await self.create(stream, staging_key, content_type, length=file.size if file.size is not None else -1)
+        metrics.UPLOAD_BYTES.inc('staged', amount=stream.bytes_read)
+        return staging_key
+
+    @metrics.instrumented(metrics.FILE_SERVICE_SECONDS, metrics.FILE_SERVICE_ERRORS)
+    async def promote_staged(self, staging_key: str) -> (str, str):
+        """
+        Переводит временный файл под постоянный ключ - хэш содержимого, копируя его на стороне хранилища.
+        Если файл с таким содержимым уже есть, копия не создается. Временный файл остается: мем на постоянный ключ
+        создается с ensure_promoted в транзакции, и только после коммита временный файл можно удалить.
+        Возвращает etag и ключ файла.
+        """
+        try:
+            key: str = await storage.run_sync(self._hash_object, staging_key)
+        except error.S3Error:
+            raise self.NothingFoundException
+        return await self._promote(staging_key, key), key
+
+    async def _promote(self, staging_key: str, key: str) -> str:
+        """Копирует временный файл под ключ key, если такого файла еще нет. Возвращает etag файла"""
+        try:
+            stat = await storage.run_sync(self.client.stat_object, self.bucket, key)
+            return stat.etag
+        except error.S3Error:
+            pass
+        try:
+            result = await storage.run_sync(self.client.copy_object, self.bucket, key,
+                                            CopySource(self.bucket, staging_key))
+        except error.S3Error:
+            raise self.NothingFoundException
+        return result.etag
+
+    @metrics.instrumented(metrics.FILE_SERVICE_SECONDS, metrics.FILE_SERVICE_ERRORS)
+    async def ensure_promoted(self, staging_key: str, key: str) -> None:
+        """
+        То же, что ensure_file, для файла, переведенного promote_staged: если его успели удалить, он снова
+        копируется из временного файла
+        """
+        await self._promote(staging_key, key)
+
+    @metrics.instrumented(metrics.FILE_SERVICE_SECONDS, metrics.FILE_SERVICE_ERRORS)
+    async def start_multipart(self, content_type: str) -> (str, str):
+        """Начинает multipart-загрузку под новым временным ключом. Возвращает ключ и идентификатор загрузки в S3"""
+        key: str = f'{_STAGING_PREFIX}uploads/{uuid.uuid4()}'
+        try:
+            s3_upload_id: str = await storage.run_sync(self.client._create_multipart_upload, self.bucket, key,
+                                                       {'Content-Type': content_type})
+        except error.S3Error:
+            raise self.DBConstrainException
+        return key, s3_upload_id
+
+    @metrics.instrumented(metrics.FILE_SERVICE_SECONDS, metrics.FILE_SERVICE_ERRORS)
+    async def upload_part(self, key: str, s3_upload_id: str, part_number: int, data: bytes) -> str:
+        """Загружает часть part_number. Повторная загрузка части заменяет ее. Возвращает etag части"""
+        try:
+            etag: str = await storage.run_sync(self.client._upload_part, self.bucket, key, data, None,
+                                               s3_upload_id, part_number)
+        except error.S3Error as _exc:
+            if _exc.code == 'NoSuchUpload':
+                raise self.NothingFoundException
+            raise self.DBConstrainException
+        metrics.UPLOAD_BYTES.inc('multipart', amount=len(data))
+        return etag
+
+    @metrics.instrumented(metrics.FILE_SERVICE_SECONDS, metrics.FILE_SERVICE_ERRORS)
+    async def complete_multipart(self, key: str, s3_upload_id: str, parts: list[schemas.UploadPart]) -> None:
+        """
+        Собирает файл из частей на стороне хранилища. Части должны идти с первой без пропусков, все, кроме последней,
+        не меньше _MIN_PART_SIZE (ограничение S3), а файл - не больше settings.minio.MAX_UPLOAD_SIZE.
+        Иначе поднимает InvalidUploadException, и загрузку можно продолжить.
+        Уже собранный файл не ошибка: завершение, сорвавшееся после сборки, можно повторить
+        """
+        if (not parts
+                or [part.part_number for part in parts] != list(range(1, len(parts) + 1))
+                or any(part.size < _MIN_PART_SIZE for part in parts[:-1])
+                or sum(part.size for part in parts) > settings.minio.MAX_UPLOAD_SIZE):
+            raise self.InvalidUploadException
+        try:
+            await storage.run_sync(self.client._complete_multipart_upload, self.bucket, key, s3_upload_id,
+                                   [Part(part.part_number, part.etag) for part in parts])
+        except error.S3Error as _exc:
+            if _exc.code in ('InvalidPart', 'InvalidPartOrder', 'EntityTooSmall'):
+                raise self.InvalidUploadException
+            if _exc.code == 'NoSuchUpload':
+                try:
+                    await storage.run_sync(self.client.stat_object, self.bucket, key)
+                    return
+                except error.S3Error:
+                    raise self.NothingFoundException
+            raise self.DBConstrainException
+
+    @metrics.instrumented(metrics.FILE_SERVICE_SECONDS, metrics.FILE_SERVICE_ERRORS)
+    async def abort_multipart(self, key: str, s3_upload_id: str) -> None:
+        """Прерывает multipart-загрузку, удаляя ее части. Уже прерванная или собранная загрузка не ошибка"""
+        try:
+            await storage.run_sync(self.client._abort_multipart_upload, self.bucket, key, s3_upload_id)
+        except error.S3Error as _exc:
+            if _exc.code != 'NoSuchUpload':
+                raise self.DBConstrainException
 
-        result = self.client.put_object(self.bucket, filename, file_buffer, length=length_, content_type=content_type)
-        url = self.client.get_presigned_url("GET", self.bucket, filename)
-        return url, result.etag
+    def presign_upload(self, content_type: str) -> schemas.DirectUpload:
+        """
+        Выдает политику presigned POST под новый ключ: клиент загружает файл прямо в хранилище, минуя приложение.
+        Ключ, тип содержимого и размер (от 1 байта до settings.minio.MAX_UPLOAD_SIZE) проверяет само хранилище.
+        Политика подписывается локально, без запросов в хранилище
+        """
+        key: str = f'{_DIRECT_PREFIX}{uuid.uuid4()}'
+        expires_at: datetime = datetime.now(timezone.utc) + timedelta(seconds=settings.uploads.DIRECT_URL_EXPIRES)
+        policy = PostPolicy(self.bucket, expires_at)
+        policy.add_equals_condition('key', key)
+        policy.add_equals_condition('Content-Type', content_type)
+        policy.add_content_length_range_condition(1, settings.minio.MAX_UPLOAD_SIZE)
+        fields: dict[str, str] = self.client.presigned_post_policy(policy)
+        scheme: str = 'https' if settings.minio.SECURE else 'http'
+        return schemas.DirectUpload(key=key,
+                                    url=f'{scheme}://{settings.minio.uri}/{self.bucket}',
+                                    fields={'key': key, 'Content-Type': content_type, **fields},
+                                    expires_at=expires_at)
 
-    def _prevent_file_rewriting(self, filename: str) -> str:
+    @metrics.instrumented(metrics.FILE_SERVICE_SECONDS, metrics.FILE_SERVICE_ERRORS)
+    async def check_direct_upload(self, key: str) -> (str, str):
         """
-        Возвращает новое название файла, если файл с таким названием уже существует.
-        Если перезаписывать файл другим содержанием и таким же названием,
-        то все ссылки старые ссылки будут вести на файл с новым содержанием.
+        Проверяет файл, загруженный по политике presign_upload, одним stat_object: ключ выдан presign_upload,
+        файл есть, это изображение не больше settings.minio.MAX_UPLOAD_SIZE и не старше settings.uploads.TTL
+        (более старые удаляет воркер). Файл остается под своим ключом: содержимое не читается и не хэшируется.
+        Возвращает etag и ключ файла
         """
+        if not _DIRECT_KEY.fullmatch(key):
+            raise self.InvalidDirectUploadException
+        stat = await self.stat(key)
+        if (not 0 < stat.size <= settings.minio.MAX_UPLOAD_SIZE
+                or not (stat.content_type or '').startswith('image/')
+                or stat.last_modified is not None
+                and stat.last_modified < datetime.now(timezone.utc) - timedelta(seconds=settings.uploads.TTL)):
+            raise self.InvalidDirectUploadException
+        return stat.etag, key
+
+    def _list_stale(self, prefix: str, older_than: timedelta) -> list[str]:
+        deadline: datetime = datetime.now(timezone.utc) - older_than
+        return [obj.object_name for obj in self.client.list_objects(self.bucket, prefix=prefix, recursive=True)
+                if obj.last_modified is not None and obj.last_modified < deadline]
+
+    @metrics.instrumented(metrics.FILE_SERVICE_SECONDS, metrics.FILE_SERVICE_ERRORS)
+    async def stale_direct_uploads(self, older_than: timedelta) -> list[str]:
+        """Ключи файлов, загруженных прямо в хранилище раньше, чем older_than назад"""
         try:
-            while self.client.stat_object(self.bucket, filename):
-                filename = f'{filename}{str(uuid.uuid4())}'
+            return await storage.run_sync(self._list_stale, _DIRECT_PREFIX, older_than)
+        except error.S3Error:
+            raise self.DBConstrainException
+
+    @metrics.instrumented(metrics.FILE_SERVICE_SECONDS, metrics.FILE_SERVICE_ERRORS)
+    async def upload_file(self, file: UploadFile) -> (str, str):
+        """
+        Загружает файл запроса в хранилище под ключом - хэшем содержимого, не вычитывая его в память целиком.
+        Если файл с таким содержимым уже есть в хранилище, повторно не загружает. Пока на файл не сослался мем,
+        его могут удалить, поэтому мем по нему создается с ensure_file в транзакции.
+        Возвращает etag и ключ файла.
+        Поднимает FileTooLargeException, если файл больше settings.minio.MAX_UPLOAD_SIZE,
+        и DBConstrainException, если хранилище отказало в записи.
+        """
+        max_size: int = settings.minio.MAX_UPLOAD_SIZE
+        if file.size is not None and file.size > max_size:
+            raise self.FileTooLargeException
+        await file.seek(0)
+        stream = _LimitedReader(file.file, limit=max_size, exception=self.FileTooLargeException)
+        key: str = await storage.run_sync(self._hash_stream, stream)
+        metrics.UPLOAD_BYTES.inc('direct', amount=stream.bytes_read)
+        try:
+            stat = await storage.run_sync(self.client.stat_object, self.bucket, key)
+            return stat.etag, key
         except error.S3Error:
             pass
-        return filename
+        await file.seek(0)
+        content_type = getattr(file, 'content_type') or 'image/jpeg'
+        try:
+            etag = await self.create(file.file, key, content_type, length=stream.bytes_read)
+        except error.S3Error as _exc:
+            raise self.DBConstrainException from _exc
+        return etag, key
 
-    async def upload_file(self, file: UploadFile, prevent_rewriting: bool = True) -> (str, str):
-        data = await file.read()
-        filename = getattr(file, 'filename') or f'file{str(uuid.uuid4())}'
-        if prevent_rewriting:
-            filename = self._prevent_file_rewriting(filename)
+    @metrics.instrumented(metrics.FILE_SERVICE_SECONDS, metrics.FILE_SERVICE_ERRORS)
+    async def ensure_file(self, key: str, file: UploadFile) -> None:
+        """
+        Проверяет, что файл key, загруженный upload_file, на месте, и загружает его из file заново, если его успели
+        удалить как файл, на который никто не ссылается (см. MemeRepository.reap_files).
+        Вызывается в транзакции, которая уже взяла ссылку на файл: после нее файл удалить не могут
+        """
+        try:
+            await storage.run_sync(self.client.stat_object, self.bucket, key)
+            return
+        except error.S3Error:
+            pass
+        await file.seek(0)
         content_type = getattr(file, 'content_type') or 'image/jpeg'
-        return await self.create(data, filename, content_type)
+        try:
+            await self.create(file.file, key, content_type, length=file.size if file.size is not None else -1)
+        except error.S3Error as _exc:
+            raise self.DBConstrainException from _exc
+
+    def _remove_derivatives(self, name: str) -> None:
+        prefix: str = f'{name}{_DERIVATIVES_SUFFIX}'
+        for obj in self.client.list_objects(self.bucket, prefix=prefix, recursive=True):
+            self.client.remove_object(self.bucket, obj.object_name)
 
+    @metrics.instrumented(metrics.FILE_SERVICE_SECONDS, metrics.FILE_SERVICE_ERRORS)
     async def delete_file_by_name(self, name: str) -> None:
+        """Удаляет файл вместе с его производными копиями"""
         try:
-            return self.client.remove_object(self.bucket, name)
+            await storage.run_sync(self._remove_derivatives, name)
+            return await storage.run_sync(self.client.remove_object, self.bucket, name)
         except error.S3Error:
             raise self.NothingFoundException
 
+    def _remove_objects(self, keys: list[str]) -> list[str]:
+        # remove_objects ленивый: запросы DeleteObjects (до 1000 ключей в каждом) уходят при переборе ошибок
+        errors = self.client.remove_objects(self.bucket, [DeleteObject(key) for key in keys])
+        return [delete_error.name for delete_error in errors]
+
+    @metrics.instrumented(metrics.FILE_SERVICE_SECONDS, metrics.FILE_SERVICE_ERRORS)
+    async def delete_files(self, keys: list[str]) -> set[str]:
+        """
+        Удаляет файлы вместе с их копиями в настроенных размерах и форматах пакетными запросами к хранилищу,
+        без перебора копий через list_objects. Возвращает ключи, которые удалить не удалось.
+        """
+        if not keys:
+            return set()
+        keys = list(dict.fromkeys([*keys, *(self.derivative_key(key, f'{size}.{fmt}')
+                                            for key in keys if _DERIVATIVES_SUFFIX not in key
+                                            for size in settings.derivatives.SIZES
+                                            for fmt in settings.derivatives.FORMATS)]))
+        try:
+            return set(await storage.run_sync(self._remove_objects, keys))
+        except error.S3Error:
+            return set(keys)
+
+    @metrics.instrumented(metrics.FILE_SERVICE_SECONDS, metrics.FILE_SERVICE_ERRORS)
     async def get_etag_by_name(self, name: str) -> str:
         try:
-            return self.client.stat_object(self.bucket, name).etag
+            stat = await storage.run_sync(self.client.stat_object, self.bucket, name)
+            return stat.etag
         except error.S3Error:
             raise self.NothingFoundException
 
@@ -256,3 +1275,48 @@ class FileService(AbstractFileRepo):
 
     class MultipleObjectsException(Exception):
         message = "Found more than one file"
+
+    class InvalidUploadException(Exception):
+        message = "Upload parts are missing, out of order or too small"
+
+    class InvalidDirectUploadException(Exception):
+        message = "Uploaded file was not issued an upload policy, is not an image, is too large or expired"
+
+    class FileTooLargeException(Exception):
+        message = "File is too large"
+
+    class NotSupportedException(Exception):
+        message = "Not supported by the storage backend"
+
+
+class LocalFileService(FileService):
+    """
+    Файлы на локальном диске (storages.local) вместо MinIO, для однонодовых установок: те же ключи, etag и удаление.
+    Ссылки get_url ведут на отдачу файлов публичным приложением, загрузки прямо в хранилище не поддерживаются
+    """
+    _urls = cache.TTLCache(maxsize=settings.minio.URL_CACHE_SIZE, ttl=settings.minio.URL_EXPIRES // 2)
+
+    _self = None
+
+    @property
+    def client(self):
+        return local_storage.get_store()
+
+    def local_path(self, key: str) -> Path | None:
+        try:
+            return self.client.path(self.bucket, key)
+        except error.S3Error:
+            return None
+
+    def verify_url(self, key: str, expires: int, signature: str) -> bool:
+        return self.client.verify_url(key, expires, signature)
+
+    def presign_upload(self, content_type: str) -> schemas.DirectUpload:
+        raise self.NotSupportedException
+
+
+def get_file_service() -> FileService:
+    """Репозиторий файлов по settings.storage.BACKEND"""
+    if settings.storage.BACKEND == 'local':
+        return LocalFileService()
+    return FileService()
@@ -1,4 +1,9 @@
-from pydantic import BaseModel
+from datetime import datetime
+from typing import Generic, TypeVar
+
+from pydantic import BaseModel, Field, model_validator
+
+T = TypeVar('T')
 
 
 class MemeCreate(BaseModel):
@@ -9,13 +14,110 @@ class MemeCreate(BaseModel):
 
 class MemeEnriched(MemeCreate):
     """Используется после загрузки файла мема в хранилище"""
-    url: str
     etag: str
+    file_key: str
 
 
 class Meme(MemeEnriched):
     """Используется после загрузки мема в БД"""
     id: int
+    version: int = Field(default=1, exclude=True)
+    url: str | None = None  # подписанная ссылка на файл, выдается при чтении, в БД не хранится
+    variants: dict[str, str] | None = Field(default=None, exclude=True)
+
+    class Config:
+        from_attributes = True
+
+
+class MemeBatchItem(BaseModel):
+    """Результат создания одного мема из пакета: созданный мем или причина отказа"""
+    index: int
+    meme: Meme | None = None
+    error: str | None = None
+
+
+class MemeBulkDelete(BaseModel):
+    """Какие мемы удалить: по списку id и/или по совпадению полей. Без условий запрос не принимается"""
+    ids: list[int] | None = None
+    title: str | None = None
+    file_key: str | None = None
+
+    @model_validator(mode='after')
+    def check_not_empty(self) -> 'MemeBulkDelete':
+        if self.ids is None and self.title is None and self.file_key is None:
+            raise ValueError('ids or a filter should be provided')
+        return self
+
+    def filters(self) -> dict:
+        return self.model_dump(exclude={'ids'}, exclude_none=True)
+
+
+class MemeBulkDeleteItem(BaseModel):
+    """Результат удаления одного мема: удален ли мем и ошибка, если мем не найден или его файл не удален"""
+    id: int
+    deleted: bool
+    error: str | None = None
+
+
+class UploadJobCreate(MemeCreate):
+    """Используется при постановке загрузки мема в очередь"""
+    staging_key: str
+    content_type: str
+
+
+class UploadJob(BaseModel):
+    """Состояние задачи асинхронной загрузки мема"""
+    id: int
+    status: str
+    meme_id: int | None = None
+    error: str | None = None
 
     class Config:
         from_attributes = True
+
+
+class UploadCreate(MemeCreate):
+    """Начало загрузки мема по частям"""
+    content_type: str = 'image/jpeg'
+
+
+class UploadPart(BaseModel):
+    part_number: int
+    etag: str
+    size: int
+
+    class Config:
+        from_attributes = True
+
+
+class Upload(BaseModel):
+    """Состояние загрузки по частям: загруженные части, чтобы докачать только недостающие, и мем после завершения"""
+    id: str
+    status: str
+    parts: list[UploadPart] = []
+    meme_id: int | None = None
+
+
+class DirectUploadCreate(BaseModel):
+    """Запрос политики загрузки файла прямо в хранилище. Принимаются только изображения"""
+    content_type: str = Field(default='image/jpeg', pattern=r'^image/[\w.+-]+$')
+
+
+class DirectUpload(BaseModel):
+    """Политика presigned POST: файл отправляется формой multipart/form-data на url с полями fields и полем file"""
+    key: str
+    url: str
+    fields: dict[str, str]
+    expires_at: datetime
+
+
+class DirectUploadComplete(MemeCreate):
+    """Создание мема по файлу, загруженному прямо в хранилище"""
+    key: str
+
+
+class CursorPage(BaseModel, Generic[T]):
+    """Страница выдачи с непрозрачным курсором на следующую страницу"""
+    items: list[T]
+    next_cursor: str | None = None
+    total: int | None = None
@@ -0,0 +1,33 @@
+"""
+Прогрев приложения при старте: соединение с БД и бакет хранилища готовятся параллельно и в пределах
+settings.web_app.STARTUP_TIMEOUT. Импорт модулей приложения ни в сеть, ни в БД не ходит.
+"""
+import logging
+import time
+
+import anyio
+
+from src.config import get_settings
+from src.core.abstracts import AbstractDBRepo, AbstractFileRepo
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+startup_seconds: float | None = None
+
+
+async def warm_up(db_repo: AbstractDBRepo, file_service: AbstractFileRepo) -> float:
+    """
+    Открывает первое соединение пула БД и создает бакет, если его нет. Возвращает время прогрева.
+    Не уложившись в settings.web_app.STARTUP_TIMEOUT, поднимает TimeoutError: приложение не стартует,
+    вместо того чтобы зависнуть на недоступной зависимости.
+    """
+    global startup_seconds
+    started: float = time.perf_counter()
+    with anyio.fail_after(settings.web_app.STARTUP_TIMEOUT):
+        async with anyio.create_task_group() as task_group:
+            task_group.start_soon(db_repo.ping)
+            task_group.start_soon(file_service.ensure_bucket)
+    startup_seconds = time.perf_counter() - started
+    logger.info('Warmed up in %.3fs', startup_seconds)
+    return startup_seconds
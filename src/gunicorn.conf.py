@@ -0,0 +1,27 @@
+"""
+Боевой запуск: gunicorn --config gunicorn.conf.py --bind 0.0.0.0:<порт> src.public.app:app
+Переменные WEB_SERVER_* - см. src/config.py
+"""
+import multiprocessing
+
+from src.config import get_settings
+
+settings = get_settings()
+
+worker_class = 'src.server.Worker'
+workers = settings.web_server.WORKERS or multiprocessing.cpu_count()
+# приложение импортируется в мастере один раз до форка: воркеры стартуют быстрее и делят память кода
+preload_app = True
+timeout = settings.web_server.TIMEOUT
+graceful_timeout = settings.web_server.GRACEFUL_TIMEOUT
+keepalive = settings.web_server.KEEPALIVE
+max_requests = settings.web_server.MAX_REQUESTS
+max_requests_jitter = settings.web_server.MAX_REQUESTS_JITTER
+accesslog = '-'
+
+
+def post_fork(server, worker):
+    # движок создается лениво, но если мастер его успел создать, соединения его пула не должны переходить в воркеры
+    from src.storages import postgres
+    if postgres.get_engine.cache_info().currsize:
+        postgres.get_engine().sync_engine.dispose(close=False)
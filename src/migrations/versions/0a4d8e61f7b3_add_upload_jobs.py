@@ -0,0 +1,41 @@
+"""add upload jobs
+
+Revision ID: 0a4d8e61f7b3
+Revises: f2b96a4e0c18
+Create Date: 2026-10-18 16:48:39.095127
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0a4d8e61f7b3'
+down_revision: Union[str, None] = 'f2b96a4e0c18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('upload_jobs',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('title', sa.String(), nullable=True),
+    sa.Column('content', sa.String(), nullable=True),
+    sa.Column('staging_key', sa.String(), nullable=False),
+    sa.Column('content_type', sa.String(), nullable=True),
+    sa.Column('meme_id', sa.Integer(), nullable=True),
+    sa.Column('error', sa.String(), nullable=True),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('updated_at', sa.DateTime(timezone=True), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_upload_jobs_status_id', 'upload_jobs', ['status', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_upload_jobs_status_id', table_name='upload_jobs')
+    op.drop_table('upload_jobs')
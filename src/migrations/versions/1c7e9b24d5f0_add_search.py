@@ -0,0 +1,38 @@
+"""add search
+
+Revision ID: 1c7e9b24d5f0
+Revises: 0a4d8e61f7b3
+Create Date: 2026-10-18 17:35:51.218406
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '1c7e9b24d5f0'
+down_revision: Union[str, None] = '0a4d8e61f7b3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # поисковый вектор - вычисляемый столбец только PostgreSQL, поэтому в модели его нет
+    # (см. MemeRepository.search_memes), конфигурация должна совпадать с repositories._SEARCH_CONFIG
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.execute("""
+        ALTER TABLE memes ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+            setweight(to_tsvector('russian', coalesce(title, '')), 'A') ||
+            setweight(to_tsvector('russian', coalesce(content, '')), 'B')
+        ) STORED
+    """)
+    op.create_index('ix_memes_search_vector', 'memes', ['search_vector'], postgresql_using='gin')
+    op.create_index('ix_memes_title_trgm', 'memes', [sa.text('title gin_trgm_ops')], postgresql_using='gin')
+
+
+def downgrade() -> None:
+    op.drop_index('ix_memes_title_trgm', table_name='memes')
+    op.drop_index('ix_memes_search_vector', table_name='memes')
+    op.drop_column('memes', 'search_vector')
@@ -0,0 +1,49 @@
+"""add uploads
+
+Revision ID: 5d2f8a6c3e71
+Revises: 1c7e9b24d5f0
+Create Date: 2026-10-18 21:12:05.482310
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5d2f8a6c3e71'
+down_revision: Union[str, None] = '1c7e9b24d5f0'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('uploads',
+    sa.Column('id', sa.String(), nullable=False),
+    sa.Column('status', sa.String(), nullable=False),
+    sa.Column('title', sa.String(), nullable=True),
+    sa.Column('content', sa.String(), nullable=True),
+    sa.Column('content_type', sa.String(), nullable=True),
+    sa.Column('object_key', sa.String(), nullable=False),
+    sa.Column('s3_upload_id', sa.String(), nullable=False),
+    sa.Column('meme_id', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('updated_at', sa.DateTime(timezone=True), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_uploads_updated_at', 'uploads', ['updated_at'], unique=False)
+    op.create_table('upload_parts',
+    sa.Column('upload_id', sa.String(), nullable=False),
+    sa.Column('part_number', sa.Integer(), nullable=False),
+    sa.Column('etag', sa.String(), nullable=False),
+    sa.Column('size', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['upload_id'], ['uploads.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('upload_id', 'part_number')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('upload_parts')
+    op.drop_index('ix_uploads_updated_at', table_name='uploads')
+    op.drop_table('uploads')
@@ -0,0 +1,28 @@
+"""add upload job file
+
+Revision ID: 9c4e2d7a1b35
+Revises: 5d2f8a6c3e71
+Create Date: 2026-10-18 23:02:41.316204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9c4e2d7a1b35'
+down_revision: Union[str, None] = '5d2f8a6c3e71'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('upload_jobs', sa.Column('file_key', sa.String(), nullable=True))
+    op.add_column('upload_jobs', sa.Column('etag', sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('upload_jobs', 'etag')
+    op.drop_column('upload_jobs', 'file_key')
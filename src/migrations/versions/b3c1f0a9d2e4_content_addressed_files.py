@@ -0,0 +1,50 @@
+"""content addressed files
+
+Revision ID: b3c1f0a9d2e4
+Revises: 7e17ba85aea2
+Create Date: 2026-10-18 10:12:31.402118
+
+"""
+from typing import Sequence, Union
+from urllib.parse import unquote, urlsplit
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b3c1f0a9d2e4'
+down_revision: Union[str, None] = '7e17ba85aea2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _backfill_file_keys(where: str) -> None:
+    """
+    Старые файлы лежат под своими именами: ключ - последний сегмент пути presigned url.
+    В url имя закодировано (пробелы, кириллица - %XX), в хранилище - нет, поэтому сегмент декодируется
+    """
+    connection = op.get_bind()
+    rows = connection.execute(sa.text(f"SELECT id, url FROM memes WHERE {where}")).all()
+    keys: list[dict] = [{'id': id, 'file_key': unquote(urlsplit(url).path.rsplit('/', 1)[-1])} for id, url in rows]
+    if keys:
+        connection.execute(sa.text("UPDATE memes SET file_key = :file_key WHERE id = :id"), keys)
+
+
+def upgrade() -> None:
+    op.create_table('meme_files',
+    sa.Column('key', sa.String(), nullable=False),
+    sa.Column('refcount', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('key')
+    )
+    op.add_column('memes', sa.Column('file_key', sa.String(), nullable=True))
+    op.create_index(op.f('ix_memes_file_key'), 'memes', ['file_key'], unique=False)
+    _backfill_file_keys("url IS NOT NULL")
+    op.execute("INSERT INTO meme_files (key, refcount) "
+               "SELECT file_key, count(*) FROM memes WHERE file_key IS NOT NULL GROUP BY file_key")
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_memes_file_key'), table_name='memes')
+    op.drop_column('memes', 'file_key')
+    op.drop_table('meme_files')
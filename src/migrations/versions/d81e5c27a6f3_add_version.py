@@ -0,0 +1,26 @@
+"""add version
+
+Revision ID: d81e5c27a6f3
+Revises: b3c1f0a9d2e4
+Create Date: 2026-10-18 12:40:05.771902
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd81e5c27a6f3'
+down_revision: Union[str, None] = 'b3c1f0a9d2e4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('memes', sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+
+
+def downgrade() -> None:
+    op.drop_column('memes', 'version')
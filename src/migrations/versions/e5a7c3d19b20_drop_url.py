@@ -0,0 +1,30 @@
+"""drop url
+
+Revision ID: e5a7c3d19b20
+Revises: d81e5c27a6f3
+Create Date: 2026-10-18 14:02:47.318560
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e5a7c3d19b20'
+down_revision: Union[str, None] = 'd81e5c27a6f3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # ключ файла - источник истины, ссылка подписывается при чтении.
+    # Ключи старых мемов и счетчики ссылок на файлы заполнила b3c1f0a9d2e4, новые мемы создаются с ключом
+    op.drop_column('memes', 'url')
+
+
+def downgrade() -> None:
+    # подписанные ссылки не восстановить, вместо них - путь к объекту в бакете
+    op.add_column('memes', sa.Column('url', sa.String(), nullable=True))
+    op.execute("UPDATE memes SET url = file_key")
@@ -0,0 +1,26 @@
+"""add variants
+
+Revision ID: f2b96a4e0c18
+Revises: e5a7c3d19b20
+Create Date: 2026-10-18 15:27:12.604311
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2b96a4e0c18'
+down_revision: Union[str, None] = 'e5a7c3d19b20'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('memes', sa.Column('variants', sa.JSON(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('memes', 'variants')
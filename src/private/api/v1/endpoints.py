@@ -1,72 +1,116 @@
-from fastapi import APIRouter, HTTPException, Depends, UploadFile, Security
-from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
-from starlette import status
+from fastapi import APIRouter, HTTPException, Depends, UploadFile, BackgroundTasks
+from starlette.requests import Request
 from starlette.responses import Response
 
 from src.config import get_settings
-from src.core import repositories, schemas
+from src.core import admission, auth, repositories, schemas, derivatives
 
-router = APIRouter()
-security = HTTPBearer()
 settings = get_settings()
-meme_repo = repositories.MemeRepository()
-file_service = repositories.FileService()
 
 
-def authenticate_admin(credentials: HTTPAuthorizationCredentials = Security(security)):
-    if not credentials.credentials == settings.web_private.API_KEY:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid token",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
+def get_meme_repo():
+    return repositories.MemeRepository()
+
+
+def get_file_service():
+    return repositories.get_file_service()
+
+
+def _file_remover(file_service, orphans: dict[str, list[str]]):
+    """Удаляет файлы вместе с копиями, записанными в мемах, которые на них ссылались (см. reap_files)"""
+    return lambda keys: file_service.delete_files([key for file_key in keys for key in (*orphans[file_key], file_key)])
+
+
+class AdminRoute(admission.AdmissionRoute):
+    """Маршрут приватного API: ключ администратора проверяется до того, как запрос займет слот ограничителя"""
+
+    async def before_admission(self, request: Request) -> None:
+        auth.authenticate_admin(credentials=await auth.security(request))
+
+
+router = APIRouter(route_class=AdminRoute, dependencies=[Depends(auth.authenticate_admin)])
 
 
 @router.put("/memes/{meme_id}")
+@admission.limited('upload')
 async def put_meme(meme_id: int,
                    file: UploadFile,
+                   background_tasks: BackgroundTasks,
                    meme: schemas.MemeCreate = Depends(),
-                   credentials: HTTPAuthorizationCredentials = Security(security)) -> schemas.Meme:
+                   meme_repo=Depends(get_meme_repo),
+                   file_service=Depends(get_file_service)) -> schemas.Meme:
     """
     Заменяет объект целиком, включая файл.
-    Если файл объекта используется, только в текущем меме, то удаляет старый файл.
+    Если старый файл больше не используется ни одним мемом, то удаляет его.
     """
-    authenticate_admin(credentials=credentials)
-
     try:
-        etag: str = await meme_repo.get_etag(id=meme_id)
-        file_not_shared: bool = await meme_repo.is_etag_unique(etag=etag)
-        if file_not_shared:
-            name: str = await meme_repo.get_meme_file_name(id=meme_id)
-            await file_service.delete_file_by_name(name=name)
-        new_file_url, new_etag = await file_service.upload_file(file=file)
-        new_meme = schemas.MemeEnriched(**meme.dict(), url=new_file_url, etag=new_etag)
-        return await meme_repo.update_or_create(filter={"id": meme_id},     # noqa
-                                                data=new_meme.model_dump(),
-                                                as_pd=True)
+        # новый файл загружается до транзакции, чтобы не держать блокировку строки мема на время загрузки
+        new_etag, new_file_key = await file_service.upload_file(file=file)
+    except file_service.FileTooLargeException as _e:
+        raise HTTPException(status_code=413, detail=_e.message)
+    except file_service.DBConstrainException as _e:
+        raise HTTPException(status_code=500, detail=_e.message)
+    new_meme = schemas.MemeEnriched(**meme.dict(), etag=new_etag, file_key=new_file_key)
+    try:
+        updated_meme, orphans = await meme_repo.replace_meme(
+            id=meme_id, meme=new_meme, before_commit=lambda: file_service.ensure_file(new_file_key, file))
     except meme_repo.NothingFoundException as _e:
+        # ссылку на новый файл мем так и не взял: reap_files удалит его, только если на него не ссылается другой мем
+        await meme_repo.reap_files([new_file_key], file_service.delete_files)
         raise HTTPException(status_code=404, detail=_e.message)
+    except file_service.DBConstrainException as _e:
+        raise HTTPException(status_code=500, detail=_e.message)
+    if orphans:
+        await meme_repo.reap_files(list(orphans), _file_remover(file_service, orphans))
+    background_tasks.add_task(derivatives.process_meme, meme_id, new_file_key, meme_repo, file_service)
+    return updated_meme.model_copy(update={'url': file_service.get_url(new_file_key)})
 
 
 @router.delete("/memes/{meme_id}")
-async def delete_meme(meme_id: int, credentials: HTTPAuthorizationCredentials = Security(security)):
+@admission.limited('write')
+async def delete_meme(meme_id: int,
+                      meme_repo=Depends(get_meme_repo),
+                      file_service=Depends(get_file_service)):
     """
-    Удаляет объект целиком, включая файл, если он используется, только в текущем меме.
+    Удаляет объект целиком, включая файл, если он больше не используется ни одним мемом.
+    Файл удаляется после коммита удаления мема.
     """
-    authenticate_admin(credentials=credentials)
     try:
-        etag: str = await meme_repo.get_etag(id=meme_id)
-        file_not_shared: bool = await meme_repo.is_etag_unique(etag=etag)
-        if file_not_shared:
-            name: str = await meme_repo.get_meme_file_name(id=meme_id)
-            await file_service.delete_file_by_name(name=name)
-        await meme_repo.delete_meme_by_id(id=meme_id)
-        return Response(status_code=200)
-
+        orphans: dict[str, list[str]] = await meme_repo.delete_meme_by_id(id=meme_id)
     except meme_repo.NothingFoundException as _e:
         raise HTTPException(status_code=404, detail=_e.message)
     except meme_repo.DBConstrainException as _e:
         raise HTTPException(status_code=500, detail=_e.message)
+    if orphans:
+        await meme_repo.reap_files(list(orphans), _file_remover(file_service, orphans))
+    return Response(status_code=200)
 
 
-
+@router.post("/memes/bulk-delete")
+@admission.limited('write')
+async def bulk_delete_memes(query: schemas.MemeBulkDelete,
+                            meme_repo=Depends(get_meme_repo),
+                            file_service=Depends(get_file_service)) -> list[schemas.MemeBulkDeleteItem]:
+    """
+    Удаляет мемы по списку id и/или фильтру одним запросом в БД.
+    Файлы, которые больше не используются ни одним мемом, удаляются из хранилища пакетными запросами
+    после удаления мемов. Результат - по каждому id: удаленному, найденному по фильтру или не найденному.
+    В одном запросе не больше settings.web_private.BULK_DELETE_MAX_SIZE id. По фильтру за запрос удаляется
+    не больше стольких же мемов с наименьшими id, остальные - следующими запросами.
+    """
+    if query.ids is not None and len(query.ids) > settings.web_private.BULK_DELETE_MAX_SIZE:
+        raise HTTPException(status_code=413,
+                            detail=f"Bulk delete is limited to {settings.web_private.BULK_DELETE_MAX_SIZE} ids")
+    deleted, orphans = await meme_repo.delete_memes(ids=query.ids,
+                                                    limit=settings.web_private.BULK_DELETE_MAX_SIZE,
+                                                    **query.filters())
+    failed_keys: set[str] = await meme_repo.reap_files(list(orphans), _file_remover(file_service, orphans))
+    results: list[schemas.MemeBulkDeleteItem] = [
+        schemas.MemeBulkDeleteItem(id=id,
+                                   deleted=True,
+                                   error=file_service.DBConstrainException.message if file_key in failed_keys else None)
+        for id, file_key in deleted.items()
+    ]
+    results.extend(schemas.MemeBulkDeleteItem(id=id, deleted=False, error=meme_repo.NothingFoundException.message)
+                   for id in dict.fromkeys(query.ids or []) if id not in deleted)
+    return results
@@ -1,22 +1,57 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+
+import anyio
+from fastapi import FastAPI, Depends
 from fastapi_pagination import add_pagination
 from starlette.responses import Response
 
 from src.config import get_settings
+from src.core import admission, auth, metrics, startup
+from src.storages import postgres
 from src.private.api.v1 import endpoints
 
 settings = get_settings()
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await startup.warm_up(endpoints.get_meme_repo(), endpoints.get_file_service())
+    async with anyio.create_task_group() as task_group:
+        task_group.start_soon(endpoints.get_meme_repo().replicas.watch)
+        yield
+        task_group.cancel_scope.cancel()
+
+
 app = FastAPI(
     title="MemesPrivateAPI",
     docs_url="/api/swagger-ui",
-    openapi_url="/api/openapi.json"
+    openapi_url="/api/openapi.json",
+    lifespan=lifespan
 )
 add_pagination(app)
 
+app.add_middleware(postgres.ReadYourWritesMiddleware)
+if metrics.enabled():
+    app.add_middleware(metrics.MetricsMiddleware, app_name='private')
+
 app.include_router(endpoints.router, prefix="/api/v1", tags=["memes"])
 
 
 @app.get(settings.web_app.HEALTHCHECK_PATH, include_in_schema=False)
 async def get_health():
     return Response(status_code=200)
+
+
+@app.get(settings.web_app.STATS_PATH, include_in_schema=False, dependencies=[Depends(auth.authenticate_admin)])
+async def get_stats(meme_repo=Depends(endpoints.get_meme_repo)):
+    return {'db_pool': meme_repo.pool_status(),
+            'db_replicas': meme_repo.replicas.status(),
+            'admission': admission.status(),
+            'startup_seconds': startup.startup_seconds}
+
+
+@app.get(settings.metrics.PATH, include_in_schema=False, dependencies=[Depends(auth.authenticate_admin)])
+async def get_metrics():
+    if not metrics.enabled():
+        return Response(status_code=404)
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
@@ -0,0 +1,49 @@
+import hashlib
+from typing import Iterable
+
+import sqlalchemy as sa
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+from src.core import schemas
+
+
+def _strong_etag(*parts) -> str:
+    digest: str = hashlib.sha256(':'.join(map(str, parts)).encode()).hexdigest()[:32]
+    return f'"{digest}"'
+
+
+def meme_etag(meme: schemas.Meme | sa.Row, url: str) -> str:
+    """
+    Сильный валидатор мема: id, версия строки, etag файла и отданная ссылка на файл.
+    Ссылка меняется со сменой окна подписи, поэтому клиент не продлит по 304 ответ с истекшей ссылкой.
+    """
+    return _strong_etag(meme.id, meme.version, meme.etag, url)
+
+
+def memes_etag(memes: Iterable[sa.Row], urls: Iterable[str], *extra) -> str:
+    """Валидатор страницы выдачи: валидаторы всех мемов страницы и прочие поля страницы (курсор, total)"""
+    return _strong_etag(*(meme_etag(meme, url) for meme, url in zip(memes, urls)), *extra)
+
+
+def is_not_modified(request: Request, etag: str) -> bool:
+    """Совпадает ли etag с одним из If-None-Match запроса (слабое сравнение, RFC 9110 13.1.2)"""
+    if_none_match: str | None = request.headers.get('if-none-match')
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    candidates = (tag.strip().removeprefix('W/') for tag in if_none_match.split(','))
+    return etag in candidates
+
+
+def conditional(request: Request, etag: str, cache_control: str) -> (Response | None, dict):
+    """
+    Заголовки ETag и Cache-Control для ответа и готовый ответ 304, если у клиента актуальная версия,
+    тогда тело ответа не нужно ни собирать, ни сериализовать
+    """
+    headers: dict = {'ETag': etag, 'Cache-Control': cache_control}
+    if is_not_modified(request, etag):
+        return Response(status_code=304, headers=headers), headers
+    return None, headers
@@ -1,15 +1,20 @@
+import contextlib
+import logging
 from typing import Annotated
 
-from fastapi import APIRouter, HTTPException, File, Depends, UploadFile
-from fastapi_pagination import Page
-from fastapi_pagination.ext.sqlalchemy import paginate
-from sqlalchemy import Select
+import anyio
+import sqlalchemy as sa
+from fastapi import (APIRouter, HTTPException, File, Depends, UploadFile, Query, Path, Request, Response, BackgroundTasks,
+                     Form)
+from fastapi.responses import FileResponse, ORJSONResponse, StreamingResponse
 
 from src.config import get_settings
-from src.core import repositories, schemas
+from src.core import admission, repositories, schemas, pagination, derivatives, models
+from src.public.api.v1 import caching, ranges
 
-router = APIRouter()
+router = APIRouter(route_class=admission.AdmissionRoute)
 settings = get_settings()
+logger = logging.getLogger(__name__)
 
 
 def get_meme_repo():
@@ -17,31 +22,500 @@ def get_meme_repo():
 
 
 def get_file_service():
-    return repositories.FileService()
+    return repositories.get_file_service()
 
 
-@router.get("/memes", response_model=Page[schemas.Meme])
-async def get_memes(meme_repo=Depends(get_meme_repo)) -> Page[schemas.Meme]:
-    memes_stmt: Select = await meme_repo.get_memes(as_stmt=True)
-    return await paginate(meme_repo.session, memes_stmt)
+def get_upload_job_repo():
+    return repositories.UploadJobRepository()
 
 
-@router.get("/memes/{meme_id}")
-async def get_meme(meme_id: int, meme_repo=Depends(get_meme_repo)) -> schemas.Meme:
+def get_upload_repo():
+    return repositories.UploadRepository()
+
+
+def _file_key(meme: schemas.Meme | sa.Row, variant: str | None) -> str:
+    """Ключ файла мема. Если запрошена уменьшенная копия variant и она уже построена - ключ копии"""
+    return (meme.variants or {}).get(variant, meme.file_key) if variant else meme.file_key
+
+
+def _url(meme: schemas.Meme | sa.Row, file_service: repositories.FileService, variant: str | None) -> str:
+    """Свежая подписанная ссылка на файл мема или на его уменьшенную копию variant"""
+    return file_service.get_url(_file_key(meme, variant))
+
+
+def with_url(meme: schemas.Meme, file_service: repositories.FileService, variant: str | None = None) -> schemas.Meme:
+    """Копия мема со свежей подписанной ссылкой на файл"""
+    return meme.model_copy(update={'url': _url(meme, file_service, variant)})
+
+
+# поля ответа в порядке schemas.Meme: без исключенных из сериализации и без url, который выдается отдельно
+_MEME_FIELDS: tuple[str, ...] = tuple(name for name, field in schemas.Meme.model_fields.items()
+                                     if not field.exclude and name != 'url')
+
+
+def meme_json(meme: schemas.Meme | sa.Row, url: str) -> dict:
+    """
+    Мем или строка выборки мема в виде schemas.Meme для ответа. На чтении ответ собирается из строк и сериализуется
+    в JSON без моделей pydantic, порядок и состав полей берутся из schemas.Meme
+    """
+    return {name: getattr(meme, name) for name in _MEME_FIELDS} | {'url': url}
+
+
+@router.get("/memes", response_model=schemas.CursorPage[schemas.Meme], response_class=ORJSONResponse)
+async def get_memes(request: Request,
+                    cursor: str | None = None,
+                    size: int = Query(50, ge=1, le=100),
+                    with_total: bool = False,
+                    variant: str | None = None,
+                    meme_repo=Depends(get_meme_repo),
+                    file_service=Depends(get_file_service)) -> Response:
+    """
+    Keyset-пагинация по id: cursor - непрозрачный курсор из next_cursor предыдущей страницы.
+    total отдается только по запросу with_total и в PostgreSQL является оценкой.
+    variant - уменьшенная копия файла ("<размер>.<формат>", напр. 320.webp), на которую ведут ссылки,
+    если она построена.
+    Поддерживает If-None-Match: если страница не изменилась, отвечает 304 без тела.
+    """
+    try:
+        after_id: int | None = int(pagination.decode_cursor(cursor, 'id')['id']) if cursor else None
+    except (pagination.InvalidCursorException, TypeError, ValueError):
+        raise HTTPException(status_code=400, detail=pagination.InvalidCursorException.message)
+    # запрашиваем на одну запись больше, чтобы узнать, есть ли следующая страница
+    memes: list[sa.Row] = await meme_repo.get_memes_page(after_id=after_id, limit=size + 1)
+    next_cursor: str | None = pagination.encode_cursor({'id': memes[size - 1].id}) if len(memes) > size else None
+    memes = memes[:size]
+    urls: list[str] = [_url(meme, file_service, variant) for meme in memes]
+    total: int | None = await meme_repo.estimate_count() if with_total else None
+    etag: str = caching.memes_etag(memes, urls, next_cursor, total)
+    not_modified, headers = caching.conditional(request, etag, settings.web_app.MEMES_CACHE_CONTROL)
+    if not_modified:
+        return not_modified
+    items: list[dict] = [meme_json(meme, url) for meme, url in zip(memes, urls)]
+    return ORJSONResponse({'items': items, 'next_cursor': next_cursor, 'total': total}, headers=headers)
+
+
+@router.get("/memes/search", response_model=schemas.CursorPage[schemas.Meme], response_class=ORJSONResponse)
+async def search_memes(request: Request,
+                       q: str = Query(min_length=1, max_length=200),
+                       cursor: str | None = None,
+                       size: int = Query(50, ge=1, le=100),
+                       variant: str | None = None,
+                       meme_repo=Depends(get_meme_repo),
+                       file_service=Depends(get_file_service)) -> Response:
+    """
+    Поиск мемов по title и content: полнотекстовый, плюс нечеткий по title. Выдача отсортирована по релевантности.
+    cursor - непрозрачный курсор из next_cursor предыдущей страницы, variant - как в GET /memes.
+    """
     try:
-        return await meme_repo.get_meme_by_id(id=meme_id)
+        position: dict | None = pagination.decode_cursor(cursor, 'rank', 'id') if cursor else None
+        after: tuple[float, int] | None = (float(position['rank']), int(position['id'])) if position else None
+    except (pagination.InvalidCursorException, TypeError, ValueError):
+        raise HTTPException(status_code=400, detail=pagination.InvalidCursorException.message)
+    found: list[sa.Row] = await meme_repo.search_memes(q, after=after, limit=size + 1)
+    next_cursor: str | None = None
+    if len(found) > size:
+        next_cursor = pagination.encode_cursor({'rank': found[size - 1].rank, 'id': found[size - 1].id})
+    found = found[:size]
+    urls: list[str] = [_url(meme, file_service, variant) for meme in found]
+    etag: str = caching.memes_etag(found, urls, next_cursor)
+    not_modified, headers = caching.conditional(request, etag, settings.web_app.MEMES_CACHE_CONTROL)
+    if not_modified:
+        return not_modified
+    items: list[dict] = [meme_json(meme, url) for meme, url in zip(found, urls)]
+    return ORJSONResponse({'items': items, 'next_cursor': next_cursor, 'total': None}, headers=headers)
+
+
+@router.get("/memes/{meme_id}", response_model=schemas.Meme, response_class=ORJSONResponse)
+async def get_meme(meme_id: int,
+                   request: Request,
+                   variant: str | None = None,
+                   meme_repo=Depends(get_meme_repo),
+                   file_service=Depends(get_file_service)) -> Response:
+    """Поддерживает If-None-Match: если мем не изменился, отвечает 304 без тела"""
+    try:
+        meme: schemas.Meme = await meme_repo.get_meme_by_id(id=meme_id)
     except meme_repo.NothingFoundException as _e:
         raise HTTPException(status_code=404, detail=_e.message)
+    url: str = _url(meme, file_service, variant)
+    not_modified, headers = caching.conditional(request, caching.meme_etag(meme, url),
+                                                settings.web_app.MEME_CACHE_CONTROL)
+    if not_modified:
+        return not_modified
+    return ORJSONResponse(meme_json(meme, url), headers=headers)
+
+
+async def _file_response(request: Request, file_service: repositories.FileService, key: str) -> Response:
+    """
+    Файл хранилища с поддержкой Range с одним диапазоном байт (ответ 206), If-Range и If-None-Match.
+    Из MinIO файл читается потоком без буферизации целиком, файл локального хранилища целиком отдается FileResponse:
+    сервер, поддерживающий http.response.pathsend, отправляет его sendfile без копирования через приложение
+    """
+    try:
+        stat = await file_service.stat(key)
+    except file_service.NothingFoundException as _e:
+        raise HTTPException(status_code=404, detail=_e.message)
+    etag: str = f'"{stat.etag}"'
+    headers: dict = {'ETag': etag, 'Cache-Control': settings.web_app.FILE_CACHE_CONTROL, 'Accept-Ranges': 'bytes'}
+    if stat.last_modified is not None:
+        headers['Last-Modified'] = ranges.http_date(stat.last_modified)
+    if caching.is_not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+    byte_range: tuple[int, int] | None = None
+    if ranges.if_range_matches(request, etag, stat.last_modified):
+        try:
+            byte_range = ranges.parse_range(request.headers.get('range'), stat.size)
+        except ranges.RangeNotSatisfiableException as _e:
+            raise HTTPException(status_code=416, detail=_e.message, headers={'Content-Range': f'bytes */{stat.size}'})
+    if byte_range is None:
+        path = file_service.local_path(key)
+        if path is not None:
+            return FileResponse(path, media_type=stat.content_type, headers=headers)
+        return StreamingResponse(file_service.stream(key), media_type=stat.content_type,
+                                 headers={**headers, 'Content-Length': str(stat.size)})
+    start, end = byte_range
+    return StreamingResponse(file_service.stream(key, offset=start, length=end - start + 1),
+                             status_code=206,
+                             media_type=stat.content_type,
+                             headers={**headers,
+                                      'Content-Length': str(end - start + 1),
+                                      'Content-Range': f'bytes {start}-{end}/{stat.size}'})
+
+
+@router.get("/memes/{meme_id}/file", response_class=StreamingResponse)
+async def get_meme_file(meme_id: int,
+                        request: Request,
+                        variant: str | None = None,
+                        meme_repo=Depends(get_meme_repo),
+                        file_service=Depends(get_file_service)) -> Response:
+    """
+    Файл мема (или его уменьшенная копия variant) из хранилища, без буферизации файла целиком.
+    Поддерживает Range с одним диапазоном байт (ответ 206) и If-Range, а также If-None-Match.
+    """
+    try:
+        meme: schemas.Meme = await meme_repo.get_meme_by_id(id=meme_id)
+    except meme_repo.NothingFoundException as _e:
+        raise HTTPException(status_code=404, detail=_e.message)
+    return await _file_response(request, file_service, _file_key(meme, variant))
+
+
+@router.get("/files/{key:path}", response_class=FileResponse, include_in_schema=False)
+async def get_file(key: str,
+                   expires: int,
+                   signature: str,
+                   request: Request,
+                   file_service=Depends(get_file_service)) -> Response:
+    """Файл локального хранилища по подписанной ссылке из FileService.get_url (STORAGE_BACKEND=local)"""
+    if file_service.local_path(key) is None:
+        raise HTTPException(status_code=404, detail=file_service.NothingFoundException.message)
+    if not file_service.verify_url(key, expires, signature):
+        raise HTTPException(status_code=403, detail="Link is invalid or expired")
+    return await _file_response(request, file_service, key)
 
 
 @router.post("/memes/")
+@admission.limited('upload')
 async def post_meme(file: UploadFile,
+                    background_tasks: BackgroundTasks,
                     meme: schemas.MemeCreate = Depends(),
                     meme_repo=Depends(get_meme_repo),
                     file_service=Depends(get_file_service)) -> schemas.Meme:
     try:
-        file_url, etag = await file_service.upload_file(file=file)
-        meme = schemas.MemeEnriched(**meme.dict(), url=file_url, etag=etag)
-        return await meme_repo.create(meme, as_pd=True)
+        etag, file_key = await file_service.upload_file(file=file)
+        meme = schemas.MemeEnriched(**meme.dict(), etag=etag, file_key=file_key)
+        created_meme: schemas.Meme = await meme_repo.create(
+            meme, as_pd=True, before_commit=lambda: file_service.ensure_file(file_key, file))
+        background_tasks.add_task(derivatives.process_meme, created_meme.id, file_key, meme_repo, file_service)
+        return with_url(created_meme, file_service)
+    except file_service.FileTooLargeException as _e:
+        raise HTTPException(status_code=413, detail=_e.message)
+    except (meme_repo.DBConstrainException, file_service.DBConstrainException) as _e:
+        raise HTTPException(status_code=500, detail=_e.message)
+
+
+@router.post("/memes/batch")
+@admission.limited('upload')
+async def post_memes_batch(files: list[UploadFile],
+                           background_tasks: BackgroundTasks,
+                           titles: list[str] = Form(),
+                           contents: list[str] = Form(),
+                           meme_repo=Depends(get_meme_repo),
+                           file_service=Depends(get_file_service)) -> list[schemas.MemeBatchItem]:
+    """
+    Пакетное создание мемов: i-й файл получает i-е title и content.
+    Файлы загружаются в хранилище параллельно (не больше settings.web_app.BATCH_CONCURRENCY одновременно),
+    мемы по загруженным файлам пишутся в БД одним запросом. Результат и ошибка - по каждому элементу пакета.
+    """
+    if not len(files) == len(titles) == len(contents):
+        raise HTTPException(status_code=422, detail="files, titles and contents should be of the same length")
+    if len(files) > settings.web_app.BATCH_MAX_SIZE:
+        raise HTTPException(status_code=413, detail=f"Batch is limited to {settings.web_app.BATCH_MAX_SIZE} memes")
+    results: list[schemas.MemeBatchItem] = [schemas.MemeBatchItem(index=index) for index in range(len(files))]
+    uploaded: dict[int, schemas.MemeEnriched] = {}
+    orphaned_keys: list[str] = []
+    limiter = anyio.CapacityLimiter(settings.web_app.BATCH_CONCURRENCY)
+
+    async def upload(index: int) -> None:
+        # ошибка элемента достается только ему: исключение из задачи отменило бы весь пакет
+        file_key: str | None = None
+        try:
+            async with limiter:
+                etag, file_key = await file_service.upload_file(file=files[index])
+            uploaded[index] = schemas.MemeEnriched(title=titles[index], content=contents[index],
+                                                   etag=etag, file_key=file_key)
+        except Exception as _e:  # noqa
+            if not isinstance(_e, (file_service.FileTooLargeException, file_service.DBConstrainException)):
+                logger.exception('Failed to upload file %s of a batch', index)
+            results[index].error = getattr(_e, 'message', file_service.DBConstrainException.message)
+            if file_key is not None:
+                orphaned_keys.append(file_key)
+
+    async with anyio.create_task_group() as task_group:
+        for index in range(len(files)):
+            task_group.start_soon(upload, index)
+    indexes: list[int] = sorted(uploaded)
+
+    async def ensure_uploaded() -> None:
+        failed: list[int] = []
+
+        async def ensure(index: int) -> None:
+            try:
+                async with limiter:
+                    await file_service.ensure_file(uploaded[index].file_key, files[index])
+            except Exception:  # noqa
+                logger.exception('Failed to restore file %s of a batch', index)
+                failed.append(index)
+        async with anyio.create_task_group() as task_group:
+            for index in indexes:
+                task_group.start_soon(ensure, index)
+        if failed:
+            raise file_service.DBConstrainException
+
+    try:
+        created_memes: list[schemas.Meme] = await meme_repo.create_memes([uploaded[index] for index in indexes],
+                                                                         before_commit=ensure_uploaded)
+    except (meme_repo.DBConstrainException, file_service.DBConstrainException) as _e:
+        await meme_repo.reap_files([*orphaned_keys, *(meme.file_key for meme in uploaded.values())],
+                                   file_service.delete_files)
+        raise HTTPException(status_code=500, detail=_e.message)
+    await meme_repo.reap_files(orphaned_keys, file_service.delete_files)
+    for index, created_meme in zip(indexes, created_memes):
+        results[index].meme = with_url(created_meme, file_service)
+        background_tasks.add_task(derivatives.process_meme, created_meme.id, created_meme.file_key,
+                                  meme_repo, file_service)
+    return results
+
+
+@router.post("/memes/uploads", status_code=201)
+@admission.limited('write')
+async def start_upload(meme: schemas.UploadCreate = Depends(),
+                       upload_repo=Depends(get_upload_repo),
+                       file_service=Depends(get_file_service)) -> schemas.Upload:
+    """
+    Загрузка мема по частям: обрыв связи стоит повторной загрузки одной части, а не всего файла.
+    Части загружаются PUT /memes/uploads/{upload_id}/parts/{part_number} в любом порядке и параллельно, все, кроме
+    последней, не меньше 5 МБ. GET /memes/uploads/{upload_id} показывает, какие части уже загружены.
+    Мем создается POST /memes/uploads/{upload_id}/complete, DELETE /memes/uploads/{upload_id} прерывает загрузку.
+    Незавершенная загрузка удаляется через settings.uploads.TTL секунд после последней части.
+    """
+    try:
+        key, s3_upload_id = await file_service.start_multipart(meme.content_type)
+    except file_service.DBConstrainException as _e:
+        raise HTTPException(status_code=500, detail=_e.message)
+    return await upload_repo.create_upload(meme, object_key=key, s3_upload_id=s3_upload_id)
+
+
+@router.get("/memes/uploads/{upload_id}")
+async def get_upload(upload_id: str, upload_repo=Depends(get_upload_repo)) -> schemas.Upload:
+    try:
+        return await upload_repo.get_upload_state(upload_id)
+    except upload_repo.NothingFoundException as _e:
+        raise HTTPException(status_code=404, detail=_e.message)
+
+
+async def _read_body(request: Request, limit: int) -> bytes:
+    """Тело запроса целиком, но не больше limit байт: часть уходит в хранилище одним запросом известной длины"""
+    content_length: str | None = request.headers.get('content-length')
+    if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+        raise HTTPException(status_code=413, detail=repositories.FileService.FileTooLargeException.message)
+    chunks: list[bytes] = []
+    size: int = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > limit:
+            raise HTTPException(status_code=413, detail=repositories.FileService.FileTooLargeException.message)
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+
+@router.put("/memes/uploads/{upload_id}/parts/{part_number}")
+@admission.limited('upload')
+async def put_upload_part(upload_id: str,
+                          request: Request,
+                          part_number: int = Path(ge=1, le=10000),
+                          upload_repo=Depends(get_upload_repo),
+                          file_service=Depends(get_file_service)) -> schemas.UploadPart:
+    """
+    Тело запроса - содержимое части, не больше settings.uploads.MAX_PART_SIZE.
+    Повторная загрузка части с тем же номером заменяет ее
+    """
+    try:
+        upload, parts = await upload_repo.get_upload(upload_id)
+    except upload_repo.NothingFoundException as _e:
+        raise HTTPException(status_code=404, detail=_e.message)
+    if upload.status != models.UploadStatus.OPEN.value:
+        raise HTTPException(status_code=409, detail=upload_repo.ConflictException.message)
+    uploaded: int = sum(part.size for part in parts if part.part_number != part_number)
+    data: bytes = await _read_body(request, min(settings.uploads.MAX_PART_SIZE,
+                                                settings.minio.MAX_UPLOAD_SIZE - uploaded))
+    if not data:
+        raise HTTPException(status_code=422, detail="Part is empty")
+    try:
+        etag: str = await file_service.upload_part(upload.object_key, upload.s3_upload_id, part_number, data)
+        part = schemas.UploadPart(part_number=part_number, etag=etag, size=len(data))
+        await upload_repo.save_part(upload_id, part)
+    except file_service.NothingFoundException as _e:
+        raise HTTPException(status_code=404, detail=_e.message)
+    except upload_repo.ConflictException as _e:
+        raise HTTPException(status_code=409, detail=_e.message)
+    except file_service.DBConstrainException as _e:
+        raise HTTPException(status_code=500, detail=_e.message)
+    return part
+
+
+@router.post("/memes/uploads/{upload_id}/complete")
+@admission.limited('upload')
+async def complete_upload(upload_id: str,
+                          background_tasks: BackgroundTasks,
+                          upload_repo=Depends(get_upload_repo),
+                          meme_repo=Depends(get_meme_repo),
+                          file_service=Depends(get_file_service)) -> schemas.Meme:
+    """
+    Собирает файл из загруженных частей на стороне хранилища и создает мем.
+    Повторное завершение уже завершенной загрузки отдает тот же мем: клиент, не дождавшийся ответа, может повторить.
+    Если мем создать не удалось, загрузка снова открыта, и завершение можно повторить
+    """
+    try:
+        state: schemas.Upload = await upload_repo.get_upload_state(upload_id)
+        if state.status == models.UploadStatus.DONE.value:
+            return with_url(await meme_repo.get_by(id=state.meme_id, as_pd=True), file_service)
+        upload: models.Upload = await upload_repo.start_completing(upload_id)
+        _, parts = await upload_repo.get_upload(upload_id)
+    except (upload_repo.NothingFoundException, meme_repo.NothingFoundException) as _e:
+        raise HTTPException(status_code=404, detail=_e.message)
+    except upload_repo.ConflictException as _e:
+        raise HTTPException(status_code=409, detail=_e.message)
+    try:
+        await file_service.complete_multipart(upload.object_key, upload.s3_upload_id, parts)
+    except file_service.InvalidUploadException as _e:
+        await upload_repo.reopen(upload_id)
+        raise HTTPException(status_code=400, detail=_e.message)
+    except file_service.NothingFoundException as _e:
+        await upload_repo.reopen(upload_id)
+        raise HTTPException(status_code=404, detail=_e.message)
+    except file_service.DBConstrainException as _e:
+        await upload_repo.reopen(upload_id)
+        raise HTTPException(status_code=500, detail=_e.message)
+    try:
+        etag, file_key = await file_service.promote_staged(upload.object_key)
+        meme = schemas.MemeEnriched(title=upload.title, content=upload.content, etag=etag, file_key=file_key)
+        created_meme: schemas.Meme = await meme_repo.create(
+            meme, as_pd=True, before_commit=lambda: file_service.ensure_promoted(upload.object_key, file_key))
+    except (file_service.NothingFoundException, meme_repo.DBConstrainException) as _e:
+        await upload_repo.reopen(upload_id)
+        raise HTTPException(status_code=500, detail=_e.message)
+    except Exception:
+        await upload_repo.reopen(upload_id)
+        raise
+    await upload_repo.finish(upload_id, meme_id=created_meme.id)
+    with contextlib.suppress(file_service.NothingFoundException):
+        await file_service.delete_file_by_name(name=upload.object_key)
+    background_tasks.add_task(derivatives.process_meme, created_meme.id, file_key, meme_repo, file_service)
+    return with_url(created_meme, file_service)
+
+
+@router.delete("/memes/uploads/{upload_id}", status_code=204)
+@admission.limited('write')
+async def abort_upload(upload_id: str,
+                       upload_repo=Depends(get_upload_repo),
+                       file_service=Depends(get_file_service)) -> Response:
+    """Прерывает открытую загрузку, ее части удаляются из хранилища"""
+    try:
+        upload: models.Upload = await upload_repo.delete_upload(upload_id)
+    except upload_repo.NothingFoundException as _e:
+        raise HTTPException(status_code=404, detail=_e.message)
+    # сбой хранилища не мешает прервать загрузку: части останутся в S3 до правила жизненного цикла бакета
+    with contextlib.suppress(file_service.DBConstrainException):
+        await file_service.abort_multipart(upload.object_key, upload.s3_upload_id)
+    # файл, собранный сорвавшимся завершением
+    with contextlib.suppress(file_service.NothingFoundException):
+        await file_service.delete_file_by_name(name=upload.object_key)
+    return Response(status_code=204)
+
+
+@router.post("/memes/direct-uploads", status_code=201)
+async def start_direct_upload(upload: schemas.DirectUploadCreate = Depends(),
+                              file_service=Depends(get_file_service)) -> schemas.DirectUpload:
+    """
+    Загрузка мема прямо в хранилище: приложение выдает политику presigned POST, клиент отправляет файл в MinIO
+    формой на url с полями fields (файл - последним полем file) до expires_at и затем создает мем
+    POST /memes/direct-uploads/complete с key из ответа. Байты файла через приложение не проходят.
+    Уменьшенные копии таким мемам не строятся: для них пришлось бы читать файл в приложении
+    """
+    try:
+        return file_service.presign_upload(upload.content_type)
+    except file_service.NotSupportedException as _e:
+        raise HTTPException(status_code=501, detail=_e.message)
+
+
+@router.post("/memes/direct-uploads/complete")
+@admission.limited('write')
+async def complete_direct_upload(meme: schemas.DirectUploadComplete = Depends(),
+                                 meme_repo=Depends(get_meme_repo),
+                                 file_service=Depends(get_file_service)) -> schemas.Meme:
+    """
+    Проверяет загруженный файл одним запросом к хранилищу и создает мем. По одному файлу создается один мем:
+    проверка и создание - одна транзакция. Файл, который успели удалить до создания мема, отдает 404
+    """
+    try:
+        etag, file_key = await file_service.check_direct_upload(meme.key)
+    except file_service.InvalidDirectUploadException as _e:
+        raise HTTPException(status_code=422, detail=_e.message)
+    except file_service.NothingFoundException as _e:
+        raise HTTPException(status_code=404, detail=_e.message)
+    try:
+        created_meme: schemas.Meme = await meme_repo.create_exclusive(
+            schemas.MemeEnriched(title=meme.title, content=meme.content, etag=etag, file_key=file_key),
+            before_commit=lambda: file_service.stat(file_key))
+    except meme_repo.FileInUseException as _e:
+        raise HTTPException(status_code=409, detail=_e.message)
+    except file_service.NothingFoundException as _e:
+        raise HTTPException(status_code=404, detail=_e.message)
     except meme_repo.DBConstrainException as _e:
         raise HTTPException(status_code=500, detail=_e.message)
+    return with_url(created_meme, file_service)
+
+
+@router.post("/memes/jobs", status_code=202)
+@admission.limited('upload')
+async def post_meme_job(file: UploadFile,
+                        meme: schemas.MemeCreate = Depends(),
+                        job_repo=Depends(get_upload_job_repo),
+                        file_service=Depends(get_file_service)) -> schemas.UploadJob:
+    """
+    Асинхронная загрузка мема: файл кладется во временное хранилище, а мем создается воркером очереди
+    (python -m src.worker). Статус задачи - GET /memes/jobs/{job_id}.
+    """
+    try:
+        staging_key: str = await file_service.stage_file(file=file)
+    except file_service.FileTooLargeException as _e:
+        raise HTTPException(status_code=413, detail=_e.message)
+    job = schemas.UploadJobCreate(**meme.dict(), staging_key=staging_key, content_type=file.content_type or 'image/jpeg')
+    return await job_repo.enqueue(job)
+
+
+@router.get("/memes/jobs/{job_id}")
+async def get_meme_job(job_id: int, job_repo=Depends(get_upload_job_repo)) -> schemas.UploadJob:
+    try:
+        return await job_repo.get_job_by_id(id=job_id)
+    except job_repo.NothingFoundException as _e:
+        raise HTTPException(status_code=404, detail=_e.message)
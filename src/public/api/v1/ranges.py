@@ -0,0 +1,58 @@
+"""Частичные ответы: заголовки Range и If-Range (RFC 9110 14.2, 13.1.5). Поддерживается один диапазон байт"""
+from datetime import datetime
+from email.utils import format_datetime
+
+from starlette.requests import Request
+
+
+class RangeNotSatisfiableException(Exception):
+    message = "Range not satisfiable"
+
+
+def http_date(value: datetime) -> str:
+    return format_datetime(value, usegmt=True)
+
+
+def parse_range(header: str | None, size: int) -> tuple[int, int] | None:
+    """
+    Диапазон (первый байт, последний байт включительно) из заголовка Range для объекта размером size.
+    None - отдать объект целиком: заголовка нет, единицы не байты, заголовок не разбирается или диапазонов несколько
+    (сервер вправе игнорировать Range). Если диапазон начинается за концом объекта - RangeNotSatisfiableException.
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+    first, dash, last = spec.strip().partition('-')
+    if not dash or not (first or last) or not all(part.isdigit() for part in (first, last) if part):
+        return None
+    if not first:
+        # суффикс: последние last байт объекта
+        suffix: int = int(last)
+        if suffix == 0 or size == 0:
+            raise RangeNotSatisfiableException
+        return max(size - suffix, 0), size - 1
+    start: int = int(first)
+    end: int = int(last) if last else size - 1
+    if last and start > end:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiableException
+    return start, min(end, size - 1)
+
+
+def if_range_matches(request: Request, etag: str, last_modified: datetime | None) -> bool:
+    """
+    Применим ли Range: If-Range нет или он совпадает с текущей версией. ETag сравнивается сильно (слабый не
+    совпадает никогда), дата - точно с Last-Modified. Иначе клиент докачивает другую версию и получит ее целиком.
+    """
+    if_range: str | None = request.headers.get('if-range')
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"'):
+        return if_range == etag
+    if if_range.startswith('W/'):
+        return False
+    return last_modified is not None and if_range == http_date(last_modified)
@@ -1,22 +1,58 @@
-from fastapi import FastAPI
-from fastapi_pagination import add_pagination
+from contextlib import asynccontextmanager
+
+import anyio
+from fastapi import FastAPI, Depends
 from starlette.responses import Response
 
 from src.config import get_settings
+from src.core import admission, auth, metrics, startup
+from src.storages import postgres
 from src.public.api.v1 import endpoints
 
 settings = get_settings()
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await startup.warm_up(endpoints.get_meme_repo(), endpoints.get_file_service())
+    async with anyio.create_task_group() as task_group:
+        # сброс кэша мемов по уведомлениям от приватного приложения
+        task_group.start_soon(endpoints.get_meme_repo().listen_for_changes)
+        task_group.start_soon(endpoints.get_meme_repo().replicas.watch)
+        yield
+        task_group.cancel_scope.cancel()
+
+
 app = FastAPI(
     title="MemesPublicAPI",
     docs_url="/api/swagger-ui",
-    openapi_url="/api/openapi.json"
+    openapi_url="/api/openapi.json",
+    lifespan=lifespan
 )
 
+app.add_middleware(postgres.ReadYourWritesMiddleware)
+if metrics.enabled():
+    app.add_middleware(metrics.MetricsMiddleware, app_name='public')
+
 app.include_router(endpoints.router, prefix="/api/v1", tags=["memes"])
-add_pagination(app)
 
 
 @app.get(settings.web_app.HEALTHCHECK_PATH, include_in_schema=False)
 async def get_health():
     return Response(status_code=200)
+
+
+@app.get(settings.web_app.STATS_PATH, include_in_schema=False, dependencies=[Depends(auth.authenticate_admin)])
+async def get_stats(meme_repo=Depends(endpoints.get_meme_repo)):
+    return {'db_pool': meme_repo.pool_status(),
+            'db_replicas': meme_repo.replicas.status(),
+            'admission': admission.status(),
+            'meme_cache': meme_repo.cache.stats(),
+            'startup_seconds': startup.startup_seconds}
+
+
+@app.get(settings.metrics.PATH, include_in_schema=False, dependencies=[Depends(auth.authenticate_admin)])
+async def get_metrics():
+    if not metrics.enabled():
+        return Response(status_code=404)
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
@@ -0,0 +1,58 @@
+"""
+Воркер gunicorn для боевого запуска приложений: uvicorn на uvloop и httptools, плавная остановка
+и перезапуск воркера, выросшего по памяти. Настройки gunicorn - в src/gunicorn.conf.py.
+"""
+import logging
+import os
+import resource
+import signal
+
+from uvicorn.workers import UvicornWorker
+
+from src.config import get_settings
+
+settings = get_settings()
+logger = logging.getLogger('uvicorn.error')
+
+
+def rss_mb() -> float:
+    """Текущий RSS процесса. Без /proc - пиковый RSS"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Worker(UvicornWorker):
+    CONFIG_KWARGS = {'loop': 'uvloop', 'http': 'httptools'}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # uvicorn должен успеть оборвать зависшие соединения до того, как мастер убьет воркер по graceful_timeout
+        self.config.timeout_graceful_shutdown = max(self.cfg.graceful_timeout - 5, 1)
+        self._recycling: bool = False
+        self._started_rss: float | None = None
+
+    async def callback_notify(self) -> None:
+        """
+        Раз в timeout / 2 секунд: отчет мастеру и проверка памяти. Выросший больше
+        settings.web_server.MAX_WORKER_RSS_MB воркер останавливается как по SIGTERM - перестает принимать соединения
+        и дожидается текущих запросов, включая загрузки, - а мастер запускает ему замену.
+        """
+        await super().callback_notify()
+        limit: int = settings.web_server.MAX_WORKER_RSS_MB
+        if not limit or self._recycling:
+            return
+        current: float = rss_mb()
+        if self._started_rss is None:
+            self._started_rss = current
+            if current > limit:
+                # иначе каждый новый воркер сразу уходил бы на перезапуск
+                logger.error('Worker %s starts with %.0fMB > %sMB limit, recycling disabled', self.pid, current, limit)
+                self._recycling = True
+                return
+        if current > limit:
+            self._recycling = True
+            logger.warning('Worker %s uses %.0fMB > %sMB, recycling', self.pid, current, limit)
+            os.kill(self.pid, signal.SIGTERM)
@@ -0,0 +1,300 @@
+"""
+Хранилище объектов на локальном диске с интерфейсом клиента MinIO в объеме, который использует FileService.
+Для небольших однонодовых установок: без отдельного объектного хранилища и сетевого перехода на загрузку и отдачу.
+
+Ключ - путь относительно каталога бакета, первый сегмент ключа раскладывается по подкаталогам по своим первым
+символам (ab12.../... -> ab/ab12.../...), чтобы в одном каталоге не копились все файлы. Тип содержимого и etag лежат
+рядом с файлом в скрытом .<имя>.meta. Запись атомарна: во временный файл в том же каталоге, fsync и os.replace,
+так что читатель видит либо прежний файл, либо новый целиком. etag - как у S3: md5 содержимого, а у собранного из
+частей - md5 от md5 частей с числом частей через дефис.
+Ссылки на скачивание ведут в приложение (STORAGE_LOCAL_URL_PATH) и подписаны HMAC с секретом STORAGE_LOCAL_URL_SECRET.
+"""
+import contextlib
+import functools
+import hashlib
+import hmac
+import json
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from types import SimpleNamespace
+from typing import BinaryIO, Iterable, Iterator
+from urllib.parse import quote, urlencode
+
+from minio import error
+from minio.deleteobjects import DeleteError, DeleteObject
+
+from src.config import get_settings
+
+settings = get_settings()
+
+_CHUNK_SIZE = 1024 * 1024
+_UPLOADS_DIR = '.uploads'  # незавершенные multipart-загрузки: каталог на загрузку, часть - файл с номером части
+
+
+def _s3_error(code: str, message: str, key: str) -> error.S3Error:
+    # по именам: в minio 7.2.x порядок аргументов S3Error менялся
+    return error.S3Error(code=code, message=message, resource=key, request_id=None, host_id=None, response=None)
+
+
+class _Response:
+    """Ответ get_object: открытый файл, из которого читается не больше length байт, с методами ответа urllib3"""
+
+    def __init__(self, file: BinaryIO, length: int | None):
+        self._file = file
+        self._left = length
+
+    def read(self, amt: int | None = None) -> bytes:
+        if self._left is not None:
+            amt = self._left if amt is None or amt < 0 else min(amt, self._left)
+        data: bytes = self._file.read(-1 if amt is None else amt)
+        if self._left is not None:
+            self._left -= len(data)
+        return data
+
+    def stream(self, amt: int = 64 * 1024) -> Iterator[bytes]:
+        while chunk := self.read(amt):
+            yield chunk
+
+    def close(self) -> None:
+        self._file.close()
+
+    def release_conn(self) -> None:
+        ...
+
+
+class LocalObjectStore:
+    """Объекты в каталоге root/<бакет>. Методы блокирующие и потокобезопасные, как у клиента MinIO"""
+
+    def __init__(self, root: str | os.PathLike, url_secret: str, url_path: str):
+        self.root = Path(root)
+        self._url_secret: bytes = url_secret.encode()
+        self._url_path: str = url_path.rstrip('/')
+
+    def path(self, bucket: str, key: str) -> Path:
+        parts: list[str] = key.split('/')
+        if any(part in ('', '.', '..') or part.startswith('.') for part in parts):
+            raise _s3_error('InvalidObjectName', 'Object name is not allowed in local storage', key)
+        return self.root.joinpath(bucket, parts[0][:2], *parts)
+
+    @staticmethod
+    def _meta_path(path: Path) -> Path:
+        return path.with_name(f'.{path.name}.meta')
+
+    def _read_meta(self, path: Path, key: str) -> dict:
+        try:
+            with open(self._meta_path(path), encoding='utf-8') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            raise _s3_error('NoSuchKey', 'Object does not exist', key)
+
+    @staticmethod
+    def _write_atomic(path: Path, chunks: Iterable[bytes]) -> None:
+        """Пишет файл во временный рядом и заменяет им path: файл по path всегда целый"""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        descriptor, temp_name = tempfile.mkstemp(dir=path.parent, prefix=f'.{path.name}.', suffix='.tmp')
+        try:
+            with os.fdopen(descriptor, 'wb') as file:
+                for chunk in chunks:
+                    file.write(chunk)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_name, path)
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(temp_name)
+            raise
+
+    def _write_meta(self, path: Path, meta: dict) -> None:
+        # метаданные пишутся после содержимого: объект виден stat_object, когда они появились
+        self._write_atomic(self._meta_path(path), [json.dumps(meta).encode()])
+
+    @staticmethod
+    def _read_chunks(data: BinaryIO, length: int, hasher) -> Iterator[bytes]:
+        left: int = length
+        while left != 0:
+            chunk: bytes = data.read(_CHUNK_SIZE if left < 0 else min(_CHUNK_SIZE, left))
+            if not chunk:
+                break
+            hasher.update(chunk)
+            left -= len(chunk) if left > 0 else 0
+            yield chunk
+
+    def put_object(self, bucket: str, key: str, data: BinaryIO, length: int,
+                   content_type: str = 'application/octet-stream', part_size: int = 0, **kwargs):
+        path: Path = self.path(bucket, key)
+        hasher = hashlib.md5()
+        self._write_atomic(path, self._read_chunks(data, length, hasher))
+        etag: str = hasher.hexdigest()
+        self._write_meta(path, {'etag': etag, 'content_type': content_type})
+        return SimpleNamespace(bucket_name=bucket, object_name=key, etag=etag)
+
+    def stat_object(self, bucket: str, key: str, **kwargs):
+        path: Path = self.path(bucket, key)
+        meta: dict = self._read_meta(path, key)
+        try:
+            stat: os.stat_result = path.stat()
+        except FileNotFoundError:
+            raise _s3_error('NoSuchKey', 'Object does not exist', key)
+        return SimpleNamespace(bucket_name=bucket, object_name=key, etag=meta['etag'], size=stat.st_size,
+                               content_type=meta['content_type'],
+                               last_modified=datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc))
+
+    def get_object(self, bucket: str, key: str, offset: int = 0, length: int = 0, **kwargs) -> _Response:
+        try:
+            file: BinaryIO = open(self.path(bucket, key), 'rb')
+        except FileNotFoundError:
+            raise _s3_error('NoSuchKey', 'Object does not exist', key)
+        file.seek(offset)
+        return _Response(file, length or None)
+
+    def copy_object(self, bucket: str, key: str, source, **kwargs):
+        source_path: Path = self.path(source.bucket_name, source.object_name)
+        meta: dict = self._read_meta(source_path, source.object_name)
+        path: Path = self.path(bucket, key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_name: str = str(path.with_name(f'.{path.name}.{uuid.uuid4().hex}.tmp'))
+        try:
+            # жесткая ссылка вместо копии: файлы не меняются на месте, а только заменяются целиком
+            os.link(source_path, temp_name)
+        except FileNotFoundError:
+            raise _s3_error('NoSuchKey', 'Object does not exist', source.object_name)
+        except OSError:
+            shutil.copyfile(source_path, temp_name)
+        os.replace(temp_name, path)
+        self._write_meta(path, meta)
+        return SimpleNamespace(bucket_name=bucket, object_name=key, etag=meta['etag'])
+
+    def remove_object(self, bucket: str, key: str, **kwargs) -> None:
+        path: Path = self.path(bucket, key)
+        path.unlink(missing_ok=True)
+        self._meta_path(path).unlink(missing_ok=True)
+
+    def remove_objects(self, bucket: str, delete_object_list: Iterable[DeleteObject],
+                       **kwargs) -> Iterator[DeleteError]:
+        for delete_object in delete_object_list:
+            try:
+                self.remove_object(bucket, delete_object.name)
+            except (OSError, error.S3Error) as _exc:
+                yield DeleteError(type(_exc).__name__, str(_exc), delete_object.name, None)
+
+    def list_objects(self, bucket: str, prefix: str | None = None, recursive: bool = False, **kwargs):
+        """Объекты с ключами, начинающимися с prefix. Обходит только подкаталог первого сегмента префикса"""
+        bucket_root: Path = self.root / bucket
+        prefix = prefix or ''
+        first, slash, _ = prefix.partition('/')
+        if slash and first and not first.startswith('.'):
+            top: Path = bucket_root / first[:2] / first
+        else:
+            top = bucket_root
+        for directory, dirnames, filenames in os.walk(top):
+            dirnames[:] = [name for name in dirnames if not name.startswith('.')]
+            for name in filenames:
+                if name.startswith('.'):
+                    continue
+                path: Path = Path(directory, name)
+                relative: tuple[str, ...] = path.relative_to(bucket_root).parts
+                key: str = '/'.join(relative[1:])
+                if not key.startswith(prefix):
+                    continue
+                try:
+                    stat: os.stat_result = path.stat()
+                except FileNotFoundError:
+                    continue
+                yield SimpleNamespace(object_name=key, size=stat.st_size,
+                                      last_modified=datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc))
+
+    def _upload_dir(self, bucket: str, upload_id: str, key: str) -> Path:
+        if not upload_id.isalnum():
+            raise _s3_error('NoSuchUpload', 'Upload does not exist', key)
+        return self.root / bucket / _UPLOADS_DIR / upload_id
+
+    def _create_multipart_upload(self, bucket: str, key: str, headers: dict) -> str:
+        upload_id: str = uuid.uuid4().hex
+        upload_dir: Path = self._upload_dir(bucket, upload_id, key)
+        upload_dir.mkdir(parents=True)
+        meta: dict = {'key': key, 'content_type': headers.get('Content-Type', 'application/octet-stream')}
+        self._write_atomic(upload_dir / '.meta', [json.dumps(meta).encode()])
+        return upload_id
+
+    def _upload_part(self, bucket: str, key: str, data: bytes, headers: dict | None,
+                     upload_id: str, part_number: int) -> str:
+        upload_dir: Path = self._upload_dir(bucket, upload_id, key)
+        if not upload_dir.is_dir():
+            raise _s3_error('NoSuchUpload', 'Upload does not exist', key)
+        self._write_atomic(upload_dir / str(part_number), [data])
+        return hashlib.md5(data).hexdigest()
+
+    def _complete_multipart_upload(self, bucket: str, key: str, upload_id: str, parts: list, **kwargs):
+        upload_dir: Path = self._upload_dir(bucket, upload_id, key)
+        try:
+            with open(upload_dir / '.meta', encoding='utf-8') as file:
+                content_type: str = json.load(file)['content_type']
+        except FileNotFoundError:
+            raise _s3_error('NoSuchUpload', 'Upload does not exist', key)
+        digests: list[bytes] = []
+        for part in parts:
+            hasher = hashlib.md5()
+            try:
+                with open(upload_dir / str(part.part_number), 'rb') as file:
+                    while chunk := file.read(_CHUNK_SIZE):
+                        hasher.update(chunk)
+            except FileNotFoundError:
+                raise _s3_error('InvalidPart', 'Part is missing', key)
+            if hasher.hexdigest() != part.etag.strip('"'):
+                raise _s3_error('InvalidPart', 'Part etag differs', key)
+            digests.append(hasher.digest())
+
+        def chunks() -> Iterator[bytes]:
+            for part in parts:
+                with open(upload_dir / str(part.part_number), 'rb') as part_file:
+                    while part_chunk := part_file.read(_CHUNK_SIZE):
+                        yield part_chunk
+
+        etag: str = f'{hashlib.md5(b"".join(digests)).hexdigest()}-{len(parts)}'
+        path: Path = self.path(bucket, key)
+        self._write_atomic(path, chunks())
+        self._write_meta(path, {'etag': etag, 'content_type': content_type})
+        shutil.rmtree(upload_dir, ignore_errors=True)
+        return SimpleNamespace(bucket_name=bucket, object_name=key, etag=etag)
+
+    def _abort_multipart_upload(self, bucket: str, key: str, upload_id: str) -> None:
+        upload_dir: Path = self._upload_dir(bucket, upload_id, key)
+        if not upload_dir.is_dir():
+            raise _s3_error('NoSuchUpload', 'Upload does not exist', key)
+        shutil.rmtree(upload_dir, ignore_errors=True)
+
+    def _signature(self, key: str, expires: int) -> str:
+        return hmac.new(self._url_secret, f'{key}\n{expires}'.encode(), hashlib.sha256).hexdigest()
+
+    def presigned_get_object(self, bucket: str, key: str, expires: timedelta = timedelta(days=7),
+                             request_date: datetime | None = None, **kwargs) -> str:
+        """Ссылка на отдачу файла приложением, действительная до request_date + expires"""
+        issued: float = request_date.timestamp() if request_date is not None else time.time()
+        expires_at: int = int(issued + expires.total_seconds())
+        query: str = urlencode({'expires': expires_at, 'signature': self._signature(key, expires_at)})
+        return f'{self._url_path}/{quote(key)}?{query}'
+
+    def verify_url(self, key: str, expires: int, signature: str) -> bool:
+        """Подписана ли ссылка на key этим хранилищем и не истекла ли она"""
+        return expires >= time.time() and hmac.compare_digest(signature, self._signature(key, expires))
+
+    def bucket_exists(self, bucket: str) -> bool:
+        return (self.root / bucket).is_dir()
+
+    def make_bucket(self, bucket: str, **kwargs) -> None:
+        (self.root / bucket).mkdir(parents=True, exist_ok=True)
+
+
+@functools.cache
+def get_store() -> LocalObjectStore:
+    """Локальное хранилище процесса в settings.storage.LOCAL_PATH. На диск при создании не обращается"""
+    if not settings.storage.LOCAL_URL_SECRET:
+        raise RuntimeError('STORAGE_LOCAL_URL_SECRET is required for the local storage backend')
+    return LocalObjectStore(settings.storage.LOCAL_PATH,
+                            url_secret=settings.storage.LOCAL_URL_SECRET,
+                            url_path=settings.storage.LOCAL_URL_PATH)
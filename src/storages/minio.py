@@ -1,21 +1,70 @@
 import functools
+import os
+from typing import Callable, TypeVar
 
+import anyio
+import certifi
+import urllib3
 from minio import Minio
+from urllib3.util import Retry, Timeout
 
 from src.config import get_settings
 
 settings = get_settings()
 
-minio_client = Minio(endpoint=settings.minio.uri,
-                     access_key=settings.minio.ROOT_USER,
-                     secret_key=settings.minio.ROOT_PASSWORD,
-                     secure=settings.minio.SECURE)
+T = TypeVar('T')
 
 
-@functools.lru_cache
-def _bucket_exist():
-    return minio_client.bucket_exists(settings.minio.STORAGE_BUCKET)
+@functools.cache
+def get_client() -> Minio:
+    """Клиент MinIO процесса. Создается при первом обращении и сам по себе в сеть не ходит"""
+    # пул HTTP-соединений клиента и пул потоков под блокирующие вызовы одного размера:
+    # поток, получивший слот, всегда получает и соединение
+    http_client = urllib3.PoolManager(
+        timeout=Timeout(connect=settings.minio.CONNECT_TIMEOUT, read=settings.minio.READ_TIMEOUT),
+        maxsize=settings.minio.MAX_CONNECTIONS,
+        block=True,
+        cert_reqs='CERT_REQUIRED',
+        ca_certs=os.environ.get('SSL_CERT_FILE') or certifi.where(),
+        retries=Retry(
+            total=settings.minio.RETRIES,
+            backoff_factor=0.2,
+            status_forcelist=[500, 502, 503, 504]
+        )
+    )
+    return Minio(endpoint=settings.minio.uri,
+                 access_key=settings.minio.ROOT_USER,
+                 secret_key=settings.minio.ROOT_PASSWORD,
+                 secure=settings.minio.SECURE,
+                 region=settings.minio.REGION,  # с известным регионом ссылки подписываются без запросов к MinIO
+                 http_client=http_client)
 
 
-if not _bucket_exist:
-    minio_client.make_bucket(settings.minio.STORAGE_BUCKET)
+_limiter: anyio.CapacityLimiter | None = None
+_stream_limiter: anyio.CapacityLimiter | None = None
+
+
+def _get_limiter() -> anyio.CapacityLimiter:
+    """Ограничитель числа потоков, одновременно работающих с хранилищем. Создается в цикле событий воркера"""
+    global _limiter
+    if _limiter is None:
+        _limiter = anyio.CapacityLimiter(settings.minio.MAX_CONNECTIONS)
+    return _limiter
+
+
+def get_stream_limiter() -> anyio.CapacityLimiter:
+    """
+    Ограничитель числа одновременно читаемых потоком объектов. Открытый поток держит соединение пула клиента
+    между чтениями кусков, поэтому потоков должно быть меньше, чем соединений: остальным вызовам нужны свободные.
+    Хотя бы один поток разрешен всегда, даже при MAX_CONNECTIONS=1 или MAX_STREAMS=0
+    """
+    global _stream_limiter
+    if _stream_limiter is None:
+        _stream_limiter = anyio.CapacityLimiter(max(1, min(settings.minio.MAX_STREAMS,
+                                                           settings.minio.MAX_CONNECTIONS - 1)))
+    return _stream_limiter
+
+
+async def run_sync(func: Callable[..., T], *args, **kwargs) -> T:
+    """Выполняет блокирующий вызов клиента MinIO в ограниченном пуле потоков, не блокируя цикл событий"""
+    return await anyio.to_thread.run_sync(functools.partial(func, *args, **kwargs), limiter=_get_limiter())
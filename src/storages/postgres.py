@@ -1,11 +1,205 @@
-from sqlalchemy import MetaData
-from sqlalchemy.ext.asyncio import create_async_engine
+import functools
+import itertools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterable, Iterator
+
+import anyio
+from sqlalchemy import MetaData, event, exc, make_url, select
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
 
 from src.config import get_settings
 
 settings = get_settings()
-DATABASE_URL = settings.pg.uri
-engine = create_async_engine(DATABASE_URL, echo=True, future=True)
+logger = logging.getLogger(__name__)
+
+
+class ObservablePool(AsyncAdaptedQueuePool):
+    """Пул соединений, который считает время ожидания выдачи соединения и отказы по таймауту"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts: int = 0
+        self.timeouts: int = 0
+        self.wait_total: float = 0.0
+        self.wait_max: float = 0.0
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            return super().connect()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with self._stats_lock:
+                self.checkouts += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+
+
+def pool_status(engine: AsyncEngine) -> dict:
+    """Заполненность пула соединений и статистика ожидания соединений"""
+    pool = engine.sync_engine.pool
+    if not isinstance(pool, QueuePool):
+        return {'pool_class': type(pool).__name__}
+    status = {
+        'pool_class': type(pool).__name__,
+        'size': pool.size(),
+        'max_overflow': pool._max_overflow,
+        'checked_in': pool.checkedin(),
+        'checked_out': pool.checkedout(),
+        'overflow': pool.overflow(),
+    }
+    if isinstance(pool, ObservablePool):
+        status.update({
+            'checkouts': pool.checkouts,
+            'timeouts': pool.timeouts,
+            'wait_seconds_total': pool.wait_total,
+            'wait_seconds_max': pool.wait_max,
+            'wait_seconds_avg': pool.wait_total / pool.checkouts if pool.checkouts else 0.0,
+        })
+    return status
+
+
+def _create_engine(uri: str) -> AsyncEngine:
+    return create_async_engine(uri,
+                               echo=settings.pg.ECHO,
+                               future=True,
+                               poolclass=ObservablePool,
+                               pool_size=settings.pg.POOL_SIZE,
+                               max_overflow=settings.pg.MAX_OVERFLOW,
+                               pool_timeout=settings.pg.POOL_TIMEOUT,
+                               pool_recycle=settings.pg.POOL_RECYCLE)
+
+
+@functools.cache
+def get_engine() -> AsyncEngine:
+    """
+    Движок процесса. Создается при первом обращении, а не при импорте: импорт модуля не открывает соединений
+    и не зависит от доступности БД, а у каждого воркера после форка свой движок
+    """
+    return _create_engine(settings.pg.uri)
+
+
+class ReplicaSet:
+    """
+    Реплики БД для чтения. pick отдает исправные реплики по кругу. Реплика, к которой не удалось подключиться,
+    выводится из оборота до следующей успешной проверки check. Без реплик pick отдает None - читать с основной БД
+    """
+
+    def __init__(self, engines: Iterable[AsyncEngine] = ()):
+        self.engines: tuple[AsyncEngine, ...] = tuple(engines)
+        self._down: set[AsyncEngine] = set()
+        self._turn = itertools.count()
+
+    def pick(self) -> AsyncEngine | None:
+        healthy: list[AsyncEngine] = [engine for engine in self.engines if engine not in self._down]
+        if not healthy:
+            return None
+        return healthy[next(self._turn) % len(healthy)]
+
+    def mark_down(self, engine: AsyncEngine) -> None:
+        if engine not in self._down:
+            logger.warning('Replica %s is down, reading from other replicas or primary', _safe_url(engine))
+        self._down.add(engine)
+
+    async def _probe(self, engine: AsyncEngine) -> None:
+        try:
+            with anyio.fail_after(settings.pg.REPLICA_CHECK_TIMEOUT):
+                async with engine.connect() as connection:
+                    await connection.execute(select(1))
+        except (OSError, TimeoutError, exc.DBAPIError):
+            self.mark_down(engine)
+        else:
+            if engine in self._down:
+                logger.info('Replica %s is back', _safe_url(engine))
+            self._down.discard(engine)
+
+    async def check(self) -> None:
+        """Проверяет все реплики параллельно, каждую не дольше settings.pg.REPLICA_CHECK_TIMEOUT"""
+        async with anyio.create_task_group() as task_group:
+            for engine in self.engines:
+                task_group.start_soon(self._probe, engine)
+
+    async def watch(self) -> None:
+        """Проверяет реплики каждые settings.pg.REPLICA_CHECK_INTERVAL секунд. Запускается в lifespan приложения"""
+        if not self.engines:
+            return
+        while True:
+            await self.check()
+            await anyio.sleep(settings.pg.REPLICA_CHECK_INTERVAL)
+
+    def status(self) -> list[dict]:
+        return [{'url': _safe_url(engine), 'healthy': engine not in self._down, **pool_status(engine)}
+                for engine in self.engines]
+
+
+def _safe_url(engine: AsyncEngine) -> str:
+    return engine.url.render_as_string(hide_password=True)
+
+
+@functools.cache
+def get_replicas() -> ReplicaSet:
+    """Реплики из settings.pg.REPLICA_URIS, общие на процесс. Движки создаются лениво, как и основной"""
+    return ReplicaSet(_create_engine(make_url(uri).set(drivername=settings.pg.DRIVER))
+                      for uri in settings.pg.REPLICA_URIS)
+
+
+# была ли в текущем запросе запись в основную БД: после записи запрос читает только с нее,
+# чтобы не получить с отстающей реплики данные до своей же записи
+_wrote_to_primary: ContextVar[bool] = ContextVar('wrote_to_primary', default=False)
+
+
+# признак ставится при выполнении пишущего запроса, а не при коммите: коммит при выходе из session_maker.begin()
+# выполняется в отдельной задаче, изменения контекстных переменных из которой в запрос не возвращаются
+@event.listens_for(Session, 'do_orm_execute')
+def _on_orm_execute(orm_execute_state) -> None:
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        _wrote_to_primary.set(True)
+
+
+@event.listens_for(Session, 'after_flush')
+def _on_flush(session: Session, flush_context) -> None:
+    _wrote_to_primary.set(True)
+
+
+def wrote_to_primary() -> bool:
+    return _wrote_to_primary.get()
+
+
+@contextmanager
+def read_your_writes_scope() -> Iterator[None]:
+    """Граница запроса для чтения после записи: внутри блока признак записи свой и сбрасывается на выходе"""
+    token = _wrote_to_primary.set(False)
+    try:
+        yield
+    finally:
+        _wrote_to_primary.reset(token)
+
+
+class ReadYourWritesMiddleware:
+    """ASGI-middleware: запрос, записавший в основную БД, до конца читает с нее, следующий запрос - снова с реплик"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope: dict, receive, send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        with read_your_writes_scope():
+            await self.app(scope, receive, send)
+
+
 metadata = MetaData()
 Base = declarative_base(metadata=metadata)
@@ -9,12 +9,18 @@ from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession, create_asyn
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
 
+from ..benchmarks.fakes import FakeObjectStore
+from ..config import get_settings
 from ..core import models, repositories
-from ..public.api.v1.endpoints import get_meme_repo, get_file_service
+from ..private.api.v1 import endpoints as private_endpoints
+from ..private.app import app as private_app
+from ..public.api.v1.endpoints import get_meme_repo, get_file_service, get_upload_repo, get_upload_job_repo
 from ..public.app import app as public_app
 from ..storages.postgres import Base
+from . import utils
 
 fake = Faker('ru_RU')
+settings = get_settings()
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./test.db"
 ASYNC_SQLALCHEMY_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
@@ -41,11 +47,28 @@ Base.metadata.create_all(bind=engine)
 def override_get_meme_repo():
     meme_repo = repositories.MemeRepository()
     meme_repo._engine = async_engine
-    meme_repo.session = AsyncTestingSessionLocal()
+    meme_repo.session_maker = AsyncTestingSessionLocal
     yield meme_repo
 
 
+def override_get_upload_repo():
+    upload_repo = repositories.UploadRepository()
+    upload_repo._engine = async_engine
+    upload_repo.session_maker = AsyncTestingSessionLocal
+    yield upload_repo
+
+
+def override_get_upload_job_repo():
+    job_repo = repositories.UploadJobRepository()
+    job_repo._engine = async_engine
+    job_repo.session_maker = AsyncTestingSessionLocal
+    yield job_repo
+
+
 public_app.dependency_overrides[get_meme_repo] = override_get_meme_repo
+public_app.dependency_overrides[get_upload_repo] = override_get_upload_repo
+public_app.dependency_overrides[get_upload_job_repo] = override_get_upload_job_repo
+private_app.dependency_overrides[private_endpoints.get_meme_repo] = override_get_meme_repo
 
 
 @pytest.fixture(scope="session")
@@ -68,13 +91,43 @@ def sync_db_session():
 
 @pytest.fixture
 def client():
+    # id в тестовой БД переиспользуются между тестами, поэтому кэш мемов сбрасывается
+    repositories.MemeRepository().cache.clear()
     return AsyncClient(app=public_app, base_url='http://testserver')
 
 
+@pytest.fixture
+def private_client():
+    repositories.MemeRepository().cache.clear()
+    return AsyncClient(app=private_app, base_url='http://testserver', headers=utils.admin_headers())
+
+
+@pytest.fixture
+def meme_repo():
+    """Репозиторий мемов на тестовой БД, как его получают обработчики"""
+    return next(override_get_meme_repo())
+
+
+@pytest.fixture
+def store(monkeypatch):
+    """Хранилище в памяти вместо MinIO у FileService на время теста"""
+    object_store = FakeObjectStore()
+    monkeypatch.setattr(repositories.FileService, 'client', object_store)
+    return object_store
+
+
+@pytest.fixture
+def job_repo():
+    return next(override_get_upload_job_repo())
+
+
 @pytest.fixture
 def meme_data_factory():
     def _create_meme_data() -> dict:
-        return {"title": fake.sentence(), "content": fake.sentence(), "url": fake.url(), "etag": fake.uuid4()}
+        return {"title": fake.sentence(),
+                "content": fake.sentence(),
+                "etag": fake.uuid4(),
+                "file_key": fake.sha256()}
     return _create_meme_data
 
 
@@ -0,0 +1,191 @@
+import hashlib
+import io
+
+import pytest
+
+from src.config import get_settings
+from src.core import admission, repositories
+from src.private.api.v1 import endpoints as private_endpoints
+from src.tests import utils
+
+settings = get_settings()
+
+
+def _put_params() -> dict:
+    return {'title': 'new title', 'content': 'new content'}
+
+
+@pytest.mark.private
+@pytest.mark.anyio
+async def test_put_meme_shared_file(private_client, meme_repo, store):
+    """Старый файл, на который ссылается другой мем, остается в хранилище, копии старого файла сбрасываются"""
+    replaced = await utils.create_meme(meme_repo, store, b'shared image')
+    other = await utils.create_meme(meme_repo, store, b'shared image')
+    variant_key: str = repositories.FileService().derivative_key(replaced.file_key, '320.webp')
+    await meme_repo.set_variants(replaced.id, replaced.file_key, {'320.webp': variant_key})
+    try:
+        async with private_client:
+            response = await private_client.put(f'/api/v1/memes/{replaced.id}', params=_put_params(),
+                                                files={'file': ('meme.png', b'new image', 'image/png')})
+        updated = await meme_repo.get_meme_by_id(replaced.id)
+    finally:
+        await meme_repo.delete_memes(ids=[replaced.id, other.id])
+    assert response.status_code == 200
+    assert response.json()['file_key'] == hashlib.sha256(b'new image').hexdigest()
+    assert (updated.title, updated.file_key, updated.variants) == ('new title', response.json()['file_key'], None)
+    assert store.get_object(settings.minio.STORAGE_BUCKET, replaced.file_key).read() == b'shared image'
+
+
+@pytest.mark.private
+@pytest.mark.anyio
+async def test_put_meme_last_reference(private_client, meme_repo, store):
+    """Старый файл, на который больше никто не ссылается, удаляется вместе с копиями, записанными в мем"""
+    replaced = await utils.create_meme(meme_repo, store, b'old image')
+    variant_key: str = repositories.FileService().derivative_key(replaced.file_key, '1.gif')
+    store.put_object(settings.minio.STORAGE_BUCKET, variant_key, io.BytesIO(b'variant'), 7, 'image/gif')
+    await meme_repo.set_variants(replaced.id, replaced.file_key, {'1.gif': variant_key})
+    try:
+        async with private_client:
+            response = await private_client.put(f'/api/v1/memes/{replaced.id}', params=_put_params(),
+                                                files={'file': ('meme.png', b'new image', 'image/png')})
+    finally:
+        await meme_repo.delete_memes(ids=[replaced.id])
+    assert response.status_code == 200
+    assert response.json()['file_key'] in store._objects
+    assert replaced.file_key not in store._objects
+    assert variant_key not in store._objects
+
+
+@pytest.mark.private
+@pytest.mark.anyio
+async def test_put_missing_meme(private_client, store):
+    """Файл, загруженный для несуществующего мема, удаляется"""
+    async with private_client:
+        orphan = await private_client.put('/api/v1/memes/0', params=_put_params(),
+                                          files={'file': ('meme.png', b'orphan image', 'image/png')})
+        unauthorized = await private_client.put('/api/v1/memes/0', params=_put_params(),
+                                                files={'file': ('meme.png', b'orphan image', 'image/png')},
+                                                headers={'Authorization': 'Bearer wrong'})
+    assert orphan.status_code == 404
+    assert hashlib.sha256(b'orphan image').hexdigest() not in store._objects
+    assert unauthorized.status_code == 401
+
+
+@pytest.mark.private
+@pytest.mark.anyio
+async def test_put_missing_meme_shared_file(private_client, meme_repo, store):
+    """Файл, загруженный для несуществующего мема, но уже используемый другим мемом, остается в хранилище"""
+    existing = await utils.create_meme(meme_repo, store, b'used image')
+    try:
+        async with private_client:
+            response = await private_client.put('/api/v1/memes/0', params=_put_params(),
+                                                files={'file': ('meme.png', b'used image', 'image/png')})
+            remaining = await meme_repo.get_meme_by_id(existing.id)
+    finally:
+        await meme_repo.delete_memes(ids=[existing.id])
+    assert response.status_code == 404
+    assert remaining.file_key == existing.file_key
+    assert store.get_object(settings.minio.STORAGE_BUCKET, existing.file_key).read() == b'used image'
+
+
+@pytest.mark.private
+@pytest.mark.anyio
+async def test_put_meme_storage_error(private_client, meme_repo, store, monkeypatch):
+    """Ошибка хранилища при загрузке нового файла - 500, мем не меняется"""
+    meme = await utils.create_meme(meme_repo, store, b'kept image')
+    utils.fail_once(monkeypatch, repositories.FileService, 'upload_file', repositories.FileService.DBConstrainException())
+    try:
+        async with private_client:
+            response = await private_client.put(f'/api/v1/memes/{meme.id}', params=_put_params(),
+                                                files={'file': ('meme.png', b'new image', 'image/png')})
+            kept = await meme_repo.get_meme_by_id(meme.id)
+    finally:
+        await meme_repo.delete_memes(ids=[meme.id])
+    assert response.status_code == 500
+    assert response.json()['detail'] == repositories.FileService.DBConstrainException.message
+    assert (kept.title, kept.file_key) == ('title', meme.file_key)
+
+
+@pytest.mark.private
+@pytest.mark.anyio
+async def test_unauthorized_not_admitted(private_client, monkeypatch):
+    """Запрос без ключа администратора получает 401, не занимая и не ожидая слота ограничителя"""
+    limiter = admission.get_limiter('upload')
+    monkeypatch.setattr(limiter, 'limit', 1)
+    monkeypatch.setattr(limiter, 'queue_size', 0)
+    rejected_before: int = limiter.rejected
+    async with private_client:
+        await limiter.acquire()
+        try:
+            unauthorized = await private_client.put('/api/v1/memes/0', params=_put_params(),
+                                                    files={'file': ('meme.png', b'image', 'image/png')},
+                                                    headers={'Authorization': 'Bearer wrong'})
+            shed = await private_client.put('/api/v1/memes/0', params=_put_params(),
+                                            files={'file': ('meme.png', b'image', 'image/png')})
+        finally:
+            limiter.release()
+    assert unauthorized.status_code == 401
+    assert shed.status_code == 503
+    assert limiter.rejected == rejected_before + 1
+    assert limiter.in_flight == 0
+
+@pytest.mark.private
+@pytest.mark.anyio
+async def test_bulk_delete_memes(private_client, meme_repo, store):
+    """Результат по каждому id, файл мема, который пережил удаление, остается, файл без ссылок удаляется"""
+    shared = await utils.create_meme(meme_repo, store, b'shared image')
+    survivor = await utils.create_meme(meme_repo, store, b'shared image')
+    single = await utils.create_meme(meme_repo, store, b'single image')
+    try:
+        async with private_client:
+            response = await private_client.post('/api/v1/memes/bulk-delete',
+                                                 json={'ids': [shared.id, single.id, 0]})
+            too_many = await private_client.post(
+                '/api/v1/memes/bulk-delete', json={'ids': list(range(settings.web_private.BULK_DELETE_MAX_SIZE + 1))})
+            remaining = await meme_repo.get_meme_by_id(survivor.id)
+    finally:
+        await meme_repo.delete_memes(ids=[shared.id, survivor.id, single.id])
+    assert response.status_code == 200
+    assert sorted((item['id'], item['deleted'], item['error']) for item in response.json()) == [
+        (0, False, meme_repo.NothingFoundException.message),
+        (shared.id, True, None),
+        (single.id, True, None),
+    ]
+    assert remaining.file_key == shared.file_key
+    assert store.get_object(settings.minio.STORAGE_BUCKET, shared.file_key).read() == b'shared image'
+    assert single.file_key not in store._objects
+    assert too_many.status_code == 413
+
+
+@pytest.mark.private
+@pytest.mark.anyio
+async def test_bulk_delete_by_filter(private_client, meme_repo, store, monkeypatch):
+    """По фильтру за запрос удаляется не больше BULK_DELETE_MAX_SIZE мемов, файл - с последним из них"""
+    web_private = settings.web_private.model_copy(update={'BULK_DELETE_MAX_SIZE': 2})
+    monkeypatch.setattr(private_endpoints, 'settings', settings.model_copy(update={'web_private': web_private}))
+    memes = [await utils.create_meme(meme_repo, store, b'filtered image') for _ in range(3)]
+    try:
+        async with private_client:
+            responses = [await private_client.post('/api/v1/memes/bulk-delete', json={'file_key': memes[0].file_key})
+                         for _ in range(3)]
+    finally:
+        await meme_repo.delete_memes(ids=[meme.id for meme in memes])
+    assert [[item['id'] for item in response.json()] for response in responses] == [
+        [memes[0].id, memes[1].id], [memes[2].id], []]
+    assert memes[0].file_key not in store._objects
+
+@pytest.mark.private
+@pytest.mark.anyio
+async def test_delete_meme_stored_variants(private_client, meme_repo, store):
+    """Удаляются копии, записанные в мем, даже если их размера больше нет в настройках"""
+    meme = await utils.create_meme(meme_repo, store, b'deleted image')
+    variant_key: str = repositories.FileService().derivative_key(meme.file_key, '1.gif')
+    store.put_object(settings.minio.STORAGE_BUCKET, variant_key, io.BytesIO(b'variant'), 7, 'image/gif')
+    await meme_repo.set_variants(meme.id, meme.file_key, {'1.gif': variant_key})
+    async with private_client:
+        deleted = await private_client.delete(f'/api/v1/memes/{meme.id}')
+        missing = await private_client.delete(f'/api/v1/memes/{meme.id}')
+    assert deleted.status_code == 200
+    assert missing.status_code == 404
+    assert meme.file_key not in store._objects
+    assert variant_key not in store._objects
@@ -1,8 +1,39 @@
+import functools
+import hashlib
+import importlib.util
+import inspect
+import io
+import os
+import signal
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from unittest import mock
+
+import anyio
+import anyio.to_process
 import pytest
+import sqlalchemy as sa
+from minio import Minio
+from minio.datatypes import Part
+from PIL import Image
+from sqlalchemy.ext.asyncio import create_async_engine
 
-from src.core import models
+from src.benchmarks.fakes import FakeObjectStore
+from src.config import get_settings
+from src.core import admission, derivatives, models, repositories, schemas
+from src.public.api.v1 import endpoints
+from src.public.app import app as public_app
+from src import server, worker
+from src.storages import local, postgres
 from src.tests import utils
 
+settings = get_settings()
+
+IMPORT_BUDGET_SECONDS = 5
+
 
 @pytest.mark.public
 @pytest.mark.anyio
@@ -11,7 +42,74 @@ async def test_get_meme(client, meme_factory):
     async with client:
         response = await client.get(f'/api/v1/memes/{sa_object.id}')
     assert response.status_code == 200
-    assert response.json() == {**data, 'id': sa_object.id}
+    assert response.json() == utils.meme_json(sa_object, data)
+
+@pytest.mark.public
+@pytest.mark.anyio
+async def test_meme_json_matches_schema(client, meme_factory):
+    """Мем, собранный на чтении без pydantic, сериализуется так же, как schemas.Meme: те же поля в том же порядке"""
+    sa_object, data = meme_factory(qty=1)[0]
+    expected: schemas.Meme = schemas.Meme.model_validate(sa_object).model_copy(
+        update={'url': repositories.FileService().get_url(data['file_key'])})
+    async with client:
+        response = await client.get(f'/api/v1/memes/{sa_object.id}')
+        page = await client.get('/api/v1/memes')
+        found = await client.get('/api/v1/memes/search', params={'q': data['title'].split()[0]})
+    assert response.content == expected.model_dump_json().encode()
+    for item in (page.json()['items'][0], found.json()['items'][0]):
+        assert list(item.items()) == list(expected.model_dump(mode='json').items())
+
+@pytest.mark.public
+@pytest.mark.anyio
+async def test_get_meme_cached(client, meme_repo, meme_factory):
+    sa_object, data = meme_factory(qty=1)[0]
+    async with client:
+        first = await client.get(f'/api/v1/memes/{sa_object.id}')
+        hits: int = meme_repo.cache.hits
+        second = await client.get(f'/api/v1/memes/{sa_object.id}')
+    assert first.json() == second.json() == utils.meme_json(sa_object, data)
+    assert meme_repo.cache.hits == hits + 1
+
+@pytest.mark.public
+@pytest.mark.anyio
+async def test_get_meme_cache_generation(meme_repo, meme_factory, monkeypatch):
+    """Мем, прочитанный до его сброса в кэше, после сброса в кэш не кладется"""
+    sa_object, data = meme_factory(qty=1)[0]
+    meme_repo.cache.clear()
+    read_rows = meme_repo._read_rows
+
+    async def read_then_invalidate(stmt):
+        rows = await read_rows(stmt)
+        # изменение мема закоммичено, пока шло чтение
+        meme_repo.cache.invalidate(sa_object.id)
+        return rows
+
+    monkeypatch.setattr(meme_repo, '_read_rows', read_then_invalidate)
+    stale = await meme_repo.get_meme_by_id(sa_object.id)
+    cached_stale = meme_repo.cache.get(sa_object.id)
+    monkeypatch.undo()
+    fresh = await meme_repo.get_meme_by_id(sa_object.id)
+    assert isinstance(stale, schemas.Meme)
+    assert stale.title == data['title']
+    assert cached_stale is None
+    assert meme_repo.cache.get(sa_object.id) is fresh
+
+
+@pytest.mark.public
+@pytest.mark.anyio
+async def test_get_meme_not_modified(client, meme_factory):
+    sa_object, data = meme_factory(qty=1)[0]
+    async with client:
+        response = await client.get(f'/api/v1/memes/{sa_object.id}')
+        etag: str = response.headers['etag']
+        not_modified = await client.get(f'/api/v1/memes/{sa_object.id}', headers={'If-None-Match': etag})
+        modified = await client.get(f'/api/v1/memes/{sa_object.id}', headers={'If-None-Match': '"stale"'})
+    assert response.headers['cache-control']
+    assert not_modified.status_code == 304
+    assert not_modified.content == b''
+    assert not_modified.headers['etag'] == etag
+    assert modified.status_code == 200
+    assert modified.json() == utils.meme_json(sa_object, data)
 
 @pytest.mark.public
 @pytest.mark.anyio
@@ -22,12 +120,587 @@ async def test_get_memes(client, meme_factory, qty):
         response = await client.get(f'/api/v1/memes')
     assert response.status_code == 200
     expected_data = {
-        'total': qty,
-        'page': 1,
-        'pages': qty//51 + 1,
-        'size': 50,
+        'total': None,
+        'next_cursor': None,
         'items': [
-            {**data, 'id': sa_object.id} for sa_object, data in memes_data
+            utils.meme_json(sa_object, data) for sa_object, data in memes_data
         ]
     }
     assert utils.ordered(response.json()) == utils.ordered(expected_data)
+
+
+@pytest.mark.public
+@pytest.mark.anyio
+async def test_get_memes_cursor(client, meme_factory):
+    memes_data: list[tuple[models.Meme, dict]] = meme_factory(qty=5)
+    pages, params = [], {'size': 2, 'with_total': True}
+    async with client:
+        while True:
+            response = await client.get('/api/v1/memes', params=params)
+            assert response.status_code == 200
+            pages.append(response.json())
+            if not pages[-1]['next_cursor']:
+                break
+            params = {'size': 2, 'cursor': pages[-1]['next_cursor']}
+        bad_cursor_response = await client.get('/api/v1/memes', params={'cursor': 'not-a-cursor'})
+    assert [len(page['items']) for page in pages] == [2, 2, 1]
+    assert pages[0]['total'] == 5
+    assert [item['id'] for page in pages for item in page['items']] == [sa_object.id for sa_object, _ in memes_data]
+    assert bad_cursor_response.status_code == 400
+
+
+@pytest.mark.public
+@pytest.mark.anyio
+async def test_search_memes(client, meme_factory):
+    memes_data: list[tuple[models.Meme, dict]] = meme_factory(qty=3)
+    sa_object, data = memes_data[1]
+    query: str = data['title'].split()[0]
+    pages, params = [], {'q': query, 'size': 1}
+    async with client:
+        while True:
+            response = await client.get('/api/v1/memes/search', params=params)
+            assert response.status_code == 200
+            pages.append(response.json())
+            if not pages[-1]['next_cursor']:
+                break
+            params = {'q': query, 'size': 1, 'cursor': pages[-1]['next_cursor']}
+        empty_query_response = await client.get('/api/v1/memes/search', params={'q': ''})
+    found: list[dict] = [item for page in pages for item in page['items']]
+    assert utils.meme_json(sa_object, data) in found
+    assert len({item['id'] for item in found}) == len(found)
+    assert empty_query_response.status_code == 422
+
+
+@pytest.mark.public
+@pytest.mark.anyio
+async def test_get_meme_file(client, meme_factory, store):
+    sa_object, data = meme_factory(qty=1)[0]
+    content: bytes = bytes(range(256)) * 1024
+    store.put_object(settings.minio.STORAGE_BUCKET, data['file_key'], io.BytesIO(content), len(content), 'image/png')
+    url: str = f'/api/v1/memes/{sa_object.id}/file'
+    async with client:
+        full = await client.get(url)
+        partial = await client.get(url, headers={'Range': 'bytes=100-199', 'If-Range': full.headers['etag']})
+        suffix = await client.get(url, headers={'Range': 'bytes=-10'})
+        stale = await client.get(url, headers={'Range': 'bytes=100-199', 'If-Range': '"stale"'})
+        not_satisfiable = await client.get(url, headers={'Range': f'bytes={len(content)}-'})
+        not_found = await client.get('/api/v1/memes/0/file')
+    assert full.status_code == 200
+    assert full.content == content
+    assert full.headers['content-type'] == 'image/png'
+    assert full.headers['content-length'] == str(len(content))
+    assert full.headers['accept-ranges'] == 'bytes'
+    assert partial.status_code == 206
+    assert partial.content == content[100:200]
+    assert partial.headers['content-range'] == f'bytes 100-199/{len(content)}'
+    assert suffix.status_code == 206
+    assert suffix.content == content[-10:]
+    assert stale.status_code == 200
+    assert stale.content == content
+    assert not_satisfiable.status_code == 416
+    assert not_satisfiable.headers['content-range'] == f'bytes */{len(content)}'
+    assert not_found.status_code == 404
+
+
+@pytest.mark.public
+@pytest.mark.anyio
+async def test_meme_variants(client, meme_repo, store, monkeypatch):
+    """
+    Фоновая задача строит копии и записывает их в мем, если файл мема за это время не поменялся.
+    ?variant= отдает копию, а если такой копии нет - оригинал
+    """
+    monkeypatch.setattr(derivatives, 'enabled', lambda: True)
+    # копии строятся в потоке, а не в пуле процессов, который пережил бы цикл событий теста
+    monkeypatch.setattr(anyio.to_process, 'run_sync', anyio.to_thread.run_sync)
+    image = io.BytesIO()
+    Image.new('RGB', (640, 480), 'red').save(image, format='PNG')
+    meme = await utils.create_meme(meme_repo, store, image.getvalue())
+    file_service = repositories.FileService()
+    variant_key: str = file_service.derivative_key(meme.file_key, '320.webp')
+    try:
+        await derivatives.process_meme(meme.id, meme.file_key, meme_repo, file_service)
+        processed = await meme_repo.get_meme_by_id(meme.id)
+        await meme_repo.set_variants(meme.id, file_key='replaced', variants={})
+        stale = await meme_repo.get_meme_by_id(meme.id)
+        async with client:
+            variant = await client.get(f'/api/v1/memes/{meme.id}/file', params={'variant': '320.webp'})
+            fallback = await client.get(f'/api/v1/memes/{meme.id}/file', params={'variant': '1.gif'})
+            variant_json = await client.get(f'/api/v1/memes/{meme.id}', params={'variant': '320.webp'})
+    finally:
+        await meme_repo.delete_meme_by_id(meme.id)
+    assert processed.variants == {'320.webp': variant_key}
+    assert stale.variants == processed.variants
+    assert variant.headers['content-type'] == 'image/webp'
+    assert variant.content == store.get_object(settings.minio.STORAGE_BUCKET, variant_key).read()
+    assert fallback.content == image.getvalue()
+    assert variant_json.json()['url'] == file_service.get_url(variant_key)
+
+
+@pytest.mark.public
+@pytest.mark.anyio
+async def test_post_meme_too_large(client, store, monkeypatch):
+    """Файл больше MAX_UPLOAD_SIZE отклоняется с 413 и не остается в хранилище"""
+    minio_settings = settings.minio.model_copy(update={'MAX_UPLOAD_SIZE': 1024})
+    monkeypatch.setattr(repositories, 'settings', settings.model_copy(update={'minio': minio_settings}))
+    params: dict = {'title': 'title', 'content': 'content'}
+    async with client:
+        created = await client.post('/api/v1/memes/', params=params,
+                                    files={'file': ('meme.png', b'x' * 1025, 'image/png')})
+        queued = await client.post('/api/v1/memes/jobs', params=params,
+                                   files={'file': ('meme.png', b'x' * 1025, 'image/png')})
+    assert created.status_code == queued.status_code == 413
+    assert created.json()['detail'] == repositories.FileService.FileTooLargeException.message
+    assert store._objects == {}
+
+
+@pytest.mark.public
+@pytest.mark.anyio
+async def test_post_meme_file_reaped(client, meme_repo, store, monkeypatch):
+    """Файл, удаленный как ни на что не ссылающийся между загрузкой и созданием мема, загружается заново"""
+    upload_file = repositories.FileService.upload_file
+
+    async def upload_then_reap(self, file):
+        etag, file_key = await upload_file(self, file)
+        # конкурирующее удаление мема с тем же файлом убирает его из хранилища
+        await meme_repo.reap_files([file_key], self.delete_files)
+        return etag, file_key
+
+    monkeypatch.setattr(repositories.FileService, 'upload_file', upload_then_reap)
+    content: bytes = b'reaped image'
+    async with client:
+        created = await client.post('/api/v1/memes/', params={'title': 'title', 'content': 'content'},
+                                    files={'file': ('meme.png', content, 'image/png')})
+        meme: dict = created.json()
+        try:
+            failed = await meme_repo.reap_files([meme['file_key']], repositories.FileService().delete_files)
+        finally:
+            await meme_repo.delete_meme_by_id(meme['id'])
+    assert created.status_code == 200
+    assert not failed
+    # на файл ссылается мем, поэтому reap_files его не удалил
+    assert store.get_object(settings.minio.STORAGE_BUCKET, meme['file_key']).read() == content
+
+
+@pytest.mark.public
+@pytest.mark.anyio
+async def test_post_memes_batch(client, meme_repo, store, monkeypatch):
+    """Мемы пакета создаются одним запросом, слишком большой файл отклоняется только для своего элемента"""
+    minio_settings = settings.minio.model_copy(update={'MAX_UPLOAD_SIZE': 1024})
+    monkeypatch.setattr(repositories, 'settings', settings.model_copy(update={'minio': minio_settings}))
+    async with client:
+        response = await client.post('/api/v1/memes/batch',
+                                     data={'titles': ['first', 'large', 'third'],
+                                           'contents': ['first', 'large', 'third']},
+                                     files=[('files', ('first.png', b'first image', 'image/png')),
+                                            ('files', ('large.png', b'x' * 1025, 'image/png')),
+                                            ('files', ('third.png', b'third image', 'image/png'))])
+        first, large, third = response.json()
+        created = [await meme_repo.get_meme_by_id(item['meme']['id']) for item in (first, third)]
+        await meme_repo.delete_memes(ids=[meme.id for meme in created])
+    assert response.status_code == 200
+    assert [(item['index'], item['error']) for item in (first, third)] == [(0, None), (2, None)]
+    assert [(meme.title, store.get_object(settings.minio.STORAGE_BUCKET, meme.file_key).read())
+            for meme in created] == [('first', b'first image'), ('third', b'third image')]
+    assert (large['index'], large['meme']) == (1, None)
+    assert large['error'] == repositories.FileService.FileTooLargeException.message
+    assert len(store._objects) == 2
+
+
+@pytest.mark.public
+@pytest.mark.anyio
+async def test_post_memes_batch_item_error(client, meme_repo, store, monkeypatch):
+    """Непредвиденная ошибка одного элемента пакета достается ему, остальные мемы создаются"""
+    upload_file = repositories.FileService.upload_file
+
+    async def upload_or_fail(self, file):
+        if file.filename == 'broken.png':
+            raise RuntimeError('unexpected')
+        return await upload_file(self, file)
+
+    monkeypatch.setattr(repositories.FileService, 'upload_file', upload_or_fail)
+    async with client:
+        response = await client.post('/api/v1/memes/batch',
+                                     data={'titles': ['first', 'second'], 'contents': ['first', 'second']},
+                                     files=[('files', ('meme.png', b'batch image', 'image/png')),
+                                            ('files', ('broken.png', b'broken image', 'image/png'))])
+        created, broken = response.json()
+        await meme_repo.delete_meme_by_id(created['meme']['id'])
+    assert response.status_code == 200
+    assert (created['index'], created['meme']['title'], created['error']) == (0, 'first', None)
+    assert (broken['index'], broken['meme']) == (1, None)
+    assert broken['error'] == repositories.FileService.DBConstrainException.message
+
+
+@pytest.mark.public
+@pytest.mark.anyio
+async def test_upload_by_parts(client, meme_repo, store):
+    first_part, last_part = b'a' * 5 * 1024 * 1024, b'b' * 1024
+    params: dict = {'title': 'title', 'content': 'content'}
+    async with client:
+        started = await client.post('/api/v1/memes/uploads', params=params)
+        url: str = f"/api/v1/memes/uploads/{started.json()['id']}"
+        # части загружаются в любом порядке, повтор части заменяет ее
+        await client.put(f'{url}/parts/2', content=b'broken')
+        await client.put(f'{url}/parts/2', content=last_part)
+        incomplete = await client.post(f'{url}/complete')
+        await client.put(f'{url}/parts/1', content=first_part)
+        state = await client.get(url)
+        completed = await client.post(f'{url}/complete')
+        meme: dict = completed.json()
+        try:
+            repeated = await client.post(f'{url}/complete')
+            late_part = await client.put(f'{url}/parts/3', content=last_part)
+            other_upload = await client.post('/api/v1/memes/uploads', params=params)
+            aborted_url: str = f"/api/v1/memes/uploads/{other_upload.json()['id']}"
+            await client.put(f'{aborted_url}/parts/1', content=last_part)
+            aborted = await client.delete(aborted_url)
+            after_abort = await client.get(aborted_url)
+        finally:
+            # мемы в тестовой БД переживают тест, а другие тесты ждут в ней только свои
+            await meme_repo.delete_meme_by_id(meme['id'])
+    assert started.status_code == 201
+    assert incomplete.status_code == 400
+    assert [(part['part_number'], part['size']) for part in state.json()['parts']] == [(1, len(first_part)),
+                                                                                       (2, len(last_part))]
+    assert completed.status_code == 200
+    assert (meme['title'], meme['content']) == ('title', 'content')
+    assert store.get_object(settings.minio.STORAGE_BUCKET, meme['file_key']).read() == first_part + last_part
+    assert repeated.json() == meme
+    assert late_part.status_code == 409
+    assert aborted.status_code == 204
+    assert after_abort.status_code == 404
+    assert not store._uploads
+
+
+@pytest.mark.public
+@pytest.mark.parametrize('client_class', [Minio, FakeObjectStore, local.LocalObjectStore])
+def test_multipart_client_signatures(client_class):
+    """Приватные методы multipart-загрузки клиента принимают аргументы в том виде, в каком их передает FileService"""
+    calls: dict[str, tuple] = {
+        '_create_multipart_upload': ('bucket', 'key', {'Content-Type': 'image/png'}),
+        '_upload_part': ('bucket', 'key', b'data', None, 'upload-id', 1),
+        '_complete_multipart_upload': ('bucket', 'key', 'upload-id', [Part(1, 'etag')]),
+        '_abort_multipart_upload': ('bucket', 'key', 'upload-id'),
+    }
+    for name, args in calls.items():
+        inspect.signature(getattr(client_class, name)).bind(None, *args)
+
+
+@pytest.mark.public
+@pytest.mark.anyio
+async def test_complete_upload_retry(client, meme_repo, store, monkeypatch):
+    """Завершение, сорвавшееся после сборки файла, открывает загрузку снова, и повтор создает мем"""
+    utils.fail_once(monkeypatch, repositories.MemeRepository, 'create', meme_repo.DBConstrainException())
+    async with client:
+        started = await client.post('/api/v1/memes/uploads', params={'title': 'title', 'content': 'content'})
+        url: str = f"/api/v1/memes/uploads/{started.json()['id']}"
+        await client.put(f'{url}/parts/1', content=b'image')
+        failed = await client.post(f'{url}/complete')
+        state = await client.get(url)
+        completed = await client.post(f'{url}/complete')
+        meme: dict = completed.json()
+        await meme_repo.delete_meme_by_id(meme['id'])
+    assert failed.status_code == 500
+    assert state.json()['status'] == models.UploadStatus.OPEN.value
+    assert completed.status_code == 200
+    assert store.get_object(settings.minio.STORAGE_BUCKET, meme['file_key']).read() == b'image'
+
+
+@pytest.mark.public
+@pytest.mark.anyio
+async def test_direct_upload(client, meme_repo, store):
+    async with client:
+        issued = await client.post('/api/v1/memes/direct-uploads', params={'content_type': 'image/png'})
+        policy: dict = issued.json()
+        not_image = await client.post('/api/v1/memes/direct-uploads', params={'content_type': 'text/html'})
+        params: dict = {'title': 'title', 'content': 'content', 'key': policy['key']}
+        not_uploaded = await client.post('/api/v1/memes/direct-uploads/complete', params=params)
+        # клиент отправляет форму с полями политики прямо в хранилище
+        store.put_object(settings.minio.STORAGE_BUCKET, policy['key'], io.BytesIO(b'image'), 5,
+                         content_type=policy['fields']['Content-Type'])
+        completed = await client.post('/api/v1/memes/direct-uploads/complete', params=params)
+        meme: dict = completed.json()
+        try:
+            repeated = await client.post('/api/v1/memes/direct-uploads/complete', params=params)
+            foreign = await client.post('/api/v1/memes/direct-uploads/complete',
+                                        params={**params, 'key': 'staging/other'})
+        finally:
+            await meme_repo.delete_meme_by_id(meme['id'])
+    assert issued.status_code == 201
+    assert policy['url'].endswith(f'/{settings.minio.STORAGE_BUCKET}')
+    assert {'key', 'policy', 'x-amz-signature'} <= policy['fields'].keys()
+    assert not_image.status_code == 422
+    assert not_uploaded.status_code == 404
+    assert completed.status_code == 200
+    assert (meme['title'], meme['file_key']) == ('title', policy['key'])
+    assert repeated.status_code == 409
+    assert foreign.status_code == 422
+
+
+@pytest.mark.public
+@pytest.mark.anyio
+async def test_upload_jobs(client, job_repo, meme_repo, store, monkeypatch):
+    """Очередь задач: захват с арендой, повтор после сбоя без повторного перевода файла, окончательный провал"""
+    file_service = repositories.FileService()
+    utils.fail_once(monkeypatch, repositories.MemeRepository, 'create', meme_repo.DBConstrainException())
+    params: dict = {'title': 'title', 'content': 'content'}
+    async with client:
+        queued = await client.post('/api/v1/memes/jobs', params=params,
+                                   files={'file': ('meme.png', b'queued image', 'image/png')})
+        job_id: int = queued.json()['id']
+        [job] = await job_repo.claim(limit=10)
+        leased = await job_repo.claim(limit=10)
+        extended: bool = await job_repo.extend_lease(job_id, attempt=job.attempts)
+        await worker.process_job(job, job_repo, meme_repo, file_service)
+        retried = await client.get(f'/api/v1/memes/jobs/{job_id}')
+        [job] = await job_repo.claim(limit=10)
+        await worker.process_job(job, job_repo, meme_repo, file_service)
+        done = await client.get(f'/api/v1/memes/jobs/{job_id}')
+        meme_id: int = done.json()['meme_id']
+        try:
+            meme = await meme_repo.get_meme_by_id(meme_id)
+            doomed = await client.post('/api/v1/memes/jobs', params=params,
+                                       files={'file': ('meme.png', b'doomed image', 'image/png')})
+            for _ in range(settings.jobs.MAX_ATTEMPTS):
+                [doomed_job] = await job_repo.claim(limit=10)
+                store.remove_object(settings.minio.STORAGE_BUCKET, doomed_job.staging_key)
+                await worker.process_job(doomed_job, job_repo, meme_repo, file_service)
+            failed = await client.get(f"/api/v1/memes/jobs/{doomed.json()['id']}")
+        finally:
+            await meme_repo.delete_meme_by_id(meme_id)
+    assert queued.status_code == 202
+    assert (job.id, job.status, job.attempts) == (job_id, models.UploadJobStatus.RUNNING.value, 2)
+    assert leased == []
+    assert extended
+    assert retried.json()['status'] == models.UploadJobStatus.PENDING.value
+    assert retried.json()['error']
+    # вторая попытка взяла файл, переведенный первой, и создала мем
+    assert job.file_key == meme.file_key
+    assert done.json()['status'] == models.UploadJobStatus.DONE.value
+    assert store.get_object(settings.minio.STORAGE_BUCKET, meme.file_key).read() == b'queued image'
+    assert job.staging_key not in store._objects
+    assert failed.json()['status'] == models.UploadJobStatus.FAILED.value
+    assert await job_repo.claim(limit=10) == []
+
+
+@pytest.mark.public
+@pytest.mark.anyio
+async def test_upload_job_lease_expired_on_last_attempt(client, job_repo, meme_repo, store):
+    """Задача, забранная снова после истечения аренды последней попытки, проваливается, не выполняясь еще раз"""
+    async with client:
+        queued = await client.post('/api/v1/memes/jobs', params={'title': 'title', 'content': 'content'},
+                                   files={'file': ('meme.png', b'expired image', 'image/png')})
+        job_id: int = queued.json()['id']
+        lease_expired = datetime.now(timezone.utc) - timedelta(seconds=settings.jobs.LEASE + 1)
+        async with job_repo.session_maker.begin() as session:
+            await session.execute(sa.update(models.UploadJob)
+                                  .where(models.UploadJob.id == job_id)
+                                  .values(status=models.UploadJobStatus.RUNNING.value,
+                                          attempts=settings.jobs.MAX_ATTEMPTS,
+                                          updated_at=lease_expired))
+        [job] = await job_repo.claim(limit=10)
+        await worker.process_job(job, job_repo, meme_repo, repositories.FileService())
+        failed = await client.get(f'/api/v1/memes/jobs/{job_id}')
+    assert job.attempts == settings.jobs.MAX_ATTEMPTS + 1
+    assert failed.json()['status'] == models.UploadJobStatus.FAILED.value
+    assert failed.json()['meme_id'] is None
+    assert store._objects == {}
+
+
+@pytest.mark.public
+@pytest.mark.anyio
+async def test_upload_job_status_errors(client, job_repo, meme_repo, store, monkeypatch, caplog):
+    """Ошибки БД при отметке задачи выполненной или проваленной пишутся в лог и не останавливают воркер"""
+    params: dict = {'title': 'title', 'content': 'content'}
+    async with client:
+        done = await client.post('/api/v1/memes/jobs', params=params,
+                                 files={'file': ('meme.png', b'done image', 'image/png')})
+        broken = await client.post('/api/v1/memes/jobs', params=params,
+                                   files={'file': ('meme.png', b'broken image', 'image/png')})
+        [broken_job] = [job for job in await job_repo.claim(limit=10) if job.id == broken.json()['id']]
+        # обе задачи снова в очереди, временного файла второй нет, поэтому она провалится
+        await job_repo.fail(done.json()['id'], error='', retry=True)
+        await job_repo.fail(broken_job.id, error='', retry=True)
+        store.remove_object(settings.minio.STORAGE_BUCKET, broken_job.staging_key)
+        utils.fail_once(monkeypatch, repositories.UploadJobRepository, 'complete', RuntimeError('database is gone'))
+        utils.fail_once(monkeypatch, repositories.UploadJobRepository, 'fail', RuntimeError('database is gone'))
+        try:
+            await worker.work(job_repo, meme_repo, repositories.FileService(), stop_when_empty=True)
+            states = [await client.get(f"/api/v1/memes/jobs/{job.json()['id']}") for job in (done, broken)]
+        finally:
+            await meme_repo.delete_memes(file_key=hashlib.sha256(b'done image').hexdigest())
+            for job in (done, broken):
+                await job_repo.fail(job.json()['id'], error='', retry=False)
+    # обе задачи остаются в работе до истечения аренды
+    assert [state.json()['status'] for state in states] == [models.UploadJobStatus.RUNNING.value] * 2
+    assert 'Could not mark upload job' in caplog.text
+    assert 'Could not record failure of upload job' in caplog.text
+
+
+@pytest.mark.public
+@pytest.mark.anyio
+async def test_local_storage(client, meme_repo, monkeypatch, tmp_path):
+    """Файлы в каталоге на диске: загрузка, отдача по подписанной ссылке и частями, удаление"""
+    store = local.LocalObjectStore(tmp_path, url_secret='secret', url_path='/api/v1/files')
+    monkeypatch.setattr(repositories.LocalFileService, 'client', store)
+    monkeypatch.setitem(public_app.dependency_overrides, endpoints.get_file_service,
+                        lambda: repositories.LocalFileService())
+    content: bytes = bytes(range(256)) * 64
+    async with client:
+        created = await client.post('/api/v1/memes/', params={'title': 'title', 'content': 'content'},
+                                    files={'file': ('meme.png', content, 'image/png')})
+        meme: dict = created.json()
+        try:
+            by_url = await client.get(meme['url'])
+            forged = await client.get(meme['url'].replace('signature=', 'signature=0'))
+            partial = await client.get(f"/api/v1/memes/{meme['id']}/file", headers={'Range': 'bytes=10-19'})
+            direct = await client.post('/api/v1/memes/direct-uploads')
+        finally:
+            await meme_repo.delete_meme_by_id(meme['id'])
+    path = store.path(settings.minio.STORAGE_BUCKET, meme['file_key'])
+    assert path.read_bytes() == content
+    assert path.is_relative_to(tmp_path / settings.minio.STORAGE_BUCKET / meme['file_key'][:2])
+    assert by_url.status_code == 200
+    assert by_url.content == content
+    assert by_url.headers['etag'] == f'"{meme["etag"]}"'
+    assert by_url.headers['content-type'] == 'image/png'
+    assert forged.status_code == 403
+    assert partial.status_code == 206
+    assert partial.content == content[10:20]
+    assert direct.status_code == 501
+    await repositories.LocalFileService().delete_files([meme['file_key']])
+    assert not path.exists()
+
+
+@pytest.mark.public
+@pytest.mark.anyio
+async def test_admission_control(client, monkeypatch):
+    """Переполненная группа загрузок сразу отвечает 503, чтение при этом обслуживается"""
+    limiter = admission.get_limiter('upload')
+    monkeypatch.setattr(limiter, 'limit', 1)
+    monkeypatch.setattr(limiter, 'queue_size', 0)
+    rejected_before: int = limiter.rejected
+    async with client:
+        await limiter.acquire()
+        try:
+            shed = await client.post('/api/v1/memes/', params={'title': 'title', 'content': 'content'},
+                                     files={'file': ('meme.jpg', b'image', 'image/jpeg')})
+            read = await client.get('/api/v1/memes')
+            stats = await client.get(settings.web_app.STATS_PATH, headers=utils.admin_headers())
+        finally:
+            limiter.release()
+    assert shed.status_code == 503
+    assert shed.headers['retry-after'] == str(settings.admission.RETRY_AFTER)
+    assert read.status_code == 200
+    assert stats.json()['admission']['upload']['rejected'] == rejected_before + 1
+    assert limiter.in_flight == 0
+
+
+@pytest.mark.public
+@pytest.mark.anyio
+async def test_metrics(client, meme_factory):
+    """Метрики и статистика отдаются только с ключом администратора"""
+    sa_object, _ = meme_factory(qty=1)[0]
+    async with client:
+        await client.get(f'/api/v1/memes/{sa_object.id}')
+        response = await client.get(settings.metrics.PATH, headers=utils.admin_headers())
+        anonymous = [await client.get(path) for path in (settings.metrics.PATH, settings.web_app.STATS_PATH)]
+        wrong_key = await client.get(settings.metrics.PATH, headers={'Authorization': 'Bearer wrong'})
+    assert [response.status_code for response in anonymous] == [403, 403]
+    assert wrong_key.status_code == 401
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/plain')
+    assert 'http_request_duration_seconds_count{app="public",method="GET",route="/api/v1/memes/{meme_id}",status="200"}' \
+           in response.text
+
+
+@pytest.mark.public
+@pytest.mark.anyio
+async def test_read_replicas(client, meme_repo, meme_factory):
+    """Чтения идут на исправную реплику, недоступная выводится из оборота, после записи читается основная БД"""
+    meme_factory(qty=2)
+    async with client:
+        replica = create_async_engine(meme_repo._engine.url)
+        dead_replica = create_async_engine('sqlite+aiosqlite:///./no-such-dir/replica.db')
+        replica_statements: list[str] = []
+        sa.event.listen(replica.sync_engine, 'before_cursor_execute',
+                        lambda conn, cursor, statement, *args: replica_statements.append(statement))
+        replicas = postgres.ReplicaSet([dead_replica, replica])
+        primary_only, meme_repo.replicas = meme_repo.replicas, replicas
+        try:
+            responses = [await client.get('/api/v1/memes', params={'size': 1}) for _ in range(3)]
+            replica_reads: int = len(replica_statements)
+            with postgres.read_your_writes_scope():
+                async with meme_repo.session_maker.begin() as session:
+                    await session.execute(sa.update(models.Meme).where(models.Meme.id == -1).values(title=''))
+                await meme_repo.get_memes_page(limit=1)
+                reads_after_write: int = len(replica_statements)
+            with postgres.read_your_writes_scope():  # следующий запрос
+                await meme_repo.get_memes_page(limit=1)
+        finally:
+            meme_repo.replicas = primary_only
+            await replica.dispose()
+            await dead_replica.dispose()
+    assert [response.status_code for response in responses] == [200, 200, 200]
+    assert [status['healthy'] for status in replicas.status()] == [False, True]
+    assert replica_reads >= 2
+    assert reads_after_write == replica_reads
+    assert len(replica_statements) > reads_after_write
+
+
+@pytest.mark.public
+@pytest.mark.anyio
+async def test_worker_rss_recycle(monkeypatch):
+    """Воркер, выросший по памяти, останавливается по SIGTERM, а начавший сверх предела - нет"""
+    monkeypatch.setattr(server, 'settings', settings.model_copy(
+        update={'web_server': settings.web_server.model_copy(update={'MAX_WORKER_RSS_MB': 200})}))
+    signals: list[tuple[int, int]] = []
+    monkeypatch.setattr(server.os, 'kill', lambda pid, sig: signals.append((pid, sig)))
+
+    async def notify(target: server.Worker, rss: list[float]) -> None:
+        for current in rss:
+            monkeypatch.setattr(server, 'rss_mb', lambda: current)
+            await target.callback_notify()
+
+    def new_worker() -> server.Worker:
+        # без __init__: конфигурация gunicorn и приложение для проверки не нужны
+        instance = server.Worker.__new__(server.Worker)
+        instance.pid, instance.tmp = 1, mock.Mock()
+        instance._recycling, instance._started_rss = False, None
+        return instance
+
+    growing, oversized = new_worker(), new_worker()
+    await notify(growing, [100, 150, 250, 300])
+    await notify(oversized, [250, 300])
+    assert signals == [(1, signal.SIGTERM)]
+    assert growing.tmp.notify.call_count == 4
+    assert oversized._recycling
+
+
+@pytest.mark.public
+def test_post_fork_disposes_inherited_engine(monkeypatch):
+    """post_fork бросает соединения движка, созданного в мастере, и не создает движок, если его не было"""
+    spec = importlib.util.spec_from_file_location('gunicorn_conf', Path(__file__).parents[2] / 'gunicorn.conf.py')
+    gunicorn_conf = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(gunicorn_conf)
+    engine = mock.Mock()
+    monkeypatch.setattr(postgres, 'get_engine', functools.cache(lambda: engine))
+    gunicorn_conf.post_fork(server=None, worker=None)
+    assert postgres.get_engine.cache_info().currsize == 0
+    postgres.get_engine()
+    gunicorn_conf.post_fork(server=None, worker=None)
+    engine.sync_engine.dispose.assert_called_once_with(close=False)
+
+
+@pytest.mark.public
+def test_import_is_side_effect_free():
+    """Импорт приложений не создает ни движок БД, ни клиент хранилища и укладывается в бюджет времени"""
+    code: str = ('import src.public.app, src.private.app\n'
+                 'from src.storages import minio, postgres\n'
+                 'print(postgres.get_engine.cache_info().currsize, minio.get_client.cache_info().currsize)')
+    started: float = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', code], cwd=Path(__file__).parents[3], env=os.environ,
+                            capture_output=True, text=True, check=True)
+    elapsed: float = time.perf_counter() - started
+    assert result.stdout.split() == ['0', '0']
+    assert elapsed < IMPORT_BUDGET_SECONDS
@@ -1,3 +1,22 @@
+import hashlib
+import io
+
+from src.config import get_settings
+from src.core import models, repositories, schemas
+
+settings = get_settings()
+
+
+def admin_headers() -> dict:
+    """Заголовок с ключом администратора: приватный API, статистика и метрики"""
+    return {'Authorization': f'Bearer {settings.web_private.API_KEY}'}
+
+
+def meme_json(sa_object: models.Meme, data: dict) -> dict:
+    """Ожидаемое представление мема в ответе API: ссылка на файл подписывается при чтении"""
+    return {**data, 'id': sa_object.id, 'url': repositories.FileService().get_url(data['file_key'])}
+
+
 def ordered(obj):
     """Рекуррентно приводит json в сортированный вид"""
     if isinstance(obj, dict):
@@ -6,3 +25,25 @@ def ordered(obj):
         return sorted(ordered(x) for x in obj)
     else:
         return obj
+
+
+async def create_meme(meme_repo: repositories.MemeRepository, store, content: bytes) -> schemas.Meme:
+    """Кладет файл в хранилище store и создает мем на него через репозиторий, со ссылкой на файл"""
+    file_key: str = hashlib.sha256(content).hexdigest()
+    etag: str = store.put_object(settings.minio.STORAGE_BUCKET, file_key, io.BytesIO(content), len(content),
+                                 'image/png').etag
+    meme = schemas.MemeEnriched(title='title', content='content', etag=etag, file_key=file_key)
+    return await meme_repo.create(meme, as_pd=True)
+
+
+def fail_once(monkeypatch, cls: type, name: str, exception: Exception) -> None:
+    """Подменяет асинхронный метод cls.name: первый вызов выбрасывает exception, следующие работают как обычно"""
+    method = getattr(cls, name)
+    failures: list[Exception] = [exception]
+
+    async def failing_once(self, *args, **kwargs):
+        if failures:
+            raise failures.pop()
+        return await method(self, *args, **kwargs)
+
+    monkeypatch.setattr(cls, name, failing_once)
@@ -0,0 +1,188 @@
+"""
+Воркер очереди асинхронной загрузки мемов. Заодно удаляет брошенные загрузки по частям и прямо в хранилище.
+Запуск: python -m src.worker
+"""
+import contextlib
+import logging
+from datetime import timedelta
+
+import anyio
+
+from src.config import get_settings
+from src.core import derivatives, models, repositories, schemas, startup
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+
+async def _keep_lease(job: models.UploadJob, job_repo: repositories.UploadJobRepository) -> None:
+    """Продлевает аренду задачи каждую треть settings.jobs.LEASE, пока задача выполняется"""
+    while True:
+        await anyio.sleep(settings.jobs.LEASE / 3)
+        if not await job_repo.extend_lease(job.id, attempt=job.attempts):
+            logger.warning('Upload job %s lease was lost, attempt %s', job.id, job.attempts)
+            return
+
+
+async def process_job(job: models.UploadJob,
+                      job_repo: repositories.UploadJobRepository,
+                      meme_repo: repositories.MemeRepository,
+                      file_service: repositories.FileService) -> None:
+    """
+    Переводит файл задачи под постоянный ключ, создает мем и отмечает задачу выполненной.
+    Пока задача выполняется, ее аренда продлевается, и другие воркеры ее не забирают
+    """
+    async with anyio.create_task_group() as task_group:
+        task_group.start_soon(_keep_lease, job, job_repo)
+        try:
+            await _run_job(job, job_repo, meme_repo, file_service)
+        finally:
+            task_group.cancel_scope.cancel()
+
+
+async def _run_job(job: models.UploadJob,
+                   job_repo: repositories.UploadJobRepository,
+                   meme_repo: repositories.MemeRepository,
+                   file_service: repositories.FileService) -> None:
+    if job.attempts > settings.jobs.MAX_ATTEMPTS:
+        # задачу забрали снова после истечения аренды: воркер последней попытки не отчитался (например, упал)
+        await _fail_job(job, job.file_key, 'Lease expired on the last attempt', False,
+                        job_repo, meme_repo, file_service)
+        return
+    # файл могла перевести прошлая попытка: временный файл остается до создания мема, и ensure_promoted
+    # скопирует его снова, если постоянный успели удалить
+    etag, file_key = job.etag, job.file_key
+    try:
+        if file_key is None:
+            etag, file_key = await file_service.promote_staged(job.staging_key)
+            await job_repo.set_file(job.id, etag=etag, file_key=file_key)
+        meme = schemas.MemeEnriched(title=job.title, content=job.content, etag=etag, file_key=file_key)
+        created_meme: schemas.Meme = await meme_repo.create(
+            meme, as_pd=True, before_commit=lambda: file_service.ensure_promoted(job.staging_key, file_key))
+    except Exception as _exc:  # noqa
+        logger.exception('Upload job %s failed, attempt %s', job.id, job.attempts)
+        await _fail_job(job, file_key, str(_exc) or type(_exc).__name__, job.attempts < settings.jobs.MAX_ATTEMPTS,
+                        job_repo, meme_repo, file_service)
+        return
+    try:
+        await job_repo.complete(job.id, meme_id=created_meme.id)
+    except Exception:  # noqa
+        # задача остается в работе, временный файл - на месте: по истечении аренды ее заберут снова
+        logger.exception('Could not mark upload job %s done, meme %s', job.id, created_meme.id)
+        return
+    with contextlib.suppress(file_service.NothingFoundException):
+        await file_service.delete_file_by_name(name=job.staging_key)
+    await derivatives.process_meme(created_meme.id, file_key, meme_repo, file_service)
+
+
+async def _fail_job(job: models.UploadJob,
+                    file_key: str | None,
+                    error: str,
+                    retry: bool,
+                    job_repo: repositories.UploadJobRepository,
+                    meme_repo: repositories.MemeRepository,
+                    file_service: repositories.FileService) -> None:
+    """
+    Возвращает задачу в очередь или помечает проваленной. У проваленной задачи удаляются временный файл и
+    постоянный file_key, если на него так и не сослался ни один мем. Ошибки БД и хранилища пишутся в лог, а не
+    прерывают цикл воркера
+    """
+    try:
+        await job_repo.fail(job.id, error=error, retry=retry)
+        if retry:
+            return
+        with contextlib.suppress(file_service.NothingFoundException):
+            await file_service.delete_file_by_name(name=job.staging_key)
+        if file_key is not None:
+            await meme_repo.reap_files([file_key], file_service.delete_files)
+    except Exception:  # noqa
+        logger.exception('Could not record failure of upload job %s', job.id)
+
+
+async def work(job_repo: repositories.UploadJobRepository,
+               meme_repo: repositories.MemeRepository,
+               file_service: repositories.FileService,
+               stop_when_empty: bool = False) -> None:
+    """Цикл одного обработчика: забирает по задаче, пока они есть, иначе ждет settings.jobs.POLL_INTERVAL"""
+    while True:
+        jobs: list[models.UploadJob] = await job_repo.claim(limit=1)
+        if not jobs:
+            if stop_when_empty:
+                return
+            await anyio.sleep(settings.jobs.POLL_INTERVAL)
+            continue
+        for job in jobs:
+            await process_job(job, job_repo, meme_repo, file_service)
+
+
+async def drain(concurrency: int = None, stop_when_empty: bool = False) -> None:
+    """Разбирает очередь concurrency обработчиками одновременно"""
+    job_repo = repositories.UploadJobRepository()
+    meme_repo = repositories.MemeRepository()
+    file_service = repositories.get_file_service()
+    async with anyio.create_task_group() as task_group:
+        for _ in range(concurrency or settings.jobs.CONCURRENCY):
+            task_group.start_soon(work, job_repo, meme_repo, file_service, stop_when_empty)
+
+
+async def clean_uploads(upload_repo: repositories.UploadRepository,
+                        file_service: repositories.FileService,
+                        stop_when_empty: bool = False,
+                        batch: int = 100) -> None:
+    """
+    Удаляет загрузки по частям, не менявшиеся дольше settings.uploads.TTL: прерывает их multipart-загрузки
+    в хранилище и удаляет собранные, но не переведенные в постоянные файлы.
+    Проверяет раз в settings.uploads.CLEANUP_INTERVAL
+    """
+    while True:
+        ttl = timedelta(seconds=settings.uploads.TTL)
+        uploads: list[models.Upload] = await upload_repo.delete_stale(older_than=ttl, limit=batch)
+        for upload in uploads:
+            if upload.status == models.UploadStatus.DONE.value:
+                continue
+            try:
+                await file_service.abort_multipart(upload.object_key, upload.s3_upload_id)
+                with contextlib.suppress(file_service.NothingFoundException):
+                    await file_service.delete_file_by_name(name=upload.object_key)
+            except file_service.DBConstrainException:
+                logger.warning('Could not clean up upload %s in storage', upload.id)
+        if len(uploads) < batch:
+            if stop_when_empty:
+                return
+            await anyio.sleep(settings.uploads.CLEANUP_INTERVAL)
+
+
+async def clean_direct_uploads(meme_repo: repositories.MemeRepository,
+                               file_service: repositories.FileService,
+                               stop_when_empty: bool = False) -> None:
+    """
+    Удаляет файлы, загруженные прямо в хранилище, по которым за settings.uploads.TTL так и не создали мем.
+    Проверяет раз в settings.uploads.CLEANUP_INTERVAL
+    """
+    while True:
+        try:
+            keys: list[str] = await file_service.stale_direct_uploads(timedelta(seconds=settings.uploads.TTL))
+            if await meme_repo.reap_files(keys, file_service.delete_files):
+                logger.warning('Could not delete some of %s abandoned direct uploads', len(keys))
+        except file_service.DBConstrainException:
+            logger.warning('Could not list direct uploads in storage')
+        if stop_when_empty:
+            return
+        await anyio.sleep(settings.uploads.CLEANUP_INTERVAL)
+
+
+async def serve() -> None:
+    await startup.warm_up(repositories.UploadJobRepository(), repositories.get_file_service())
+    async with anyio.create_task_group() as task_group:
+        task_group.start_soon(clean_uploads, repositories.UploadRepository(), repositories.get_file_service())
+        task_group.start_soon(clean_direct_uploads, repositories.MemeRepository(), repositories.get_file_service())
+        task_group.start_soon(drain)
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO)
+    anyio.run(serve)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,18 @@
 #!/bin/sh
+# start.sh migrate                 - применить миграции, один раз на развертывание
+# start.sh <порт> <приложение>     - боевой режим: gunicorn с воркерами uvicorn (src/gunicorn.conf.py)
+# start.sh --reload <порт> <прил.> - разработка: один процесс uvicorn с перезагрузкой при изменении кода
+set -e
 
 cd /app/src
-alembic upgrade head
-uvicorn --host 0.0.0.0 --port $1 --reload $2
+case "$1" in
+  migrate)
+    exec alembic upgrade head
+    ;;
+  --reload)
+    exec uvicorn --host 0.0.0.0 --port "$2" --reload "$3"
+    ;;
+  *)
+    exec gunicorn --config gunicorn.conf.py --bind "0.0.0.0:$1" "$2"
+    ;;
+esac